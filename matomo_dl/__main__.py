@@ -1,16 +1,35 @@
+import json
 import logging
+import os
 import pathlib
+import sys
+import typing as typ
+from contextlib import ExitStack, redirect_stdout
 
 import click
 import click_log
 
 from matomo_dl import __version__
-from matomo_dl.bundle import build_release
+from matomo_dl.bundle import DEFAULT_BUILD_JOBS, ReleaseOutput, build_release
+from matomo_dl.bundle.artifacts import (
+    DEFAULT_FETCH_JOBS,
+    fetch_artifacts,
+    lock_artifacts,
+)
+from matomo_dl.bundle.formats import (
+    DEFAULT_FORMAT,
+    FORMATS,
+    ArchiveFormat,
+    infer_format,
+)
+from matomo_dl.bundle.tree_cache import TreeCache
 from matomo_dl.distribution.load_save import (
     diff_lockfiles,
     load_from_distribution_path,
+    load_lockfile,
     write_lockfile_using_distribution_path,
 )
+from matomo_dl.distribution.lock import DistributionLockFile, lock_hashes
 from matomo_dl.errors import MatomoError
 from matomo_dl.lock.general import build_lock
 from matomo_dl.session import (
@@ -18,7 +37,12 @@ from matomo_dl.session import (
     DEFAULT_CACHE_LEVEL,
     SessionStore,
     create_session,
+    standardise_size,
 )
+from matomo_dl.session import maintenance
+from matomo_dl.session.blobs import BlobStore
+from matomo_dl.session.metrics import format_size
+from matomo_dl.session.mirror import create_cache_server
 
 logger = logging.getLogger(__name__)
 click_log.basic_config()
@@ -30,6 +54,14 @@ cache_level_choices = sorted(
 )
 
 
+def parse_size(ctx, param, value: typ.Optional[str]) -> typ.Optional[int]:
+    # Parsed here, so only its own mistakes are reported against the option.
+    try:
+        return standardise_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.group()
 @click.version_option(version=__version__)
 @click_log.simple_verbosity_option(logging.root)
@@ -49,12 +81,57 @@ cache_level_choices = sorted(
     show_envvar=True,
 )
 @click.option("--clear", "cache_clear", is_flag=True, default=False)
+@click.option("--paranoid", "paranoid", is_flag=True, default=False)
+@click.option("--offline", "offline", is_flag=True, default=False, show_envvar=True)
+@click.option("--cache-upstream", "cache_upstream", default=None, show_envvar=True)
+@click.option(
+    "--cache-layer",
+    "cache_layers",
+    multiple=True,
+    type=click.Path(exists=True, file_okay=False),
+    show_envvar=True,
+)
+@click.option("--cache-promote", "cache_promote", is_flag=True, default=False)
+@click.option("--tree-cache", "tree_cache", is_flag=True, default=False)
+@click.option(
+    "--cache-max-size",
+    "cache_max_size",
+    default=None,
+    callback=parse_size,
+    envvar="MATOMO_DL_CACHE_MAX_SIZE",
+    show_envvar=True,
+)
 @click.pass_context
-def cli(ctx, cache_dir: str, cache_level: str, cache_clear: bool):
+def cli(
+    ctx,
+    cache_dir: str,
+    cache_level: str,
+    cache_clear: bool,
+    paranoid: bool,
+    cache_max_size: typ.Optional[int],
+    offline: bool,
+    cache_upstream: typ.Optional[str],
+    cache_layers: typ.Tuple[str, ...],
+    cache_promote: bool,
+    tree_cache: bool,
+):
     ctx.ensure_object(dict)
+    if offline and not (cache_dir or cache_layers):
+        raise click.BadParameter(
+            "An offline build needs a cache directory", param_hint="--offline"
+        )
 
     ctx.obj["session"] = create_session(
-        cache_dir=cache_dir, level=cache_level, clear=cache_clear
+        cache_dir=cache_dir,
+        level=cache_level,
+        clear=cache_clear,
+        paranoid=paranoid,
+        max_size=cache_max_size,
+        offline=offline,
+        upstream=cache_upstream,
+        layers=cache_layers,
+        promote=cache_promote,
+        tree_cache=tree_cache,
     )
 
 
@@ -82,6 +159,8 @@ def update(ctx, distribution_file, dry, diff):
             + " 🛑"
         )
         return ctx.exit(2)
+    finally:
+        click.echo("📊 " + session.metrics.summary())
     if new_lock != lock:
         if diff:
             diff_lockfiles(lock, new_lock)
@@ -96,6 +175,42 @@ def update(ctx, distribution_file, dry, diff):
         click.secho("✨ Already up to date ✨", fg="green")
 
 
+def open_build_output(
+    ctx,
+    output_file: str,
+    output_fd: typ.Optional[int],
+    archive_format: typ.Optional[str],
+) -> typ.Tuple[ArchiveFormat, ReleaseOutput, typ.ContextManager]:
+    output: ReleaseOutput
+    stdout_redirect: typ.ContextManager = ExitStack()
+    if output_fd is not None or output_file == "-":
+        try:
+            output = (
+                sys.stdout.buffer
+                if output_fd is None
+                else os.fdopen(output_fd, "wb", closefd=False)
+            )
+        except OSError as e:
+            raise click.BadParameter(str(e), param_hint="'--output-fd'")
+        if output.isatty():
+            click.secho("⛔ Not writing an archive to a terminal ⛔", fg="yellow")
+            click.echo("Redirect the output to a file or pipe.")
+            ctx.exit(1)
+        fmt = FORMATS[archive_format] if archive_format else DEFAULT_FORMAT
+        if output_fd in (None, 1):
+            # The archive is written to stdout; so everything else goes to
+            #  stderr, progress bars included.
+            stdout_redirect = redirect_stdout(sys.stderr)
+    elif archive_format is None:
+        try:
+            fmt, output = infer_format(pathlib.Path(output_file))
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint="'--output'")
+    else:
+        fmt, output = FORMATS[archive_format], pathlib.Path(output_file)
+    return fmt, output, stdout_redirect
+
+
 @cli.command()
 @click.option(
     "--fail-if-updates/--no-fail-if-updates", "-f/ ", "fail_if_updates", default=False
@@ -108,45 +223,142 @@ def update(ctx, distribution_file, dry, diff):
     "-o",
     "output_file",
     default="./matomo.tar.gz",
+    type=click.Path(exists=False, resolve_path=True, dir_okay=False, allow_dash=True),
+)
+@click.option("--output-fd", "output_fd", default=None, type=click.IntRange(min=0))
+@click.option(
+    "--build-json",
+    "build_json_file",
+    default=None,
     type=click.Path(exists=False, resolve_path=True, dir_okay=False),
 )
+@click.option(
+    "--format",
+    "archive_format",
+    default=None,
+    type=click.Choice(sorted(FORMATS)),
+)
+@click.option("--compression-level", "compresslevel", default=None, type=int)
+@click.option("--fast/--no-fast", "fast", default=False)
+@click.option(
+    "--jobs", "-j", "jobs", default=DEFAULT_BUILD_JOBS, type=click.IntRange(min=1)
+)
+@click.argument(
+    "distribution_file",
+    default="./distribution.toml",
+    type=click.Path(exists=True, resolve_path=True, dir_okay=False),
+)
+@click.pass_context
+def build(
+    ctx,
+    distribution_file,
+    output_file,
+    output_fd,
+    build_json_file,
+    archive_format,
+    compresslevel,
+    fast,
+    jobs,
+    update_locks,
+    fail_if_updates,
+):
+    fmt, output, stdout_redirect = open_build_output(
+        ctx, output_file, output_fd, archive_format
+    )
+    try:
+        compresslevel = fmt.compression_level(compresslevel, fast=fast)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="'--compression-level'")
+
+    with stdout_redirect:
+        update_kws = {}
+        if update_locks is True:
+            update_kws["diff"] = True
+            update_kws["dry"] = False
+        if fail_if_updates is True:
+            update_kws["diff"] = True
+            update_kws["dry"] = True
+        if update_kws:
+            click.secho("🔄 Checking for updates before building 🔄")
+            ctx.invoke(update, distribution_file=distribution_file, **update_kws)
+
+        click.secho("  Building your distribution  ")
+        session = ctx.obj["session"]
+        assert isinstance(session, SessionStore)
+        distribution_file = pathlib.Path(distribution_file)
+        dist, lock = load_from_distribution_path(distribution_file)
+        if not lock:
+            click.secho(
+                "⛔ The distribution file hasn't been locked ⛔", fg="yellow", bold=True
+            )
+            click.echo("Add '--sync' to create one as part of the build.")
+            ctx.exit(1)
+        if lock.distribution_hash != dist.versioning_hash:
+            click.secho(
+                "⛔ The distribution file has changed ⛔", fg="yellow", bold=True
+            )
+            click.echo("Cowardly refusing to build from an outdated lock file.")
+            click.echo("Add '--sync' to perform an update.")
+            ctx.exit(1)
+        try:
+            session.set_pool_size(jobs * session.range_parts)
+            info = build_release(
+                session,
+                dist,
+                lock,
+                output,
+                jobs=jobs,
+                archive_format=fmt,
+                compresslevel=compresslevel,
+            )
+            click.secho("🎉 Built your distribution 🎉", fg="green")
+            session.enforce_cache_budget(keep=lock_hashes(lock))
+            click.echo("📊 " + session.metrics.summary())
+            if build_json_file:
+                # The archived `.build.json` must stay reproducible; so the
+                #  metrics only go into this copy.
+                build_json = {
+                    **info.to_output(),
+                    "metrics": session.metrics.to_output(),
+                }
+                pathlib.Path(build_json_file).write_text(json.dumps(build_json))
+        except MatomoError as e:
+            click.echo(
+                "💥 "
+                + click.style("Error: ", fg="red", bold=True)
+                + click.style(str(e), fg="red")
+                + " 💥"
+            )
+            return ctx.exit(2)
+
+
+@cli.command()
+@click.option(
+    "--jobs", "-j", "jobs", default=DEFAULT_FETCH_JOBS, type=click.IntRange(min=1)
+)
 @click.argument(
     "distribution_file",
     default="./distribution.toml",
     type=click.Path(exists=True, resolve_path=True, dir_okay=False),
 )
 @click.pass_context
-def build(ctx, distribution_file, output_file, update_locks, fail_if_updates):
-    update_kws = {}
-    if update_locks is True:
-        update_kws["diff"] = True
-        update_kws["dry"] = False
-    if fail_if_updates is True:
-        update_kws["diff"] = True
-        update_kws["dry"] = True
-    if update_kws:
-        click.secho("🔄 Checking for updates before building 🔄")
-        ctx.invoke(update, distribution_file=distribution_file, **update_kws)
-
-    click.secho("  Building your distribution  ")
+def fetch(ctx, distribution_file, jobs):
     session = ctx.obj["session"]
     assert isinstance(session, SessionStore)
+    if not session.cache_dir:
+        click.secho("⛔ There is no cache to fetch into ⛔", fg="yellow", bold=True)
+        click.echo("Add '--cache' to choose a cache directory.")
+        ctx.exit(1)
     distribution_file = pathlib.Path(distribution_file)
     dist, lock = load_from_distribution_path(distribution_file)
     if not lock:
         click.secho(
             "⛔ The distribution file hasn't been locked ⛔", fg="yellow", bold=True
         )
-        click.echo("Add '--sync' to create one as part of the build.")
-        ctx.exit(1)
-    if lock.distribution_hash != dist.versioning_hash:
-        click.secho("⛔ The distribution file has changed ⛔", fg="yellow", bold=True)
-        click.echo("Cowardly refusing to build from an outdated lock file.")
-        click.echo("Add '--sync' to perform an update.")
+        click.echo("Run 'update' to create one.")
         ctx.exit(1)
     try:
-        build_release(session, dist, lock, pathlib.Path(output_file))
-        click.secho("🎉 Built your distribution 🎉", fg="green")
+        fetched = fetch_artifacts(session, dist.license_key, lock, jobs=jobs)
     except MatomoError as e:
         click.echo(
             "💥 "
@@ -155,6 +367,166 @@ def build(ctx, distribution_file, output_file, update_locks, fail_if_updates):
             + " 💥"
         )
         return ctx.exit(2)
+    if fetched:
+        click.secho(f"✨ Fetched {len(fetched)} downloads ✨", fg="green", bold=True)
+    else:
+        click.secho("✨ Already fetched ✨", fg="green")
+
+
+@cli.command("serve-cache")
+@click.option("--host", "host", default="127.0.0.1", show_default=True)
+@click.option("--port", "-p", "port", default=8080, type=int, show_default=True)
+@click.pass_context
+def serve_cache(ctx, host, port):
+    session = ctx.obj["session"]
+    assert isinstance(session, SessionStore)
+    if session.cache_blobs is None:
+        click.secho("⛔ There is no cache to serve ⛔", fg="yellow", bold=True)
+        click.echo("Add '--cache' to choose a cache directory.")
+        ctx.exit(1)
+    server = create_cache_server(session.cache_blobs, host, port)
+    server_host, server_port = server.server_address[:2]
+    click.secho(
+        f"📡 Serving {session.cache_dir} on http://{server_host}:{server_port} 📡",
+        fg="green",
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def require_cache(ctx) -> BlobStore:
+    session = ctx.obj["session"]
+    assert isinstance(session, SessionStore)
+    if session.cache_blobs is None:
+        click.secho("⛔ There is no cache to manage ⛔", fg="yellow", bold=True)
+        click.echo("Add '--cache' to choose a cache directory.")
+        raise click.exceptions.Exit(1)
+    return session.cache_blobs
+
+
+def load_lockfiles(ctx, lockfiles: typ.Iterable[str]) -> typ.List[DistributionLockFile]:
+    locks = []
+    for lockfile in lockfiles:
+        lock = load_lockfile(pathlib.Path(lockfile))
+        if not lock:
+            click.secho(f"⛔ Cannot read the lock file {lockfile} ⛔", fg="yellow")
+            raise click.exceptions.Exit(1)
+        locks.append(lock)
+    return locks
+
+
+jobs_option = click.option(
+    "--jobs",
+    "-j",
+    "jobs",
+    default=maintenance.DEFAULT_JOBS,
+    type=click.IntRange(min=1),
+)
+lockfile_type = click.Path(exists=True, resolve_path=True, dir_okay=False)
+
+
+@cli.group()
+def cache():
+    pass
+
+
+@cache.command()
+@click.pass_context
+def stats(ctx):
+    blobs = require_cache(ctx)
+    cache_stats = maintenance.cache_stats(blobs)
+    click.echo(f"Cache: {blobs.folder}")
+    click.echo(
+        f"Blobs: {cache_stats.blob_count} ({format_size(cache_stats.total_size)})"
+    )
+    for name, count in cache_stats.ages.items():
+        label = "Older" if name == "older" else f"Used within {name}"
+        click.echo(f"  {label}: {count}")
+    tree_count, tree_size = TreeCache.for_blobs(blobs).usage()
+    click.echo(f"Extracted trees: {tree_count} ({format_size(tree_size)})")
+
+
+@cache.command()
+@jobs_option
+@click.pass_context
+def verify(ctx, jobs):
+    blobs = require_cache(ctx)
+    corrupt = maintenance.verify_blobs(blobs, jobs=jobs)
+    if corrupt:
+        click.secho(
+            f"💥 Discarded {len(corrupt)} corrupt blobs 💥", fg="red", bold=True
+        )
+        for hash_info in corrupt:
+            click.echo(f"  {hash_info}")
+        return ctx.exit(2)
+    click.secho("✨ All blobs are intact ✨", fg="green")
+
+
+@cache.command()
+@click.option(
+    "--keep", "-k", "lockfiles", multiple=True, required=True, type=lockfile_type
+)
+@click.option("--dry", "dry", default=False, is_flag=True)
+@jobs_option
+@click.pass_context
+def gc(ctx, lockfiles, dry, jobs):
+    blobs = require_cache(ctx)
+    keep: typ.Set[str] = set()
+    for lock in load_lockfiles(ctx, lockfiles):
+        keep.update(lock_hashes(lock))
+    removed = maintenance.collect_garbage(blobs, keep, jobs=jobs, dry=dry)
+    pruned = TreeCache.for_blobs(blobs).prune(keep, dry=dry)
+    verb = "Would remove" if dry else "Removed"
+    click.secho(
+        f"✨ {verb} {len(removed)} blobs and {pruned} extracted trees ✨", fg="green"
+    )
+
+
+@cache.command("export")
+@click.option(
+    "--lock", "-l", "lockfiles", multiple=True, required=True, type=lockfile_type
+)
+@click.argument(
+    "output_file", type=click.Path(exists=False, resolve_path=True, dir_okay=False)
+)
+@click.pass_context
+def export_cache(ctx, lockfiles, output_file):
+    require_cache(ctx)
+    session = ctx.obj["session"]
+    entries = []
+    missing = []
+    for lock in load_lockfiles(ctx, lockfiles):
+        for artifact in lock_artifacts(lock):
+            blob = session.retrieve_cache_file(artifact.cache_key, artifact.hash)
+            if blob:
+                entries.append((artifact.cache_key, artifact.hash, blob))
+            else:
+                missing.append(artifact.cache_key)
+    if missing:
+        click.secho(
+            "⛔ These downloads are not in the cache: " + ", ".join(missing),
+            fg="yellow",
+            bold=True,
+        )
+        click.echo("Run 'fetch' first.")
+        ctx.exit(1)
+    count = maintenance.export_blobs(entries, pathlib.Path(output_file))
+    click.secho(f"✨ Exported {count} blobs ✨", fg="green")
+
+
+@cache.command("import")
+@click.argument(
+    "archive", type=click.Path(exists=True, resolve_path=True, dir_okay=False)
+)
+@click.pass_context
+def import_cache(ctx, archive):
+    blobs = require_cache(ctx)
+    imported = maintenance.import_blobs(blobs, pathlib.Path(archive))
+    click.secho(f"✨ Imported {len(imported)} blobs ✨", fg="green")
 
 
 if __name__ == "__main__":
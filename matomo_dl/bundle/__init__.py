@@ -1,105 +1,224 @@
-import gzip
+import bz2
 import json
 import logging
+import lzma
+import os
 import pathlib
+import posixpath
 import tarfile
 import tempfile
+import time
 import typing as typ
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import ExitStack
+from stat import S_IFDIR, S_IFREG, S_ISDIR, S_ISREG
 
-from matomo_dl.distribution.file import DistributionFile
 from matomo_dl.distribution.lock import DistributionLockFile
-from matomo_dl.errors import DownloadHashMismatch
-from matomo_dl.lock.matomo import get_cache_key
 from matomo_dl.progress import progressbar
 from matomo_dl.session import SessionStore
+from .artifacts import (
+    DEFAULT_FETCH_JOBS,
+    assert_artifacts_cached,
+    fetch_artifact,
+    matomo_artifact,
+)
+from .compress import (
+    DEFAULT_COMPRESS_JOBS,
+    ParallelGzipWriter,
+    StreamWriter,
+    open_zstd_writer,
+)
 from .customisation import apply_customisations
-from .extract import extract_zip_file
+from .customisation.remove import get_removal_filter, record_removed_files
+from .formats import (
+    DEFAULT_FORMAT,
+    ZIP_LEVELS_SUPPORTED,
+    ArchiveFormat,
+    infer_format,
+)
 from .info import BuildInformation
-from .plugin import extract_plugins
+from .plugin import (
+    acquire_plugins,
+    add_source_times,
+    check_plugin_conflicts,
+    extract_plugin,
+)
 from .stat import standardise_mode
+from .tar_writer import TarWriter
+from .tree_cache import extract_archive, get_tree_cache
 
 logger = logging.getLogger(__name__)
+# Either a path, or an already open stream such as stdout.
+ReleaseOutput = typ.Union[pathlib.Path, typ.IO[bytes]]
+DEFAULT_BUILD_JOBS = DEFAULT_FETCH_JOBS
+# 1980-01-02; zip cannot represent anything earlier.
+ZIP_MIN_MTIME = 315619200
+# Deflating these again only costs time.
+ZIP_STORED_SUFFIXES = frozenset(
+    (".gz", ".tgz", ".bz2", ".xz", ".zst", ".zip", ".jar", ".phar")
+    + (".png", ".jpg", ".jpeg", ".gif", ".webp", ".ico")
+    + (".woff", ".woff2", ".eot", ".mmdb")
+)
 
 
 def build_release(
     session: SessionStore,
-    dist: DistributionFile,
+    dist: "DistributionFile",
     lock: DistributionLockFile,
-    output_file: pathlib.Path,
-):
-    with tempfile.TemporaryDirectory(prefix="matomo-dl") as f:
+    output_file: ReleaseOutput,
+    jobs: int = DEFAULT_BUILD_JOBS,
+    archive_format: typ.Optional[ArchiveFormat] = None,
+    compresslevel: typ.Optional[int] = None,
+) -> BuildInformation:
+    if session.offline:
+        assert_artifacts_cached(session, lock)
+    trees = get_tree_cache(session)
+    build_dir = None
+    if trees is not None:
+        # On the same filesystem as the tree cache, so it can be linked in.
+        trees.tmp_dir.mkdir(parents=True, exist_ok=True)
+        build_dir = str(trees.tmp_dir)
+    with tempfile.TemporaryDirectory(prefix="matomo-dl", dir=build_dir) as f:
         folder = pathlib.Path(f)
         info = BuildInformation(lock, dist.customisation, folder)
-        extract_matomo(session, info)
-        extract_plugins(session, dist.license_key, info)
+        extract_sources(session, dist.license_key, info, jobs=jobs)
 
         apply_customisations(info)
 
         (folder / ".build.json").write_text(json.dumps(info.to_output()))
-        create_release_tarball(info, output_file)
-
-
-def extract_matomo(session: SessionStore, build: BuildInformation):
-    with progressbar(range(4), label="Acquiring Matomo") as _bar:
-        logger.info("Attempting to retrieve Matomo zipfile from cache")
-        bar = iter(_bar)
-        lock = build.lockfile.matomo
-        folder = build.folder
-        next(bar)
-        data = session.retrieve_cache_data(get_cache_key(lock.version), lock.hash)
-        next(bar)
-        if not data:
-            logger.info("Matomo zipfile not in cache. Downloading it now")
-            r = session.get(lock.link)
-            next(bar)
-            data = r.content
-            data_hash = session.store_cache_data(get_cache_key(lock.version), data)
-            next(bar)
-            if lock.hash != data_hash:
-                raise DownloadHashMismatch()
-        list(bar)  # Finish the progress bar
-    latest_mtime = extract_zip_file(
-        data, folder, root=lock.extraction_root, progress="Extracting Matomo"
-    )
-    assert latest_mtime is not None
-    build.add_source_time(latest_mtime)
-
-
-def create_release_tarball(build: BuildInformation, output_file: pathlib.Path):
-    if output_file.suffixes[0] != ".tar":
-        output_file = output_file.with_suffix(".tar.gz")
-    with ExitStack() as stack:
-        if output_file.suffix == ".tar":
-            file: tarfile.TarFile = stack.enter_context(
-                tarfile.open(output_file, mode="w")
+        create_release_tarball(info, output_file, archive_format, compresslevel)
+    return info
+
+
+def core_plugin_names(archive: pathlib.Path, root: str) -> typ.Set[str]:
+    # Only reads the archive's index, not its contents.
+    prefix = f"{root}plugins/"
+    with zipfile.ZipFile(str(archive)) as z:
+        names = {
+            name[len(prefix) :].partition("/")[0]
+            for name in z.namelist()
+            if name.startswith(prefix)
+        }
+    names.discard("")
+    return names
+
+
+def extract_sources(
+    session: SessionStore,
+    license_key: typ.Optional[str],
+    build: BuildInformation,
+    jobs: int = DEFAULT_BUILD_JOBS,
+):
+    # Matomo and each plugin extract into separate folders; so once they are
+    #  known not to overlap they can all be extracted at the same time.
+    lock = build.lockfile.matomo
+    # Files the customisations would remove are never written at all.
+    path_filter = get_removal_filter(build)
+    # Archives' members are extracted on a pool of their own, shared between
+    #  them; so `jobs` bounds the extraction threads, however many archives.
+    with ThreadPoolExecutor(max_workers=jobs) as pool, ThreadPoolExecutor(
+        max_workers=jobs
+    ) as member_pool:
+        logger.info("Acquiring Matomo and plugins")
+        matomo = pool.submit(
+            fetch_artifact, session, None, matomo_artifact(build.lockfile)
+        )
+        plugins = acquire_plugins(session, license_key, build, pool)
+        archive = matomo.result()
+        check_plugin_conflicts(
+            plugins, core_plugin_names(archive, lock.extraction_root)
+        )
+        futures = [
+            pool.submit(
+                extract_archive,
+                session,
+                archive,
+                lock.hash,
+                build.folder,
+                root=lock.extraction_root,
+                path_filter=path_filter,
+                pool=member_pool,
+            )
+        ]
+        futures.extend(
+            pool.submit(
+                extract_plugin, session, build, plugin, path_filter, member_pool
             )
-        elif output_file.suffix == ".gz":
-            # Have to construct the gzip stream seperately otherwise python
-            #  'helpfully' adds the current time as a gzip comment; thus
-            #  ruining our reproducible builds.
-            output_fd: typ.IO[bytes] = gzip.GzipFile(  # type: ignore
-                filename="",
-                mode="wb",
-                compresslevel=9,
-                mtime=build.mtime_clamp,
-                fileobj=stack.enter_context(output_file.open("wb")),
+            for plugin in plugins
+        )
+        add_source_times(build, futures, label="Extracting Matomo and plugins")
+    if path_filter is not None:
+        record_removed_files(build, path_filter)
+
+
+def open_release_output(stack: ExitStack, output_file: ReleaseOutput) -> typ.IO[bytes]:
+    if isinstance(output_file, pathlib.Path):
+        return stack.enter_context(output_file.open("wb"))
+    return stack.enter_context(typ.cast(typ.IO[bytes], StreamWriter(output_file)))
+
+
+def open_compressed_output(
+    stack: ExitStack,
+    build: BuildInformation,
+    output_fd: typ.IO[bytes],
+    archive_format: ArchiveFormat,
+    level: int,
+    jobs: int,
+) -> typ.IO[bytes]:
+    if archive_format.name == "tar.gz":
+        # Constructed seperately so the gzip header's mtime is the build's
+        #  rather than the current time; and so all cores compress it.
+        return stack.enter_context(
+            ParallelGzipWriter(  # type: ignore
+                output_fd, mtime=build.mtime_clamp, compresslevel=level, jobs=jobs
             )
-            file = stack.enter_context(
-                tarfile.open(fileobj=stack.enter_context(output_fd), mode="w")
+        )
+    elif archive_format.name == "tar.zst":
+        return stack.enter_context(open_zstd_writer(output_fd, level, jobs))
+    elif archive_format.name == "tar.bz2":
+        return stack.enter_context(
+            bz2.BZ2File(output_fd, mode="wb", compresslevel=level)
+        )
+    elif archive_format.name == "tar.xz":
+        return stack.enter_context(lzma.LZMAFile(output_fd, mode="wb", preset=level))
+    raise ValueError(archive_format.name)
+
+
+def create_release_tarball(
+    build: BuildInformation,
+    output_file: ReleaseOutput,
+    archive_format: typ.Optional[ArchiveFormat] = None,
+    compresslevel: typ.Optional[int] = None,
+    jobs: int = DEFAULT_COMPRESS_JOBS,
+):
+    if archive_format is None and isinstance(output_file, pathlib.Path):
+        archive_format, output_file = infer_format(output_file)
+    elif archive_format is None:
+        archive_format = DEFAULT_FORMAT
+    # Only plain tarballs have no compression level.
+    level = archive_format.compression_level(compresslevel)
+    if level is None:
+        if create_release_plain_tar(build, output_file):
+            return
+    elif archive_format.name == "zip":
+        return create_release_zip(build, output_file, level)
+    with ExitStack() as stack:
+        output_fd = open_release_output(stack, output_file)
+        if level is not None:
+            output_fd = open_compressed_output(
+                stack, build, output_fd, archive_format, level, jobs
             )
-        else:
-            if output_file.suffix in [".gz", ".xz"]:
-                mode = "w:" + output_file.suffix[1:]
-            elif output_file.suffix in [".bz", ".bz2"]:
-                mode = "w:bz2"
-            else:
-                raise ValueError()
-            file = stack.enter_context(
-                tarfile.open(output_file, mode=mode, compresslevel=9)
+        file: tarfile.TarFile = stack.enter_context(
+            tarfile.open(fileobj=output_fd, mode="w")
+        )
+        bar = stack.enter_context(
+            progressbar(
+                iter_folder_for_tar(build, build.folder, ""),
+                length=count_folder_for_tar(build.folder),
+                label="Creating archive",
             )
-        items = list(iter_folder_for_tar(file, build, build.folder, ""))
-        bar = stack.enter_context(progressbar(items, label="Creating archive"))
+        )
         for tar_info, path in bar:
             if path:
                 with path.open("rb") as f:
@@ -108,39 +227,135 @@ def create_release_tarball(build: BuildInformation, output_file: pathlib.Path):
                 file.addfile(tar_info)
 
 
-def normalise_tar_info(
-    build: BuildInformation, info: tarfile.TarInfo
+def create_release_plain_tar(
+    build: BuildInformation, output_file: ReleaseOutput
+) -> bool:
+    # Returns False if the output has no file descriptor to write to.
+    with ExitStack() as stack:
+        if isinstance(output_file, pathlib.Path):
+            fd = stack.enter_context(output_file.open("wb", buffering=0)).fileno()
+        else:
+            try:
+                output_file.flush()
+                fd = output_file.fileno()
+            except (AttributeError, OSError):
+                return False
+        writer = TarWriter(fd)
+        bar = stack.enter_context(
+            progressbar(
+                iter_folder_for_tar(build, build.folder, ""),
+                length=count_folder_for_tar(build.folder),
+                label="Creating archive",
+            )
+        )
+        for tar_info, path in bar:
+            writer.addfile(tar_info, path)
+        writer.close()
+    return True
+
+
+def create_release_zip(
+    build: BuildInformation, output_file: ReleaseOutput, compresslevel: int
+):
+    with ExitStack() as stack:
+        output_fd = open_release_output(stack, output_file)
+        file = stack.enter_context(zipfile.ZipFile(output_fd, mode="w"))
+        bar = stack.enter_context(
+            progressbar(
+                iter_folder_for_tar(build, build.folder, ""),
+                length=count_folder_for_tar(build.folder),
+                label="Creating archive",
+            )
+        )
+        for tar_info, path in bar:
+            zip_info = zip_info_from_tar_info(tar_info)
+            data = path.read_bytes() if path else b""
+            # `writestr` is the only public way to give a member its level;
+            #  which `ZipFile.open` would take from a private attribute.
+            if ZIP_LEVELS_SUPPORTED:
+                file.writestr(zip_info, data, compresslevel=compresslevel)
+            else:
+                file.writestr(zip_info, data)
+
+
+def zip_info_from_tar_info(tar_info: tarfile.TarInfo) -> zipfile.ZipInfo:
+    # Zip timestamps have no timezone; UTC keeps them the same wherever the
+    #  build is run.
+    date_time = time.gmtime(max(tar_info.mtime, ZIP_MIN_MTIME))[:6]
+    if tar_info.isdir():
+        zip_info = zipfile.ZipInfo(tar_info.name + "/", date_time)
+        zip_info.external_attr = ((S_IFDIR | tar_info.mode) << 16) | 0x10
+    else:
+        zip_info = zipfile.ZipInfo(tar_info.name, date_time)
+        zip_info.external_attr = (S_IFREG | tar_info.mode) << 16
+        suffix = posixpath.splitext(tar_info.name)[1].lower()
+        if suffix not in ZIP_STORED_SUFFIXES:
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+    zip_info.create_system = 3  # Unix, so the modes are kept
+    return zip_info
+
+
+def tar_info_for_entry(
+    build: BuildInformation, entry: "os.DirEntry[str]", name: str
 ) -> typ.Optional[tarfile.TarInfo]:
-    if not info.isfile() and not info.isdir():
+    # Built straight from the (usually cached) stat, rather than using
+    #  `TarFile.gettarinfo`; which looks up user and group names only for
+    #  them to be thrown away.
+    stat_result = entry.stat(follow_symlinks=False)
+    if S_ISREG(stat_result.st_mode):
+        info = tarfile.TarInfo(name)
+        info.size = stat_result.st_size
+    elif S_ISDIR(stat_result.st_mode):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.DIRTYPE
+    else:
         return None
-    if info.mode & 0o7000 != 0:
-        print(info, info.mode)
-        raise ValueError()
-    info.mode = standardise_mode(info.mode, force_exec=info.isdir())
-    info.uid = 0
-    info.uname = ""
-    info.gid = 0
-    info.gname = ""
-    info.pax_headers = {}
+    if stat_result.st_mode & 0o7000 != 0:
+        raise ValueError(f"{name} has an unsupported mode {stat_result.st_mode:o}")
+    info.mode = standardise_mode(stat_result.st_mode, force_exec=info.isdir())
     # Clamp any files modified during this run to the start;
     # See https://reproducible-builds.org/docs/source-date-epoch/
-    info.mtime = build.clamp_mtime(info.mtime)
+    info.mtime = build.clamp_mtime(stat_result.st_mtime)
     return info
 
 
+def sorted_entries(folder: pathlib.Path) -> typ.List["os.DirEntry[str]"]:
+    with os.scandir(str(folder)) as entries:
+        return sorted(entries, key=lambda entry: entry.name)
+
+
 def iter_folder_for_tar(
-    tar: tarfile.TarFile, build: BuildInformation, folder: pathlib.Path, base_path: str
+    build: BuildInformation, folder: pathlib.Path, base_path: str
 ) -> typ.Iterator[typ.Tuple[tarfile.TarInfo, typ.Optional[pathlib.Path]]]:
     if base_path != "" and base_path[-1] != "/":
         base_path += "/"
-    for path in sorted(folder.iterdir()):
-        tar_info = normalise_tar_info(
-            build, tar.gettarinfo(str(path), f"{base_path}{path.name}")
-        )
+    for entry in sorted_entries(folder):
+        tar_info = tar_info_for_entry(build, entry, f"{base_path}{entry.name}")
         if not tar_info:
             continue
         elif tar_info.isfile():
-            yield tar_info, path
+            yield tar_info, pathlib.Path(entry.path)
         elif tar_info.isdir():
             yield tar_info, None
-            yield from iter_folder_for_tar(tar, build, path, f"{base_path}{path.name}/")
+            yield from iter_folder_for_tar(
+                build, pathlib.Path(entry.path), f"{base_path}{entry.name}/"
+            )
+
+
+def count_folder_for_tar(folder: pathlib.Path) -> int:
+    # Only uses the entries' types, which rarely needs a stat.
+    count = 0
+    with os.scandir(str(folder)) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                count += 1 + count_folder_for_tar(pathlib.Path(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                count += 1
+    return count
+
+
+if typ.TYPE_CHECKING:
+    # At the end to avoid a recursive import
+    from matomo_dl.distribution.file import DistributionFile
+else:
+    DistributionFile = None
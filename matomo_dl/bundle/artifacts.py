@@ -0,0 +1,108 @@
+import logging
+import pathlib
+import typing as typ
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import attr
+
+from matomo_dl.distribution.lock import DistributionLockFile, VersionedPluginLock
+from matomo_dl.errors import MissingDownloadError
+from matomo_dl.hashing import HashInfo
+from matomo_dl.lock.matomo import get_cache_key as get_matomo_cache_key
+from matomo_dl.lock.plugin.versioned import get_cache_key as get_plugin_cache_key
+from matomo_dl.lock.plugin.versioned import plugin_request
+from matomo_dl.progress import progressbar
+from matomo_dl.session import SessionStore
+
+logger = logging.getLogger(__name__)
+DEFAULT_FETCH_JOBS = 4
+
+
+@attr.s(frozen=True)
+class Artifact:
+
+    cache_key: str = attr.ib()
+    hash: HashInfo = attr.ib()
+    link: str = attr.ib()
+    # Plugin downloads are POSTed along with the license key.
+    is_plugin: bool = attr.ib(default=False)
+
+
+def matomo_artifact(lock: DistributionLockFile) -> Artifact:
+    matomo = lock.matomo
+    return Artifact(get_matomo_cache_key(matomo.version), matomo.hash, matomo.link)
+
+
+def plugin_artifact(name: str, lock: VersionedPluginLock) -> Artifact:
+    return Artifact(
+        get_plugin_cache_key(name, lock.version), lock.hash, lock.link, is_plugin=True
+    )
+
+
+def lock_artifacts(lock: DistributionLockFile) -> typ.List[Artifact]:
+    artifacts = [matomo_artifact(lock)]
+    for name, plugin_lock in lock.plugin_locks.items():
+        if isinstance(plugin_lock, VersionedPluginLock):
+            artifacts.append(plugin_artifact(name, plugin_lock))
+    return artifacts
+
+
+def fetch_artifact(
+    session: SessionStore, license_key: typ.Optional[str], artifact: Artifact
+) -> pathlib.Path:
+    if not artifact.is_plugin:
+        return session.download_cache_file(
+            artifact.cache_key, artifact.hash, artifact.link
+        )
+    return session.fetch_cache_file(
+        artifact.cache_key,
+        artifact.hash,
+        lambda: plugin_request(
+            session, artifact.link, license_key=license_key, stream=True
+        ),
+    )
+
+
+def missing_artifacts(
+    session: SessionStore, lock: DistributionLockFile
+) -> typ.List[Artifact]:
+    return [
+        artifact
+        for artifact in lock_artifacts(lock)
+        if not session.retrieve_cache_file(artifact.cache_key, artifact.hash)
+    ]
+
+
+def assert_artifacts_cached(session: SessionStore, lock: DistributionLockFile):
+    # Checked up front, so an offline build reports everything it is missing
+    #  rather than failing on the first download it attempts.
+    missing = missing_artifacts(session, lock)
+    if missing:
+        raise MissingDownloadError(
+            "Cannot build offline; these downloads are not in the cache: "
+            + ", ".join(artifact.cache_key for artifact in missing)
+        )
+
+
+def fetch_artifacts(
+    session: SessionStore,
+    license_key: typ.Optional[str],
+    lock: DistributionLockFile,
+    jobs: int = DEFAULT_FETCH_JOBS,
+) -> typ.List[Artifact]:
+    missing = missing_artifacts(session, lock)
+    if not missing:
+        return missing
+    session.set_pool_size(jobs * session.range_parts)
+    with ThreadPoolExecutor(max_workers=jobs) as pool, progressbar(
+        length=len(missing), label="Fetching downloads"
+    ) as bar:
+        futures = {
+            pool.submit(fetch_artifact, session, license_key, artifact): artifact
+            for artifact in missing
+        }
+        for future in as_completed(futures):
+            future.result()
+            logger.info(f"Fetched {futures[future].cache_key}")
+            bar.update(1)
+    return missing
@@ -0,0 +1,162 @@
+import io
+import os
+import struct
+import typing as typ
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from matomo_dl.errors import MatomoError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_GZIP_BLOCK_SIZE = 1024 * 1024
+DEFAULT_COMPRESS_JOBS = os.cpu_count() or 1
+# Deflate can refer back at most this far; so each block is primed with the
+#  end of the one before it.
+DICTIONARY_SIZE = 32 * 1024
+
+
+def compress_block(
+    block: bytes, dictionary: bytes, compresslevel: int, final: bool
+) -> bytes:
+    args = (compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL)
+    if dictionary:
+        compressor = zlib.compressobj(*args, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(*args)
+    # A sync flush ends on a byte boundary without ending the stream; so the
+    #  blocks can simply be concatenated.
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+    )
+
+
+def gzip_header(mtime: int, compresslevel: int) -> bytes:
+    # The same header `gzip.GzipFile` writes given an empty filename.
+    if compresslevel == 9:
+        extra_flags = 2
+    elif compresslevel == 1:
+        extra_flags = 4
+    else:
+        extra_flags = 0
+    return struct.pack("<BBBBLBB", 0x1F, 0x8B, 8, 0, mtime, extra_flags, 255)
+
+
+class ParallelGzipWriter(io.BufferedIOBase):
+    # Writes a single gzip member whose deflate stream is compressed in
+    #  fixed-size blocks on a thread pool, as pigz does. The output only
+    #  depends on the data and the block size, not on the number of jobs.
+
+    def __init__(
+        self,
+        fileobj: typ.IO[bytes],
+        mtime: int,
+        compresslevel: int = 9,
+        block_size: int = DEFAULT_GZIP_BLOCK_SIZE,
+        jobs: int = DEFAULT_COMPRESS_JOBS,
+    ):
+        super().__init__()
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.jobs = max(jobs, 1)
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self._pending: typ.Deque["Future[bytes]"] = deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+        self.fileobj.write(gzip_header(mtime, compresslevel))
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        data = memoryview(data).cast("B")
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[: self.block_size])
+            del self._buffer[: self.block_size]
+            self._submit(block, final=False)
+        return len(data)
+
+    def _submit(self, block: bytes, final: bool) -> None:
+        self._pending.append(
+            self._pool.submit(
+                compress_block, block, self._dictionary, self.compresslevel, final
+            )
+        )
+        self._dictionary = block[-DICTIONARY_SIZE:]
+        # Bounded, so a fast producer cannot buffer the whole archive.
+        while len(self._pending) > 2 * self.jobs:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self._buffer), final=True)
+            self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+            self.fileobj.write(
+                struct.pack("<LL", self._crc & 0xFFFFFFFF, self._size & 0xFFFFFFFF)
+            )
+        finally:
+            self._pool.shutdown()
+            super().close()
+
+
+def open_zstd_writer(
+    fileobj: typ.IO[bytes], compresslevel: int, jobs: int = DEFAULT_COMPRESS_JOBS
+) -> typ.IO[bytes]:
+    if zstandard is None:
+        raise MatomoError(
+            "Creating .tar.zst archives requires the zstandard module; "
+            "install matomo_dl[zstd]"
+        )
+    # zstd's multi-threaded output is the same for any number of threads, but
+    #  differs from its single-threaded output; so always use at least one.
+    compressor = zstandard.ZstdCompressor(
+        level=compresslevel, threads=max(jobs, 1), write_checksum=True
+    )
+    return typ.cast(typ.IO[bytes], compressor.stream_writer(fileobj, closefd=False))
+
+
+class StreamWriter(io.BufferedIOBase):
+    # Pipes cannot report their position, which tarfile and zipfile ask for;
+    #  so count what has been written instead. Never closes the stream.
+
+    def __init__(self, fileobj: typ.IO[bytes]):
+        super().__init__()
+        self.fileobj = fileobj
+        self._size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._size
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.fileobj.write(data)
+        size = memoryview(data).nbytes
+        self._size += size
+        return size
+
+    def flush(self) -> None:
+        if not self.closed:
+            self.fileobj.flush()
@@ -1,6 +1,7 @@
 import logging
 import re
 
+from matomo_dl.bundle.fs_util import break_link
 from matomo_dl.bundle.info import BuildInformation
 
 logger = logging.getLogger(__name__)
@@ -39,6 +40,7 @@ def regenerate_autoload_classmap(build: BuildInformation) -> None:
             continue
         content.append(line)
     postfix.extend(autoload_file)
+    break_link(autoload)
     autoload.write_text("\n".join(prefix + sorted(content) + postfix))
 
 
@@ -69,5 +71,6 @@ def regenerate_autoload_static(build: BuildInformation) -> None:
             continue
         content.append(line)
     postfix.extend(autoload_file)
+    break_link(autoload)
     autoload.write_text("\n".join(prefix + sorted(content) + postfix))
     pass
@@ -1,5 +1,6 @@
 import logging
 
+from matomo_dl.bundle.fs_util import break_link
 from matomo_dl.bundle.info import BuildInformation
 from matomo_dl.matomo_config import read as read_config, write as write_config
 
@@ -11,9 +12,8 @@ def update_plugins_list(build: BuildInformation) -> None:
     plugins_folder = folder / "plugins"
     global_config = folder / "config/global.ini.php"
     config = read_config(global_config.open())
-    print(config["Plugins"])
     all_plugins = config["Plugins"]["Plugins"]
-    print(all_plugins)
+    logger.debug(f"Plugins listed in the global config: {all_plugins}")
     base_default_plugins = config["PluginsInstalled"]["PluginsInstalled"]
     assert isinstance(all_plugins, list)
     assert isinstance(base_default_plugins, list)
@@ -42,4 +42,5 @@ def update_plugins_list(build: BuildInformation) -> None:
 
     config["Plugins"]["Plugins"] = installed_plugins
     config["PluginsInstalled"]["PluginsInstalled"] = activated_plugins
+    break_link(global_config)
     write_config(config, global_config.open("w"))
@@ -2,6 +2,7 @@ import logging
 import re
 from hashlib import md5
 
+from matomo_dl.bundle.fs_util import break_link
 from matomo_dl.bundle.info import BuildInformation
 
 logger = logging.getLogger(__name__)
@@ -38,4 +39,5 @@ def regenerate_manifest(build: BuildInformation) -> None:
         file_hash = md5(file.read_bytes()).hexdigest()
         content.append(f'{indent}"{fname}" => array("{file_size}", "{file_hash}"),')
     postfix.extend(manifest_file)
+    break_link(manifest)
     manifest.write_text("\n".join(prefix + sorted(content) + postfix))
@@ -1,16 +1,27 @@
 import logging
 import os
 import pathlib
+import posixpath
+import shutil
 import typing as typ
 import zipfile
+from concurrent.futures import Executor, ThreadPoolExecutor
 from contextlib import ExitStack
 from datetime import datetime
 from io import BytesIO
 
+import attr
+
 from matomo_dl.progress import progressbar
+from .fs_util import PathFilter
 from .stat import is_extended_mode_dir, standardise_privacy_mode
 
 logger = logging.getLogger(__name__)
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_EXTRACT_JOBS = os.cpu_count() or 1
+WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+FD_UTIME = os.utime in os.supports_fd
+FD_CHMOD = os.chmod in os.supports_fd
 
 
 def is_zipinfo_dir(info: zipfile.ZipInfo) -> bool:
@@ -19,56 +30,163 @@ def is_zipinfo_dir(info: zipfile.ZipInfo) -> bool:
     return is_msdos_dir or is_unix_dir or info.filename[-1] == "/"
 
 
-def resolve_filename(
-    destination: pathlib.Path, name: str
-) -> typ.Optional[pathlib.Path]:
-    target = (destination / name).resolve(strict=False)
+def lexical_filename(destination: str, name: str) -> typ.Optional[str]:
+    # `destination` is resolved once up front, and the extraction never
+    #  creates symlinks; so normalising the name is enough to confine it.
+    normalised = posixpath.normpath(name)
     if (
-        len(target.parts) <= len(destination.parts)
-        or target.parts[: len(destination.parts)] != destination.parts
+        normalised.startswith("/")
+        or normalised in (".", "..")
+        or normalised.startswith("../")
     ):
         return None
-    return target
+    return os.path.join(destination, normalised)
+
+
+def current_umask() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except OSError:
+        pass
+    # Assume the worst, so the mode is always set explicitly.
+    return 0o777
+
+
+@attr.s(frozen=True)
+class PlannedFile:
+
+    info: zipfile.ZipInfo = attr.ib()
+    target: str = attr.ib()
+    mode: int = attr.ib()
+    mtime: int = attr.ib()
+
+
+@attr.s
+class ExtractionPlan:
+
+    folders: typ.Set[str] = attr.ib(factory=set)
+    files: typ.Dict[str, PlannedFile] = attr.ib(factory=dict)
+    latest_mtime: typ.Optional[int] = attr.ib(default=None)
+
+
+def plan_extraction(
+    infos: typ.Iterable[zipfile.ZipInfo],
+    destination: str,
+    root: str,
+    path_filter: typ.Optional[PathFilter] = None,
+) -> ExtractionPlan:
+    plan = ExtractionPlan()
+    folders = plan.folders
+    files = plan.files
+    for item in infos:
+        _, root_chk, dest_filename = item.filename.partition(root)
+        if root_chk != root:
+            continue
+        elif not dest_filename:
+            folders.add(destination)
+            continue
+        dest = lexical_filename(destination, dest_filename)
+        if not dest:
+            logger.warning(
+                f"Skipping potentially dangeous item {item.filename!r}, "
+                f"it was to be placed at {dest_filename!r}"
+            )
+            continue
+        if is_zipinfo_dir(item):
+            folders.add(dest)
+            files.pop(dest, None)
+        else:
+            mtime = int(datetime(*item.date_time, microsecond=0).timestamp())
+            mode = standardise_privacy_mode(item.external_attr >> 16)
+            if plan.latest_mtime is None:
+                plan.latest_mtime = mtime
+            else:
+                plan.latest_mtime = max(plan.latest_mtime, mtime)
+            folders.add(os.path.dirname(dest))
+            # Later members replace earlier ones of the same name.
+            files.pop(dest, None)
+            files[dest] = PlannedFile(item, dest, mode, mtime)
+    if path_filter is not None:
+        filter_plan(plan, destination, path_filter)
+    return plan
+
+
+def filter_plan(plan: ExtractionPlan, destination: str, path_filter: PathFilter):
+    # The latest mtime still counts removed files, as it did when they were
+    #  extracted and then deleted.
+    for folder in list(plan.folders):
+        # Including the folders that only exist as the parent of another.
+        while folder != destination and folder.startswith(destination + os.sep):
+            folder = os.path.dirname(folder)
+            plan.folders.add(folder)
+    for folder in list(plan.folders):
+        if path_filter.removes_folder(folder):
+            path_filter.record(folder)
+            plan.folders.discard(folder)
+    for dest in list(plan.files):
+        if path_filter.removes(dest):
+            path_filter.record(dest)
+            del plan.files[dest]
+
+
+def write_member(zip_file: zipfile.ZipFile, planned: PlannedFile, umask: int) -> None:
+    try:
+        fd = os.open(planned.target, WRITE_FLAGS, planned.mode)
+    except FileExistsError:
+        # Replace, rather than write through, any cloned file.
+        os.unlink(planned.target)
+        fd = os.open(planned.target, WRITE_FLAGS, planned.mode)
+    with open(fd, "wb") as dst:
+        with zip_file.open(planned.info) as src:
+            shutil.copyfileobj(src, dst, EXTRACT_CHUNK_SIZE)
+        dst.flush()
+        target: typ.Union[int, str] = dst.fileno()
+        if planned.mode & umask:
+            os.chmod(target if FD_CHMOD else planned.target, planned.mode)
+        times = (planned.mtime, planned.mtime)
+        os.utime(target if FD_UTIME else planned.target, times=times)
 
 
 def extract_zip_file(
-    file_data: bytes,
+    file_data: typ.Union[pathlib.Path, bytes],
     destination: pathlib.Path,
     root: str,
     progress: typ.Optional[str] = None,
+    jobs: int = DEFAULT_EXTRACT_JOBS,
+    path_filter: typ.Optional[PathFilter] = None,
+    pool: typ.Optional[Executor] = None,
 ) -> typ.Optional[int]:
-    latest_mtime = None
+    # Archives extracted side by side share one `pool` for their members;
+    #  otherwise each starts its own, of `jobs` threads.
+    source: typ.Union[pathlib.Path, typ.IO[bytes]] = (
+        BytesIO(file_data) if isinstance(file_data, bytes) else file_data
+    )
+    destination_str = str(destination.resolve(strict=False))
     with ExitStack() as stack:
-        file = stack.enter_context(zipfile.ZipFile(BytesIO(file_data), "r"))
-        infos: typ.Iterable[zipfile.ZipInfo] = file.infolist()
+        file = stack.enter_context(zipfile.ZipFile(source, "r"))
+        infos = file.infolist()
+        plan = plan_extraction(infos, destination_str, root, path_filter)
+        files = plan.files
+        # Sorted, so every parent is created before its children.
+        for folder in sorted(plan.folders):
+            os.makedirs(folder, exist_ok=True)
+        bar = None
         if progress:
-            infos = stack.enter_context(progressbar(infos, label=progress))
-        for item in infos:
-            _, root_chk, dest_filename = item.filename.partition(root)
-            if root_chk != root:
-                continue
-            elif not dest_filename:
-                destination.mkdir(parents=True, exist_ok=True)
-                continue
-            dest = resolve_filename(destination, dest_filename)
-            if not dest:
-                logger.warning(
-                    f"Skipping potentially dangeous item {item.filename!r}, "
-                    f"it was to be placed at {dest_filename!r}"
-                )
-                continue
-            if is_zipinfo_dir(item):
-                dest.mkdir(parents=True, exist_ok=True)
-            else:
-                mtime = int(datetime(*item.date_time, microsecond=0).timestamp())
-                if latest_mtime is None:
-                    latest_mtime = mtime
-                else:
-                    latest_mtime = max(latest_mtime, mtime)
-                # File
-                mode = standardise_privacy_mode(item.external_attr >> 16)
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                dest.write_bytes(file.read(item))
-                dest.chmod(mode)
-                os.utime(dest, times=(mtime, mtime))
-    return latest_mtime
+            bar = stack.enter_context(progressbar(length=len(infos), label=progress))
+            bar.update(len(infos) - len(files))
+        umask = current_umask()
+        # zlib releases the GIL while inflating, so members extract in parallel.
+        if pool is None:
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(jobs, 1)))
+        futures = [
+            pool.submit(write_member, file, planned, umask)
+            for planned in files.values()
+        ]
+        for future in futures:
+            future.result()
+            if bar:
+                bar.update(1)
+    return plan.latest_mtime
@@ -0,0 +1,91 @@
+import logging
+import pathlib
+import re
+import sys
+import typing as typ
+
+import attr
+
+logger = logging.getLogger(__name__)
+
+
+@attr.s(frozen=True)
+class ArchiveFormat:
+
+    name: str = attr.ib()
+    suffix: str = attr.ib()
+    min_level: typ.Optional[int] = attr.ib(default=None)
+    max_level: typ.Optional[int] = attr.ib(default=None)
+    default_level: typ.Optional[int] = attr.ib(default=None)
+    # Used by `--fast`; for development builds where size doesn't matter.
+    fast_level: typ.Optional[int] = attr.ib(default=None)
+
+    @property
+    def compressed(self) -> bool:
+        return self.default_level is not None
+
+    def compression_level(
+        self, level: typ.Optional[int] = None, fast: bool = False
+    ) -> typ.Optional[int]:
+        if not self.compressed:
+            if level is not None:
+                raise ValueError(f"{self.name} archives are not compressed")
+            return None
+        elif level is None:
+            if fast and self.fast_level == self.default_level:
+                logger.warning(f"{self.name} archives cannot be compressed faster here")
+            return self.fast_level if fast else self.default_level
+        elif self.min_level == self.max_level != level:
+            raise ValueError(
+                f"The compression level for {self.name} can only be "
+                f"{self.min_level} here"
+            )
+        elif not self.min_level <= level <= self.max_level:  # type: ignore
+            raise ValueError(
+                f"The compression level for {self.name} must be between "
+                f"{self.min_level} and {self.max_level}"
+            )
+        return level
+
+
+# Before 3.7, zipfile always deflates at zlib's default level.
+ZIP_LEVELS_SUPPORTED = sys.version_info >= (3, 7)
+if ZIP_LEVELS_SUPPORTED:
+    ZIP_FORMAT = ArchiveFormat("zip", ".zip", 0, 9, 9, 1)
+else:
+    ZIP_FORMAT = ArchiveFormat("zip", ".zip", 6, 6, 6, 6)
+
+FORMATS: typ.Dict[str, ArchiveFormat] = {
+    fmt.name: fmt
+    for fmt in [
+        ArchiveFormat("tar", ".tar"),
+        ArchiveFormat("tar.gz", ".tar.gz", 0, 9, 9, 1),
+        ArchiveFormat("tar.bz2", ".tar.bz2", 1, 9, 9, 1),
+        ArchiveFormat("tar.xz", ".tar.xz", 0, 9, 6, 0),
+        ArchiveFormat("tar.zst", ".tar.zst", 1, 22, 19, 1),
+        ZIP_FORMAT,
+    ]
+}
+FORMAT_ALIASES = {
+    ".tar.bz": "tar.bz2",
+    ".tgz": "tar.gz",
+    ".tbz": "tar.bz2",
+    ".tbz2": "tar.bz2",
+    ".txz": "tar.xz",
+}
+UNKNOWN_TAR_SUFFIX_RE = re.compile(r"\.tar\.[^.]+$")
+DEFAULT_FORMAT = FORMATS["tar.gz"]
+
+
+def infer_format(output_file: pathlib.Path) -> typ.Tuple[ArchiveFormat, pathlib.Path]:
+    name = output_file.name.lower()
+    # Longest first, so `.tar.gz` is not mistaken for `.tar`.
+    for fmt in sorted(FORMATS.values(), key=lambda f: -len(f.suffix)):
+        if name.endswith(fmt.suffix):
+            return fmt, output_file
+    for suffix, format_name in FORMAT_ALIASES.items():
+        if name.endswith(suffix):
+            return FORMATS[format_name], output_file
+    if UNKNOWN_TAR_SUFFIX_RE.search(name):
+        raise ValueError(f"Cannot tell the archive format of {output_file.name}")
+    return DEFAULT_FORMAT, output_file.with_suffix(DEFAULT_FORMAT.suffix)
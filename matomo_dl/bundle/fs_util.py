@@ -1,10 +1,21 @@
+import errno
 import itertools
 import logging
+import os
 import pathlib
 import re
+import shutil
+import threading
 import typing as typ
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
 logger = logging.getLogger(__name__)
+# From linux/fs.h; shares the data blocks of two files until either is written.
+FICLONE = 0x40049409
 
 
 def iter_tree(folder: pathlib.Path) -> typ.Iterator[pathlib.Path]:
@@ -75,6 +86,47 @@ def delete_all_matching(
     return itertools.chain.from_iterable(chainable)
 
 
+class PathFilter:
+    # Decides which paths a set of `delete_all_matching` rules would delete,
+    #  so they can be left out of a build rather than written and then
+    #  deleted. Any path inside a matching folder is removed along with it.
+
+    root: str
+    removed: typ.Set[str]
+
+    def __init__(self, root: pathlib.Path, rules: typ.Iterable[typ.Dict[str, typ.Any]]):
+        self.root = str(root)
+        self.explicit: typ.Set[str] = set()
+        self.patterns: typ.List[typ.Pattern] = []
+        for rule in rules:
+            kwds = dict(rule)
+            for path in itertools.chain(kwds.pop("paths", ()), kwds.pop("folders", ())):
+                self.explicit.add(str(root / path))
+            if kwds:
+                self.patterns.append(get_path_regex(root, **kwds))
+        self.removed = set()
+        self._folders: typ.Dict[str, bool] = {}
+        self._lock = threading.Lock()
+
+    def matches(self, path: str) -> bool:
+        return path in self.explicit or any(p.match(path) for p in self.patterns)
+
+    def removes(self, path: str) -> bool:
+        if not path.startswith(self.root + os.sep):
+            return False
+        return self.matches(path) or self.removes_folder(os.path.dirname(path))
+
+    def removes_folder(self, folder: str) -> bool:
+        removed = self._folders.get(folder)
+        if removed is None:
+            removed = self._folders[folder] = self.removes(folder)
+        return removed
+
+    def record(self, path: str) -> None:
+        with self._lock:
+            self.removed.add(os.path.relpath(path, self.root))
+
+
 def delete_all(*paths: pathlib.Path) -> typ.Collection[pathlib.Path]:
     return delete_all_iter(paths)
 
@@ -100,3 +152,88 @@ def delete_all_iter(paths: typ.Iterable[pathlib.Path]) -> typ.Collection[pathlib
             item.unlink()
             deleted.add(item)
     return deleted
+
+
+def reflink_file(source: pathlib.Path, target: pathlib.Path) -> None:
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported", str(target))
+    try:
+        with source.open("rb") as src, target.open("xb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(str(source), str(target))
+    except OSError:
+        if target.exists():
+            target.unlink()
+        raise
+
+
+def link_file(source: pathlib.Path, target: pathlib.Path) -> None:
+    os.link(str(source), str(target))
+
+
+def copy_file(source: pathlib.Path, target: pathlib.Path) -> None:
+    shutil.copy2(str(source), str(target))
+
+
+CLONE_METHODS: typ.Sequence[
+    typ.Tuple[str, typ.Callable[[pathlib.Path, pathlib.Path], None]]
+] = (("reflink", reflink_file), ("hardlink", link_file), ("copy", copy_file))
+
+
+def clone_file(
+    source: pathlib.Path, target: pathlib.Path, method: typ.Optional[str] = None
+) -> str:
+    # Tries each method in turn, starting from the one that last worked.
+    names = [name for name, _ in CLONE_METHODS]
+    start = names.index(method) if method else 0
+    if target.exists() or target.is_symlink():
+        # Never write through an existing (possibly linked) file.
+        target.unlink()
+    for name, clone in CLONE_METHODS[start:-1]:
+        try:
+            clone(source, target)
+            return name
+        except OSError as e:
+            logger.debug(f"Cannot {name} {source} to {target}: {e}")
+    name, clone = CLONE_METHODS[-1]
+    clone(source, target)
+    return name
+
+
+def clone_tree(
+    source: pathlib.Path,
+    destination: pathlib.Path,
+    path_filter: typ.Optional[PathFilter] = None,
+) -> typ.Optional[str]:
+    method = None
+    if path_filter is not None:
+        destination = destination.resolve()
+    for folder, _, files in os.walk(str(source)):
+        target_folder = destination / os.path.relpath(folder, str(source))
+        if path_filter is not None:
+            if path_filter.removes_folder(str(target_folder)):
+                path_filter.record(str(target_folder))
+                for name in files:
+                    path_filter.record(str(target_folder / name))
+                continue
+        target_folder.mkdir(parents=True, exist_ok=True)
+        for name in sorted(files):
+            target = target_folder / name
+            if path_filter is not None and path_filter.removes(str(target)):
+                path_filter.record(str(target))
+                continue
+            method = clone_file(pathlib.Path(folder, name), target, method)
+    return method
+
+
+def break_link(file: pathlib.Path) -> None:
+    # Files cloned from the tree cache may be hardlinks into it; so give them
+    #  their own copy before they are modified in place.
+    try:
+        if file.stat().st_nlink <= 1:
+            return
+    except FileNotFoundError:
+        return
+    tmp_file = file.with_name(f".{file.name}.unlinked")
+    shutil.copy2(str(file), str(tmp_file))
+    os.replace(str(tmp_file), str(file))
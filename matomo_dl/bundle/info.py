@@ -1,6 +1,7 @@
 import logging
 import os
 import pathlib
+import threading
 import time
 import typing as typ
 
@@ -44,21 +45,40 @@ class BuildInformation:
     extra_info: typ.Dict[str, typ.Any] = attr.ib(factory=dict)
     mtime_clamp: int = attr.ib(factory=get_build_mtime)
 
+    def __attrs_post_init__(self):
+        # Not an attribute, so it is left out of the build's output.
+        self._source_time_lock = threading.Lock()
+
     def add_source_time(self, source: int):
-        if source > BUILD_START_TIME:
-            logger.warning("Source built after build started.")
-        elif self.mtime_clamp == BUILD_START_TIME:
-            self.mtime_clamp = source
-        else:
-            self.mtime_clamp = max(self.mtime_clamp, source + 1)
+        with self._source_time_lock:
+            if source > BUILD_START_TIME:
+                logger.warning("Source built after build started.")
+            elif self.mtime_clamp == BUILD_START_TIME:
+                self.mtime_clamp = source
+            else:
+                self.mtime_clamp = max(self.mtime_clamp, source + 1)
 
     def clamp_mtime(self, source: typ.Union[int, float]) -> int:
         return int(min(source, self.mtime_clamp))
 
     def to_output(self) -> typ.Dict[str, typ.Any]:
-        data: typ.Dict[str, typ.Any] = cattr.unstructure(self)
-        del data["folder"]
-        return data
+        # Field by field, dispatching on each value's own class; as the
+        #  annotations here name types cattrs cannot resolve (`Customisations`)
+        #  or base classes (`PluginLock`) that would drop fields.
+        lockfile = self.lockfile
+        return {
+            "lockfile": {
+                "matomo": cattr.unstructure(lockfile.matomo),
+                "plugin_locks": {
+                    name: cattr.unstructure(plugin_lock)
+                    for name, plugin_lock in lockfile.plugin_locks.items()
+                },
+                "distribution_hash": lockfile.distribution_hash,
+            },
+            "customisations": cattr.unstructure(self.customisations),
+            "extra_info": cattr.unstructure(self.extra_info),
+            "mtime_clamp": self.mtime_clamp,
+        }
 
     def add_removed_files(self, files: typ.Iterable[typ.Union[pathlib.Path, str]]):
         clean_files: typ.Set[str] = set()
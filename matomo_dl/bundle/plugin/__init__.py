@@ -1,55 +1,120 @@
 import logging
+import pathlib
 import typing as typ
+from concurrent.futures import Executor, Future
 
-from matomo_dl.bundle.extract import extract_zip_file
+import attr
+
+from matomo_dl.bundle.artifacts import fetch_artifact, plugin_artifact
+from matomo_dl.bundle.fs_util import PathFilter
 from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.bundle.tree_cache import extract_archive
 from matomo_dl.distribution.lock import VersionedPluginLock
-from matomo_dl.errors import DownloadHashMismatch
-from matomo_dl.lock.plugin.versioned import (
-    get_cache_key,
-    get_plugin_data,
-    plugin_request,
-)
+from matomo_dl.errors import PluginConflictError
+from matomo_dl.lock.plugin.versioned import get_plugin_data
 from matomo_dl.progress import progressbar
 from matomo_dl.session import SessionStore
 
 logger = logging.getLogger(__name__)
 
 
-def extract_plugins(
-    session: SessionStore, license_key: typ.Optional[str], build: BuildInformation
-):
-    plugin_locks = build.lockfile.plugin_locks
-    with progressbar(plugin_locks.items(), label="Extracting plugins") as bar:
-        for name, plugin_lock in bar:
-            if isinstance(plugin_lock, VersionedPluginLock):
-                extract_versioned_plugin(session, license_key, build, name, plugin_lock)
-            else:
-                raise ValueError()
+@attr.s(frozen=True)
+class PluginSource:
+
+    name: str = attr.ib()  # As installed, ie. `plugins/<name>`
+    archive: pathlib.Path = attr.ib()
+    lock: VersionedPluginLock = attr.ib()
 
 
-def extract_versioned_plugin(
+def acquire_versioned_plugin(
     session: SessionStore,
     license_key: typ.Optional[str],
-    build: BuildInformation,
     name: str,
     lock: VersionedPluginLock,
+) -> PluginSource:
+    # Only the lock decides where the plugin goes; so a build is the same
+    #  online or offline.
+    plugin_name = lock.name or name
+    if not session.offline:
+        plugin = get_plugin_data(session, license_key, name)
+        plugin.assert_downloadable()  # We perform a license check every build.
+        if plugin.name != plugin_name:
+            logger.warning(
+                f"The plugin {name!r} is named {plugin.name!r} by the marketplace; "
+                "run 'update' to install it under that name"
+            )
+    data = fetch_artifact(session, license_key, plugin_artifact(name, lock))
+    return PluginSource(plugin_name, data, lock)
+
+
+def acquire_plugins(
+    session: SessionStore,
+    license_key: typ.Optional[str],
+    build: BuildInformation,
+    pool: Executor,
+) -> typ.List[PluginSource]:
+    futures = []
+    for name, plugin_lock in build.lockfile.plugin_locks.items():
+        if isinstance(plugin_lock, VersionedPluginLock):
+            futures.append(
+                pool.submit(
+                    acquire_versioned_plugin, session, license_key, name, plugin_lock
+                )
+            )
+        else:
+            raise ValueError()
+    # In lock order, whichever finishes first.
+    return [future.result() for future in futures]
+
+
+def check_plugin_conflicts(
+    plugins: typ.Iterable[PluginSource], core_plugins: typ.Collection[str] = ()
 ):
-    plugin = get_plugin_data(session, license_key, name)
-    plugin.assert_downloadable()  # We perform a license check every build.
-    cache_key = get_cache_key(name, lock.version)
-
-    data = session.retrieve_cache_data(cache_key, lock.hash)
-    if not data:
-        r = plugin_request(session, lock.link, license_key=license_key)
-        data = r.content
-        assert data is not None
-        data_hash = session.store_cache_data(cache_key, data)
-        if lock.hash != data_hash:
-            raise DownloadHashMismatch()
-
-    latest_mtime = extract_zip_file(
-        data, build.folder / "plugins" / plugin.name, root=lock.extraction_root
+    # Every plugin is extracted into its own folder at the same time; so two
+    #  sources sharing a folder would silently overwrite each other.
+    seen: typ.Set[str] = set()
+    for plugin in plugins:
+        if plugin.name in core_plugins:
+            raise PluginConflictError(
+                f"The plugin {plugin.name} would overwrite the one bundled with Matomo"
+            )
+        if plugin.name in seen:
+            raise PluginConflictError(
+                f"The plugin {plugin.name} is included more than once"
+            )
+        seen.add(plugin.name)
+
+
+def extract_plugin(
+    session: SessionStore,
+    build: BuildInformation,
+    plugin: PluginSource,
+    path_filter: typ.Optional[PathFilter] = None,
+    pool: typ.Optional[Executor] = None,
+) -> typ.Optional[int]:
+    return extract_archive(
+        session,
+        plugin.archive,
+        plugin.lock.hash,
+        build.folder / "plugins" / plugin.name,
+        root=plugin.lock.extraction_root,
+        path_filter=path_filter,
+        pool=pool,
     )
-    assert latest_mtime is not None
-    build.add_source_time(latest_mtime)
+
+
+def add_source_times(
+    build: BuildInformation,
+    futures: typ.Sequence["Future[typ.Optional[int]]"],
+    label: str,
+):
+    with progressbar(length=len(futures), label=label) as bar:
+        latest_mtimes = []
+        for future in futures:
+            latest_mtimes.append(future.result())
+            bar.update(1)
+    # In the order the futures were given rather than completed; as the
+    #  resulting clamp depends on it.
+    for latest_mtime in latest_mtimes:
+        assert latest_mtime is not None
+        build.add_source_time(latest_mtime)
@@ -0,0 +1,122 @@
+import errno
+import logging
+import os
+import pathlib
+import tarfile
+import typing as typ
+
+logger = logging.getLogger(__name__)
+COPY_CHUNK_SIZE = 1024 * 1024
+# Raised by a copy method that cannot be used between these two files; so
+#  the next one is tried instead.
+UNSUPPORTED_ERRNOS = frozenset(
+    (
+        errno.EINVAL,
+        errno.EXDEV,
+        errno.ENOSYS,
+        errno.EOPNOTSUPP,
+        errno.ENOTSOCK,
+        errno.EBADF,
+        errno.ESPIPE,
+    )
+)
+
+
+def copy_range(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(in_fd, out_fd, count, offset)
+
+
+def send_range(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+
+def read_write_range(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    data = os.pread(in_fd, min(count, COPY_CHUNK_SIZE), offset)
+    write_all(out_fd, data)
+    return len(data)
+
+
+COPY_METHODS: typ.Sequence[typ.Tuple[str, typ.Callable[[int, int, int, int], int]]] = (
+    tuple(
+        (name, method)
+        for name, method, available in (
+            ("copy_file_range", copy_range, hasattr(os, "copy_file_range")),
+            ("sendfile", send_range, hasattr(os, "sendfile")),
+            ("read", read_write_range, True),
+        )
+        if available
+    )
+)
+
+
+def write_all(fd: int, data: typ.Union[bytes, bytearray]) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+class TarWriter:
+    # Writes the same bytes as `tarfile.TarFile(mode="w")` and `addfile`, but
+    #  moves the file bodies in the kernel where it can; so large uncompressed
+    #  archives are bound by I/O rather than the interpreter.
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.offset = 0
+        self.method = 0
+        self._pending = bytearray()
+
+    def _write(self, data: bytes) -> None:
+        # Headers and padding are gathered up, and written along with the
+        #  next file body.
+        self._pending += data
+        self.offset += len(data)
+
+    def _flush(self) -> None:
+        write_all(self.fd, self._pending)
+        self._pending = bytearray()
+
+    def addfile(
+        self, tar_info: tarfile.TarInfo, path: typ.Optional[pathlib.Path] = None
+    ) -> None:
+        self._write(
+            tar_info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+        )
+        if path is None:
+            return
+        self._flush()
+        in_fd = os.open(str(path), os.O_RDONLY)
+        try:
+            self.copy_body(in_fd, tar_info.size)
+        finally:
+            os.close(in_fd)
+        self.offset += tar_info.size
+        remainder = tar_info.size % tarfile.BLOCKSIZE
+        if remainder:
+            self._write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+
+    def copy_body(self, in_fd: int, size: int) -> None:
+        copied = 0
+        while copied < size:
+            name, method = COPY_METHODS[self.method]
+            try:
+                count = method(in_fd, self.fd, copied, size - copied)
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or self.method + 1 >= len(
+                    COPY_METHODS
+                ):
+                    raise
+                logger.debug(f"Cannot {name} into the archive: {e}")
+                self.method += 1
+                continue
+            if not count:
+                raise OSError("unexpected end of data")
+            copied += count
+
+    def close(self) -> None:
+        # The end-of-archive marker, padded out to a whole record.
+        self._write(tarfile.NUL * (tarfile.BLOCKSIZE * 2))
+        remainder = self.offset % tarfile.RECORDSIZE
+        if remainder:
+            self._write(tarfile.NUL * (tarfile.RECORDSIZE - remainder))
+        self._flush()
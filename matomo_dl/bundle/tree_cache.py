@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+import typing as typ
+from concurrent.futures import Executor
+
+from matomo_dl.hashing import HashInfo
+from matomo_dl.session import SessionStore
+from matomo_dl.session.blobs import BlobStore, split_hash_info
+from .extract import extract_zip_file
+from .fs_util import PathFilter, clone_tree
+
+logger = logging.getLogger(__name__)
+
+
+class TreeCache:
+    # Pristine extracted trees, keyed by archive digest and extraction root.
+    #  Builds are populated from these by reflink, hardlink or copy; so the
+    #  trees must never be modified in place (see `fs_util.break_link`).
+
+    folder: pathlib.Path
+
+    def __init__(self, folder: pathlib.Path):
+        self.folder = folder
+
+    @classmethod
+    def for_blobs(cls, blobs: BlobStore) -> "TreeCache":
+        return cls(blobs.folder / "trees")
+
+    @property
+    def tmp_dir(self) -> pathlib.Path:
+        return self.folder / "tmp"
+
+    def entry_path(self, archive_hash: HashInfo, root: str) -> pathlib.Path:
+        algo, digest = split_hash_info(archive_hash)
+        root_key = hashlib.sha256(root.encode()).hexdigest()[:16]
+        return self.folder / algo / digest[:2] / f"{digest}-{root_key}"
+
+    def lookup(
+        self, archive_hash: HashInfo, root: str
+    ) -> typ.Optional[typ.Tuple[pathlib.Path, typ.Optional[int]]]:
+        entry = self.entry_path(archive_hash, root)
+        try:
+            latest_mtime = (entry / "latest_mtime").read_text().strip()
+        except FileNotFoundError:
+            return None
+        return entry / "tree", int(latest_mtime) if latest_mtime else None
+
+    def store(
+        self,
+        archive: pathlib.Path,
+        archive_hash: HashInfo,
+        root: str,
+        progress: typ.Optional[str] = None,
+        pool: typ.Optional[Executor] = None,
+    ) -> typ.Tuple[pathlib.Path, typ.Optional[int]]:
+        entry = self.entry_path(archive_hash, root)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_entry = pathlib.Path(tempfile.mkdtemp(dir=str(self.tmp_dir)))
+        try:
+            latest_mtime = extract_zip_file(
+                archive, tmp_entry / "tree", root=root, progress=progress, pool=pool
+            )
+            latest_str = "" if latest_mtime is None else str(latest_mtime)
+            # Written last, as it marks the entry as complete.
+            (tmp_entry / "latest_mtime").write_text(latest_str)
+            entry.parent.mkdir(parents=True, exist_ok=True)
+            os.rename(str(tmp_entry), str(entry))
+        except OSError:
+            if self.lookup(archive_hash, root) is None:
+                raise
+            # Another build stored the same tree first.
+        finally:
+            shutil.rmtree(str(tmp_entry), ignore_errors=True)
+        return entry / "tree", latest_mtime
+
+    def iter_entries(self) -> typ.Iterator[typ.Tuple[HashInfo, pathlib.Path]]:
+        for entry in sorted(self.folder.glob("*/??/*-*")):
+            algo = entry.parent.parent.name
+            if algo == self.tmp_dir.name:
+                continue
+            yield f"{algo}:{entry.name.rpartition('-')[0]}", entry
+
+    def usage(self) -> typ.Tuple[int, int]:
+        count = size = 0
+        for _, entry in self.iter_entries():
+            count += 1
+            size += sum(
+                path.lstat().st_size for path in entry.rglob("*") if path.is_file()
+            )
+        return count, size
+
+    def prune(self, keep: typ.Collection[HashInfo], dry: bool = False) -> int:
+        pruned = 0
+        for archive_hash, entry in self.iter_entries():
+            if archive_hash in keep:
+                continue
+            pruned += 1
+            if not dry:
+                shutil.rmtree(str(entry))
+        return pruned
+
+
+def get_tree_cache(session: SessionStore) -> typ.Optional[TreeCache]:
+    # Paranoid builds always extract from the (re-verified) archive.
+    if not session.tree_cache or session.cache_blobs is None:
+        return None
+    if session.cache_blobs.paranoid:
+        return None
+    return TreeCache.for_blobs(session.cache_blobs)
+
+
+def extract_archive(
+    session: SessionStore,
+    archive: pathlib.Path,
+    archive_hash: HashInfo,
+    destination: pathlib.Path,
+    root: str,
+    progress: typ.Optional[str] = None,
+    path_filter: typ.Optional[PathFilter] = None,
+    pool: typ.Optional[Executor] = None,
+) -> typ.Optional[int]:
+    trees = get_tree_cache(session)
+    if trees is None:
+        return extract_zip_file(
+            archive,
+            destination,
+            root=root,
+            progress=progress,
+            path_filter=path_filter,
+            pool=pool,
+        )
+    cached = trees.lookup(archive_hash, root)
+    if cached is None:
+        cached = trees.store(archive, archive_hash, root, progress=progress, pool=pool)
+    tree, latest_mtime = cached
+    # The cached tree is never filtered; only what is cloned out of it.
+    method = clone_tree(tree, destination, path_filter)
+    logger.info(f"Populated {destination} from {tree} using {method}")
+    return latest_mtime
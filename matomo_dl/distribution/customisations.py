@@ -79,6 +79,18 @@ class RemoveCustomisation(Customisation):
             ),
         )
 
+    def get_removal_rules(self) -> typ.List[remove.RemovalRules]:
+        return [
+            rules
+            for include, rules in (
+                (self.build_support, remove.BUILD_SUPPORT_RULES),
+                (self.documentation, remove.DOCUMENTATION_RULES),
+                (self.example_plugins, remove.EXAMPLE_PLUGINS_RULES),
+                (self.vendored_extras, remove.VENDORED_EXTRAS_RULES),
+            )
+            if include
+        ]
+
 
 @attr.s
 class UpdateCustomisation(Customisation):
@@ -42,6 +42,10 @@ def load_from_distribution_path(
     return dist, lock
 
 
+def load_lockfile(lockfile: pathlib.Path) -> typ.Optional[DistributionLockFile]:
+    return unstringify_distribution_lock(lockfile.read_text())
+
+
 def write_lockfile_using_distribution_path(
     distribution_file: pathlib.Path, locks: DistributionLockFile
 ):
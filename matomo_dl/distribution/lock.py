@@ -31,6 +31,9 @@ class VersionedPluginLock(PluginLock):
     version: str = attr.ib()
     link: str = attr.ib()
     hash: HashInfo = attr.ib()
+    # The marketplace's name for the plugin, which it is installed as. Locks
+    #  from before it was recorded install the plugin under its lock key.
+    name: typ.Optional[str] = attr.ib(default=None)
 
 
 @attr.s
@@ -56,6 +59,15 @@ class DistributionLockFile:
     distribution_hash: str = attr.ib()
 
 
+def lock_hashes(dist_lock: DistributionLockFile) -> typ.FrozenSet[HashInfo]:
+    hashes = {dist_lock.matomo.hash}
+    for plugin_lock in dist_lock.plugin_locks.values():
+        plugin_hash = getattr(plugin_lock, "hash", None)
+        if plugin_hash:
+            hashes.add(plugin_hash)
+    return frozenset(hashes)
+
+
 def unstringify_distribution_lock(dist_lock: str) -> typ.Optional[DistributionLockFile]:
     try:
         data = toml.loads(dist_lock)
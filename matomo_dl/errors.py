@@ -12,3 +12,11 @@ class VersionError(MatomoError):
 
 class DownloadHashMismatch(MatomoError):
     ...
+
+
+class OfflineError(MatomoError):
+    ...
+
+
+class PluginConflictError(MatomoError):
+    ...
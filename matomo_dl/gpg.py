@@ -1,3 +1,4 @@
+import pathlib
 import random
 import shutil
 import subprocess  # noqa: S404 -- subprocess usage is safe
@@ -87,7 +88,10 @@ class GpgVerifier:
         with tempfile.NamedTemporaryFile("wb") as data_file:
             data_file.write(data)
             data_file.flush()
-            try:
-                self.gpg_call("--verify", "-", data_file.name, input=signature)
-            except subprocess.CalledProcessError as e:
-                raise VerificationError() from e
+            self.verify_file(pathlib.Path(data_file.name), signature)
+
+    def verify_file(self, data_file: pathlib.Path, signature: bytes):
+        try:
+            self.gpg_call("--verify", "-", str(data_file), input=signature)
+        except subprocess.CalledProcessError as e:
+            raise VerificationError() from e
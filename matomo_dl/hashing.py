@@ -1,27 +1,135 @@
-import functools
 import hashlib
+import os
+import pathlib
+import threading
 import typing as typ
+from collections import OrderedDict
 
 HashInfo = str
+Chunk = typ.Union[bytes, bytearray, memoryview]
 
 
 desired_algorithms = ["sha256"]
+# Any of these may appear in a `HashInfo`, ie. `blake2b:<hex>`.
+supported_algorithms = frozenset(
+    algo
+    for algo in ("sha256", "sha512", "blake2b", "blake2s", "sha3_256")
+    if algo in hashlib.algorithms_available
+)
+HASH_CHUNK_SIZE = 1024 * 1024
+FILE_HASH_CACHE_SIZE = 1024
 
 
-def all_hashes_for_data(data: bytes) -> HashInfo:
-    return ":".join(next(hashes_for_data(data)))
+def hash_algorithm(hash_info: HashInfo) -> str:
+    algo, sep, _ = hash_info.partition(":")
+    if not sep or algo not in supported_algorithms:
+        raise ValueError(f"Unsupported hash {hash_info!r}")
+    return algo
 
 
-def hashes_for_data(data: bytes) -> typ.Iterator[typ.Tuple[str, str]]:
-    hashed = False
-    for algo in desired_algorithms:
-        if algo in hashlib.algorithms_available:
-            hashed = True
-            yield (algo, hashlib.new(algo, data).hexdigest())
-    assert hashed
+class MultiHasher:
+    # Computes every requested digest in a single pass over the data. hashlib
+    #  releases the GIL while hashing large chunks, so this runs in parallel
+    #  with other threads.
 
+    def __init__(self, algorithms: typ.Optional[typ.Iterable[str]] = None) -> None:
+        names = desired_algorithms if algorithms is None else algorithms
+        self.hashers = [(algo, hashlib.new(algo)) for algo in dict.fromkeys(names)]
+        assert self.hashers
 
-@functools.lru_cache()
-def hash_for_data(data: bytes, algo: str) -> str:
-    assert algo in hashlib.algorithms_available
-    return hashlib.new(algo, data).hexdigest()
+    def update(self, data: Chunk) -> None:
+        for _, hasher in self.hashers:
+            hasher.update(data)
+
+    def update_from(
+        self, source: typ.Union[typ.IO[bytes], typ.Iterable[Chunk]]
+    ) -> "MultiHasher":
+        if hasattr(source, "readinto"):
+            buffer = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                size = source.readinto(buffer)
+                if not size:
+                    break
+                self.update(view[:size])
+        else:
+            for chunk in source:
+                self.update(chunk)
+        return self
+
+    def hash_info(self, algorithm: typ.Optional[str] = None) -> HashInfo:
+        for algo, hasher in self.hashers:
+            if algorithm is None or algo == algorithm:
+                return f"{algo}:{hasher.hexdigest()}"
+        raise ValueError(f"{algorithm} was not computed")
+
+    def all_hash_infos(self) -> typ.List[HashInfo]:
+        return [f"{algo}:{hasher.hexdigest()}" for algo, hasher in self.hashers]
+
+
+def hash_stream(
+    source: typ.Union[typ.IO[bytes], typ.Iterable[Chunk]],
+    algorithm: typ.Optional[str] = None,
+) -> HashInfo:
+    algorithms = None if algorithm is None else [algorithm]
+    return MultiHasher(algorithms).update_from(source).hash_info()
+
+
+def all_hashes_for_data(data: Chunk, algorithm: typ.Optional[str] = None) -> HashInfo:
+    return hash_stream([memoryview(data)], algorithm)
+
+
+class FileHashCache:
+    # Keyed by the file's identity and stat rather than its content; so a
+    #  file is only re-read once it has changed.
+
+    def __init__(self, size: int = FILE_HASH_CACHE_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries: typ.MutableMapping[typ.Tuple, HashInfo] = OrderedDict()
+
+    @staticmethod
+    def key(file: pathlib.Path, stat: os.stat_result, algorithm: str) -> typ.Tuple:
+        return (
+            str(file),
+            algorithm,
+            stat.st_dev,
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ctime_ns,
+        )
+
+    def get(self, key: typ.Tuple) -> typ.Optional[HashInfo]:
+        with self._lock:
+            hash_info = self._entries.get(key)
+            if hash_info is not None:
+                self._entries.move_to_end(key)  # type: ignore
+            return hash_info
+
+    def put(self, key: typ.Tuple, hash_info: HashInfo) -> None:
+        with self._lock:
+            self._entries[key] = hash_info
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)  # type: ignore
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+file_hash_cache = FileHashCache()
+
+
+def all_hashes_for_file(
+    file: pathlib.Path, algorithm: typ.Optional[str] = None, cached: bool = True
+) -> HashInfo:
+    algorithm = algorithm or desired_algorithms[0]
+    with file.open("rb") as f:
+        stat = os.fstat(f.fileno())
+        key = FileHashCache.key(file, stat, algorithm)
+        hash_info = file_hash_cache.get(key) if cached else None
+        if hash_info is None:
+            hash_info = hash_stream(f, algorithm)
+            file_hash_cache.put(key, hash_info)
+    return hash_info
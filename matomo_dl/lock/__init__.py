@@ -1,15 +1,21 @@
+import pathlib
 import tarfile
 import typing as typ
 import zipfile
 from io import BytesIO
 
 
-def get_zip_extraction_root(zip_data, root_file) -> typ.Optional[str]:
+def get_zip_extraction_root(
+    zip_data: typ.Union[pathlib.Path, bytes], root_file: str
+) -> typ.Optional[str]:
     if root_file[0:2] == "./":
         root_file = root_file[2:]
     root_file = root_file.lstrip("/")
     root = None
-    with zipfile.ZipFile(BytesIO(zip_data)) as zipf:
+    source: typ.Union[pathlib.Path, typ.IO[bytes]] = (
+        BytesIO(zip_data) if isinstance(zip_data, bytes) else zip_data
+    )
+    with zipfile.ZipFile(source) as zipf:
         for name in zipf.namelist():
             root_folder, file, _ = name.rpartition(root_file)
             if file == root_file and root_folder[-1] == "/":
@@ -1,14 +1,15 @@
 import logging
+import pathlib
 import re
 import typing as typ
 from urllib.parse import urljoin
 
 import bs4
-import requests
 
 from matomo_dl.distribution.lock import MatomoLock
 from matomo_dl.distribution.version import Version
 from matomo_dl.gpg import GpgVerifier, KeyImportError, VerificationError
+from matomo_dl.hashing import HashInfo
 from matomo_dl.lock import get_zip_extraction_root
 from matomo_dl.session import SessionStore
 
@@ -33,13 +34,14 @@ def sync_matomo_lock(
         return existing_lock
     logger.info(f"Downloading matomo version {version_spec}")
     cache_key = get_cache_key(version)
-    url, data = get_matomo_version(session, version)
-    logger.info("Determining extraction root")
-    base_path = get_zip_extraction_root(data, "piwik.php")
-    if not base_path:
-        logger.error("Cannot determine how to extract Matomo!")
-        raise ValueError("")
-    data_hash = session.store_cache_data(cache_key, data)
+    with session.cache_lock(cache_key):
+        url, data, data_hash = get_matomo_version(session, version)
+        logger.info("Determining extraction root")
+        base_path = get_zip_extraction_root(data, "piwik.php")
+        if not base_path:
+            logger.error("Cannot determine how to extract Matomo!")
+            session.remove_cache_data(cache_key)
+            raise ValueError("")
     lock = MatomoLock(
         version=version, link=url, hash=data_hash, extraction_root=base_path
     )
@@ -48,13 +50,14 @@ def sync_matomo_lock(
 
 
 def get_matomo_version(
-    session: requests.Session, version: str
-) -> typ.Tuple[str, bytes]:
+    session: SessionStore, version: str
+) -> typ.Tuple[str, pathlib.Path, HashInfo]:
     dl_url = f"{BUILDS_URL}/matomo-{version}.zip"
     asc_url = f"{BUILDS_URL}/matomo-{version}.zip.asc"
     logger.info(f"Downloading Matomo release {version}")
-    r = session.get(dl_url)
-    zip_file = r.content
+    cache_key = get_cache_key(version)
+    r = session.get(dl_url, stream=True)
+    zip_file, zip_hash = session.store_cache_response(cache_key, r)
     r = session.get(asc_url)
     r.raise_for_status()
     zip_file_sig = r.content
@@ -62,19 +65,19 @@ def get_matomo_version(
     with GpgVerifier() as verifier:
         try:
             verifier.load_fingerprint("0x814E346FA01A20DBB04B6807B5DBD5925590A237")
-            verifier.verify(zip_file, zip_file_sig)
+            verifier.verify_file(zip_file, zip_file_sig)
         except KeyImportError:
             logger.error("Unable to import the Matomo release keys.")
+            session.remove_cache_data(cache_key)
             raise
         except VerificationError:
             logger.error("Signature does not match file.")
+            session.remove_cache_data(cache_key)
             raise
-    return dl_url, zip_file
+    return dl_url, zip_file, zip_hash
 
 
-def resolve_matomo_version_spec(
-    session: requests.Session, version_spec: Version
-) -> str:
+def resolve_matomo_version_spec(session: SessionStore, version_spec: Version) -> str:
     logger.info(f"Getting latest matomo version from API")
     latest = get_latest_matomo_version(session)
     if version_spec.choose_version([latest]):
@@ -92,14 +95,14 @@ def resolve_matomo_version_spec(
             raise ValueError("No supported versions")
 
 
-def get_latest_matomo_version(session: requests.Session) -> str:
-    resp = session.get(f"{API_URL}/1.0/getLatestVersion/")
+def get_latest_matomo_version(session: SessionStore) -> str:
+    resp = session.request_metadata("GET", f"{API_URL}/1.0/getLatestVersion/")
     resp.raise_for_status()
     return resp.text.strip()
 
 
-def get_all_matomo_versions(session: requests.Session) -> typ.Collection[str]:
-    resp = session.get(BUILDS_URL)
+def get_all_matomo_versions(session: SessionStore) -> typ.Collection[str]:
+    resp = session.request_metadata("GET", BUILDS_URL)
     resp.raise_for_status()
     base_url = resp.url
     logger.info("Got version listing, parsing with BeautifulSoup")
@@ -1,3 +1,4 @@
+import functools
 import logging
 import typing as typ
 from urllib.parse import urljoin
@@ -28,47 +29,51 @@ def sync_versioned_plugin_lock(
     version_spec: Version,
     existing_lock: typ.Optional[VersionedPluginLock],
 ) -> VersionedPluginLock:
-    version, dl_url = resolve_plugin_version_spec(
+    plugin_name, version, dl_url = resolve_plugin_version_spec(
         session, php_version, matomo_version, license_key, version_spec, name
     )
     if existing_lock and version == existing_lock.version:
-        return existing_lock
+        return attr.evolve(existing_lock, name=plugin_name)
 
     cache_key = get_cache_key(name, version)
-    resp = plugin_request(session, dl_url, license_key=license_key)
-    resp.raise_for_status()
-    data = resp.content
-
-    base_path = get_zip_extraction_root(data, "plugin.json")
-    if not base_path:
-        logger.error("Cannot determine how to extract plugin!")
-        raise ValueError("Unable to determine path")
-    hashes = session.store_cache_data(cache_key, data)
+    with session.cache_lock(cache_key):
+        resp = plugin_request(session, dl_url, license_key=license_key, stream=True)
+        data, hashes = session.store_cache_response(cache_key, resp)
+
+        base_path = get_zip_extraction_root(data, "plugin.json")
+        if not base_path:
+            logger.error("Cannot determine how to extract plugin!")
+            session.remove_cache_data(cache_key)
+            raise ValueError("Unable to determine path")
     return VersionedPluginLock(
-        version=version, link=dl_url, extraction_root=base_path, hash=hashes
+        version=version,
+        link=dl_url,
+        extraction_root=base_path,
+        hash=hashes,
+        name=plugin_name,
     )
 
 
 def resolve_plugin_version_spec(
-    session: requests.Session,
+    session: SessionStore,
     php_version: typ.Optional[str],
     matomo_version: str,
     license_key: typ.Optional[str],
     version_spec: Version,
     name: str,
-) -> typ.Tuple[str, str]:
-    latest, all_versions = get_all_plugin_versions(
+) -> typ.Tuple[str, str, str]:
+    plugin_name, latest, all_versions = get_all_plugin_versions(
         session, php_version, matomo_version, license_key, name
     )
     if not latest and not all_versions:
         logger.error(f"There are no versions of {name} that are supported.")
         raise VersionError(f"No versions returned for {name}")
     elif latest and version_spec.choose_version([latest]):
-        return latest, all_versions[latest]
+        return plugin_name, latest, all_versions[latest]
     else:
         version = version_spec.choose_version(set(all_versions))
         if version:
-            return version, all_versions[version]
+            return plugin_name, version, all_versions[version]
         else:
             logger.error(
                 f"There are no versions of {name} that "
@@ -111,7 +116,7 @@ class PluginData:
 
 
 def get_plugin_data(
-    session: requests.Session,
+    session: SessionStore,
     license_key: typ.Optional[str],
     name: str,
     matomo_version: typ.Optional[str] = None,
@@ -119,7 +124,7 @@ def get_plugin_data(
     url = f"{PLUGIN_API_URL}/api/2.0/plugins/{name}/info"
     if matomo_version:
         url += f"?coreVersion={matomo_version}"
-    resp = plugin_request(session, url, license_key=license_key)
+    resp = plugin_request(session, url, license_key=license_key, revalidate=True)
     resp.raise_for_status()
     data = resp.json()
     return PluginData(
@@ -133,12 +138,14 @@ def get_plugin_data(
 
 
 def get_all_plugin_versions(
-    session: requests.Session,
+    session: SessionStore,
     php_version: typ.Optional[str],
     matomo_version: str,
     license_key: typ.Optional[str],
     name: str,
-) -> typ.Tuple[typ.Optional[str], typ.Mapping[str, str]]:
+) -> typ.Tuple[str, typ.Optional[str], typ.Mapping[str, str]]:
+    # Returns the plugin's canonical name, its latest version (if supported)
+    #  and the download link of each supported version.
     data = get_plugin_data(session, license_key, name, matomo_version)
     data.assert_downloadable()
     latest_version = data.latest_version
@@ -158,31 +165,39 @@ def get_all_plugin_versions(
             f"There are no versions of {name!r} supported on"
             f" Matomo {matomo_version} and PHP {php_version}."
         )
-        return (None, {})
+        return (data.name, None, {})
     if latest_version not in filtered_versions:
         logger.warning(
             f"The latest version of {name!r} is not supported on"
             f" Matomo {matomo_version} and PHP {php_version}."
         )
-        return None, filtered_versions
+        return data.name, None, filtered_versions
     else:
-        return latest_version, filtered_versions
+        return data.name, latest_version, filtered_versions
 
 
 def plugin_request(
-    session: requests.Session, *a, license_key: typ.Optional[str] = None, **k
+    session: SessionStore,
+    *a,
+    license_key: typ.Optional[str] = None,
+    revalidate: bool = False,
+    **k,
 ) -> requests.Response:
+    post: typ.Callable[..., requests.Response]
+    if revalidate:
+        post = functools.partial(session.request_metadata, "POST", secret=license_key)
+    else:
+        post = session.post
     if not license_key:
-        return session.post(*a, **k)
-    data = None
+        return post(*a, **k)
     if "data" not in k:
         k["data"] = {"access_token": license_key}
     elif isinstance(k["data"], typ.MutableMapping):
         k["data"].setdefault("access_token", license_key)
-    resp = session.post(*a, **k)
+    resp = post(*a, **k)
     if resp.status_code in [401, 403]:
         logger.warning("License key denied. Contact Matomo for support.")
         if "data" in k and isinstance(k["data"], typ.MutableMapping):
             k["data"].pop("access_token", None)
-        return plugin_request(*a, **k, data=data)
+        return plugin_request(session, *a, revalidate=revalidate, **k)
     return resp
@@ -1,5 +1,6 @@
 import logging
 import pathlib
+import re
 import typing as typ
 from datetime import timedelta
 from types import MappingProxyType
@@ -22,17 +23,37 @@ SUPPORTED_CACHE_LEVELS = frozenset(
 )
 MAX_SUPPORTED_CACHE_LEVEL = max(SUPPORTED_CACHE_LEVELS)
 DEFAULT_CACHE_LEVEL = min(2, MAX_SUPPORTED_CACHE_LEVEL)
+SIZE_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)\s*([kmgt]?i?b?)", re.IGNORECASE)
+SIZE_UNITS = MappingProxyType(
+    {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4}
+)
 
 
 def create_session(
     cache_dir: typ.Union[pathlib.Path, str, None],
     level: typ.Union[str, int, float, None],
     clear: bool = False,
+    paranoid: bool = False,
+    max_size: typ.Union[str, int, None] = None,
+    offline: bool = False,
+    upstream: typ.Optional[str] = None,
+    layers: typ.Sequence[typ.Union[pathlib.Path, str]] = (),
+    promote: bool = False,
+    tree_cache: bool = False,
 ) -> SessionStore:
     cache_level = standardise_level(level)
     del level  # Prevent bugs if we accidentally reuse `level`
+    store_options: typ.Dict[str, typ.Any] = {
+        "paranoid": paranoid,
+        "max_size": standardise_size(max_size),
+        "offline": offline,
+        "upstream": upstream,
+        "layers": [pathlib.Path(layer) for layer in layers],
+        "promote": promote,
+        "tree_cache": tree_cache,
+    }
     if not cache_dir or cache_level == 0:
-        return SessionStore(cache_dir=None)
+        return SessionStore(cache_dir=None, **store_options)
     else:
         cache_dir = pathlib.Path(cache_dir)
         cache_dir.resolve(strict=False)
@@ -40,21 +61,28 @@ def create_session(
             remove_dir(cache_dir)
         cache_dir.mkdir(parents=True, exist_ok=True)
         if cache_level == CACHE_LEVEL_NAMES["memory"]:
-            return create_cached_session_store(cache_dir=cache_dir, backend="memory")
+            return create_cached_session_store(
+                cache_dir=cache_dir, backend="memory", **store_options
+            )
         elif cache_level == CACHE_LEVEL_NAMES["persistent"]:
-            return create_cached_session_store(cache_dir=cache_dir, backend="sqlite")
+            return create_cached_session_store(
+                cache_dir=cache_dir, backend="sqlite", **store_options
+            )
         else:
-            return SessionStore(cache_dir=cache_dir)
+            return SessionStore(cache_dir=cache_dir, **store_options)
 
 
-def create_cached_session_store(cache_dir: pathlib.Path, backend: str) -> SessionStore:
+def create_cached_session_store(
+    cache_dir: pathlib.Path, backend: str, **store_options: typ.Any
+) -> SessionStore:
     if not CachingSessionStore:
         logger.warning(
             "CachingSessionStore is unavaliable due to a "
             "lack of the underlying library."
         )
-        return SessionStore(cache_dir=cache_dir)
+        return SessionStore(cache_dir=cache_dir, **store_options)
     common = {
+        **store_options,
         "allowable_methods": ["GET", "POST"],
         "old_data_on_error": False,
         "expire_after": timedelta(days=7),
@@ -96,6 +124,22 @@ def standardise_level(level: typ.Union[str, int, float, None]) -> int:
     return cache_level
 
 
+def standardise_size(size: typ.Union[str, int, None]) -> typ.Optional[int]:
+    if size is None or size == "":
+        return None
+    elif isinstance(size, int):
+        value = size
+    else:
+        match = SIZE_RE.fullmatch(str(size).strip())
+        if not match:
+            raise ValueError(f"Cannot parse the size {size!r}")
+        number, unit = match.groups()
+        value = int(float(number) * SIZE_UNITS[unit.lower().rstrip("b").rstrip("i")])
+    if value < 0:
+        raise ValueError(f"The size {size!r} is negative")
+    return value
+
+
 def remove_dir(input_path: pathlib.Path):
     if not input_path.exists():
         return
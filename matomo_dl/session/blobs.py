@@ -0,0 +1,436 @@
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import threading
+import time
+import typing as typ
+from contextlib import ExitStack, contextmanager
+
+from matomo_dl.errors import DownloadHashMismatch
+from matomo_dl.hashing import (
+    HashInfo,
+    MultiHasher,
+    all_hashes_for_file,
+    hash_algorithm,
+)
+from .index import CacheIndex
+from .metrics import SessionMetrics
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+CACHE_KEY_RE = re.compile(r"^[0-9a-z\-_.]+$")
+HASH_INFO_RE = re.compile(r"^([0-9a-z_\-]+):([0-9a-f]+)$")
+# Blobs used more recently than this are never evicted; another build may
+#  have resolved one and not opened it yet.
+EVICTION_GRACE = 15 * 60
+
+
+def read_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# `mkstemp` creates owner-only files, which a shared cache cannot use; so
+#  they are given the mode `open` would have. Read once, at import, as
+#  reading the umask briefly changes it for every thread.
+FILE_MODE = 0o666 & ~read_umask()
+
+
+def split_hash_info(hash_info: HashInfo) -> typ.Tuple[str, str]:
+    match = HASH_INFO_RE.match(hash_info)
+    if not match:
+        raise ValueError(f"Invalid hash {hash_info!r}")
+    return match.group(1), match.group(2)
+
+
+# Content-addressed storage: blobs live at `blobs/<algorithm>/<xx>/<digest>`,
+#  with a small `names/<cache_key>` index recording the digest last stored
+#  under each cache key.
+class BlobStore:
+
+    folder: pathlib.Path
+    index: typ.Optional[CacheIndex]
+    paranoid: bool
+    read_only: bool
+    metrics: SessionMetrics
+
+    def __init__(
+        self,
+        folder: pathlib.Path,
+        index: typ.Optional[CacheIndex] = None,
+        paranoid: bool = False,
+        read_only: bool = False,
+        metrics: typ.Optional[SessionMetrics] = None,
+    ):
+        self.folder = pathlib.Path(folder)
+        self.index = index
+        self.paranoid = paranoid
+        self.read_only = read_only
+        self.metrics = SessionMetrics() if metrics is None else metrics
+        self._local = threading.local()
+
+    @classmethod
+    def read_only_layer(
+        cls,
+        folder: pathlib.Path,
+        paranoid: bool = False,
+        metrics: typ.Optional[SessionMetrics] = None,
+    ):
+        index_file = pathlib.Path(folder) / "index.sqlite"
+        index = CacheIndex(index_file, read_only=True) if index_file.exists() else None
+        return cls(
+            folder, index=index, paranoid=paranoid, read_only=True, metrics=metrics
+        )
+
+    @property
+    def blob_dir(self) -> pathlib.Path:
+        return self.folder / "blobs"
+
+    @property
+    def names_dir(self) -> pathlib.Path:
+        return self.folder / "names"
+
+    @property
+    def tmp_dir(self) -> pathlib.Path:
+        return self.folder / "tmp"
+
+    @property
+    def locks_dir(self) -> pathlib.Path:
+        return self.folder / "locks"
+
+    def lock_path(self, cache_key: str) -> pathlib.Path:
+        assert CACHE_KEY_RE.match(cache_key)
+        return self.locks_dir / f"{cache_key}.lock"
+
+    @contextmanager
+    def lock(self, cache_key: str, blocking: bool = True) -> typ.Iterator[bool]:
+        # Advisory, so that concurrent builds sharing a cache wait on each
+        #  other's download rather than all fetching the same file. Yields
+        #  whether the lock was taken, which is only False when not blocking.
+        #  Re-entrant within a thread, so a key's blob can be discarded while
+        #  the key is held.
+        held: typ.Set[str] = self._local.__dict__.setdefault("held", set())
+        if cache_key in held:
+            yield True
+            return
+        self.locks_dir.mkdir(parents=True, exist_ok=True)
+        lock_file = acquire_lock_file(self.lock_path(cache_key), blocking)
+        if lock_file is None:
+            yield False
+            return
+        held.add(cache_key)
+        try:
+            yield True
+        finally:
+            held.discard(cache_key)
+            # Closing releases the lock.
+            lock_file.close()
+
+    def iter_locks(self) -> typ.Iterator[str]:
+        if not self.locks_dir.exists():
+            return
+        for lock_file in sorted(self.locks_dir.glob("*.lock")):
+            if CACHE_KEY_RE.match(lock_file.stem):
+                yield lock_file.stem
+
+    def remove_lock(self, cache_key: str) -> bool:
+        # Only once taken, so it is never removed from under its holder; and
+        #  anyone waiting on it moves on to a new file (see
+        #  `acquire_lock_file`). Busy locks are left alone.
+        with self.lock(cache_key, blocking=False) as locked:
+            if locked:
+                remove_file(self.lock_path(cache_key))
+        return locked
+
+    @contextmanager
+    def lock_names(
+        self, hash_info: HashInfo, blocking: bool = True
+    ) -> typ.Iterator[typ.Optional[typ.List[str]]]:
+        # Locks every cache key naming the blob, in order so that two callers
+        #  cannot deadlock. Yields the keys; or None, when not blocking and
+        #  one of them is busy.
+        keys = sorted(key for key, named in self.iter_names() if named == hash_info)
+        with ExitStack() as stack:
+            for key in keys:
+                if not stack.enter_context(self.lock(key, blocking)):
+                    yield None
+                    return
+            yield keys
+
+    def blob_path(self, hash_info: HashInfo) -> pathlib.Path:
+        algo, digest = split_hash_info(hash_info)
+        return self.blob_dir / algo / digest[:2] / digest
+
+    def name_path(self, cache_key: str) -> pathlib.Path:
+        assert CACHE_KEY_RE.match(cache_key)
+        return self.names_dir / cache_key
+
+    def lookup_name(self, cache_key: str) -> typ.Optional[HashInfo]:
+        try:
+            return self.name_path(cache_key).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def record_name(self, cache_key: str, hash_info: HashInfo) -> None:
+        if self.lookup_name(cache_key) == hash_info:
+            return
+        self.names_dir.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.name_path(cache_key), [hash_info.encode()])
+
+    def store(
+        self,
+        cache_key: str,
+        chunks: typ.Iterable[bytes],
+        algorithm: typ.Optional[str] = None,
+    ) -> typ.Tuple[pathlib.Path, HashInfo]:
+        blob, hash_info = self.put(chunks, name=cache_key, algorithm=algorithm)
+        self.record_name(cache_key, hash_info)
+        return blob, hash_info
+
+    def put(
+        self,
+        chunks: typ.Iterable[bytes],
+        name: str = "blob",
+        expected_hash: typ.Optional[HashInfo] = None,
+        algorithm: typ.Optional[str] = None,
+    ) -> typ.Tuple[pathlib.Path, HashInfo]:
+        if self.read_only:
+            raise ValueError(f"The cache layer {self.folder} is read-only")
+        if expected_hash is not None:
+            algorithm = hash_algorithm(expected_hash)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file, hash_info = write_temporary(
+            self.tmp_dir, name, chunks, metrics=self.metrics, algorithm=algorithm
+        )
+        if expected_hash is not None and hash_info != expected_hash:
+            tmp_file.unlink()
+            raise DownloadHashMismatch(
+                f"{name} has hash {hash_info}, expected {expected_hash}"
+            )
+        blob = self.blob_path(hash_info)
+        try:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(str(tmp_file), str(blob))
+        except BaseException:
+            tmp_file.unlink()
+            raise
+        if self.index:
+            self.index.record(hash_info, blob.stat())
+        return blob, hash_info
+
+    def retrieve(
+        self, cache_key: str, expected_hash: HashInfo
+    ) -> typ.Optional[pathlib.Path]:
+        blob = self.blob_path(expected_hash)
+        if self.read_only:
+            if not blob.exists():
+                return None
+            if not self.verify(expected_hash, blob):
+                logger.warning(f"Cached blob {blob} is corrupt. Ignoring it")
+                return None
+            return blob
+        if not blob.exists() and not self.import_legacy(cache_key, expected_hash):
+            return None
+        if not self.verify(expected_hash, blob):
+            logger.warning(f"Cached blob {blob} is corrupt. Discarding it")
+            self.discard(expected_hash)
+            return None
+        self.record_name(cache_key, expected_hash)
+        return blob
+
+    def verify(
+        self, expected_hash: HashInfo, blob: pathlib.Path, force: bool = False
+    ) -> bool:
+        stat = blob.stat()
+        record = self.index.lookup(expected_hash) if self.index else None
+        if record is not None:
+            if record.size != stat.st_size:
+                # The digest pins the size, so no need to read the file.
+                return False
+            if not (self.paranoid or force) and record.matches(stat):
+                if self.index is not None and not self.read_only:
+                    self.index.touch(expected_hash)
+                return True
+        with self.metrics.timer("hash_seconds"):
+            actual_hash = all_hashes_for_file(
+                blob,
+                hash_algorithm(expected_hash),
+                cached=not (self.paranoid or force),
+            )
+        if expected_hash != actual_hash:
+            return False
+        if self.index and not self.read_only:
+            self.index.record(expected_hash, stat)
+        return True
+
+    def iter_blobs(self) -> typ.Iterator[typ.Tuple[HashInfo, pathlib.Path]]:
+        if not self.blob_dir.exists():
+            return
+        for algo_dir in sorted(self.blob_dir.iterdir()):
+            for blob in sorted(algo_dir.glob("??/*")):
+                hash_info = f"{algo_dir.name}:{blob.name}"
+                if HASH_INFO_RE.match(hash_info) and blob.is_file():
+                    yield hash_info, blob
+
+    def iter_names(self) -> typ.Iterator[typ.Tuple[str, HashInfo]]:
+        if not self.names_dir.exists():
+            return
+        for name_file in sorted(self.names_dir.iterdir()):
+            if not CACHE_KEY_RE.match(name_file.name):
+                continue
+            hash_info = self.lookup_name(name_file.name)
+            if hash_info:
+                yield name_file.name, hash_info
+
+    def evict(
+        self,
+        max_size: int,
+        keep: typ.Collection[HashInfo] = (),
+        grace: typ.Optional[float] = None,
+    ) -> int:
+        # Only the index is consulted, so blobs it doesn't know about are
+        #  never evicted (and the directory is never rescanned).
+        if not self.index:
+            return 0
+        total = self.index.total_size()
+        evicted = 0
+        if total <= max_size:
+            return evicted
+        cutoff = time.time() - (EVICTION_GRACE if grace is None else grace)
+        for hash_info, size in self.index.least_recently_used():
+            if total <= max_size:
+                break
+            if hash_info in keep:
+                continue
+            with self.lock_names(hash_info, blocking=False) as keys:
+                # Checked under the lock, as a build may have just used it.
+                accessed = self.index.accessed_at(hash_info)
+                if keys is None or (accessed is not None and accessed > cutoff):
+                    continue
+                logger.info(f"Evicting {hash_info} from the cache")
+                self.discard_locked(hash_info, keys)
+            total -= size
+            evicted += size
+        if total > max_size:
+            logger.warning(
+                f"Cache size {total} still exceeds {max_size} after eviction. "
+                "The current build needs more than the allowed size."
+            )
+        return evicted
+
+    def discard(self, hash_info: HashInfo) -> None:
+        with self.lock_names(hash_info) as keys:
+            self.discard_locked(hash_info, keys or [])
+
+    def discard_locked(self, hash_info: HashInfo, keys: typ.Iterable[str]) -> None:
+        # The blob goes along with the names pointing at it; which must be
+        #  locked by the caller.
+        if self.index:
+            self.index.forget(hash_info)
+        remove_file(self.blob_path(hash_info))
+        for key in keys:
+            if self.lookup_name(key) == hash_info:
+                remove_file(self.name_path(key))
+
+    def remove(self, cache_key: str) -> None:
+        hash_info = self.lookup_name(cache_key)
+        remove_file(self.name_path(cache_key))
+        if hash_info:
+            self.discard(hash_info)
+
+    def import_legacy(self, cache_key: str, expected_hash: HashInfo) -> bool:
+        # Caches written before blobs were content-addressed stored a flat
+        #  `<cache_key>.dat` file, with its hashes in `<cache_key>.dat.check`.
+        assert CACHE_KEY_RE.match(cache_key)
+        file = self.folder / f"{cache_key}.dat"
+        hash_file = self.folder / f"{cache_key}.dat.check"
+        if not file.exists() or not hash_file.exists():
+            return False
+        if expected_hash not in hash_file.read_text().splitlines():
+            return False
+        blob = self.blob_path(expected_hash)
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(str(file), str(blob))
+        hash_file.unlink()
+        return True
+
+
+def acquire_lock_file(path: pathlib.Path, blocking: bool) -> typ.Optional[typ.BinaryIO]:
+    # Returns the open, locked, file; or None when not blocking and another
+    #  process holds it.
+    while True:
+        lock_file = path.open("a+b")
+        if fcntl is None:
+            return lock_file
+        try:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking:
+                    lock_file.close()
+                    return None
+                logger.info(f"Waiting for another process to release {path.stem}")
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            # The file may have been removed while we waited; in which case
+            #  the lock is now on whatever replaced it.
+            try:
+                current = os.stat(str(path)).st_ino
+            except FileNotFoundError:
+                current = None
+        except BaseException:
+            lock_file.close()
+            raise
+        if current == os.fstat(lock_file.fileno()).st_ino:
+            return lock_file
+        lock_file.close()
+
+
+def write_temporary(
+    folder: pathlib.Path,
+    name: str,
+    chunks: typ.Iterable[bytes],
+    metrics: typ.Optional[SessionMetrics] = None,
+    algorithm: typ.Optional[str] = None,
+) -> typ.Tuple[pathlib.Path, HashInfo]:
+    hasher = MultiHasher(None if algorithm is None else [algorithm])
+    fd, tmp_name = tempfile.mkstemp(dir=str(folder), prefix=f".{name}.", suffix=".tmp")
+    try:
+        os.fchmod(fd, FILE_MODE)
+        with open(fd, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                f.write(chunk)
+                if metrics is None:
+                    hasher.update(chunk)
+                else:
+                    with metrics.timer("hash_seconds"):
+                        hasher.update(chunk)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return pathlib.Path(tmp_name), hasher.hash_info()
+
+
+def atomic_write(target: pathlib.Path, chunks: typ.Iterable[bytes]) -> HashInfo:
+    tmp_file, hash_info = write_temporary(target.parent, target.name, chunks)
+    try:
+        os.replace(str(tmp_file), str(target))
+    except BaseException:
+        tmp_file.unlink()
+        raise
+    return hash_info
+
+
+def remove_file(file: pathlib.Path) -> None:
+    try:
+        file.unlink()
+    except FileNotFoundError:
+        pass
@@ -1,11 +1,41 @@
+import re
+
+import requests
+
 from .store import SessionStore
 
+# Archives are kept, hash-verified, in the blob store; so only the small API
+#  and listing responses are worth keeping in requests_cache.
+ARTIFACT_URL_RE = re.compile(r"(?:\.zip|\.tar(?:\.[a-z0-9]+)?|\.tgz|/download/[^/]+)$")
+METADATA_CONTENT_TYPES = frozenset(
+    ("application/json", "application/javascript", "application/xml")
+)
+
+
+def is_artifact_request(request: requests.PreparedRequest, stream: bool) -> bool:
+    url = (request.url or "").partition("?")[0]
+    return stream or bool(ARTIFACT_URL_RE.search(url))
+
+
+def is_metadata_response(response: requests.Response) -> bool:
+    content_type = response.headers.get("Content-Type", "")
+    content_type = content_type.partition(";")[0].strip().lower()
+    return content_type.startswith("text/") or content_type in METADATA_CONTENT_TYPES
+
+
 try:
     from requests_cache.core import CachedSession
 
     class CachingSessionStore(SessionStore, CachedSession):
-        pass
-
+        def send(self, request, **kwargs):
+            if is_artifact_request(request, kwargs.get("stream", False)):
+                response = super(CachedSession, self).send(request, **kwargs)
+                response.from_cache = False
+                return response
+            response = super().send(request, **kwargs)
+            if not response.from_cache and not is_metadata_response(response):
+                self.cache.delete(self.cache.create_key(request))
+            return response
 
 except ImportError:
     CachingSessionStore = None
@@ -0,0 +1,196 @@
+import logging
+import pathlib
+import re
+import typing as typ
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+import requests
+
+from .blobs import remove_file
+
+logger = logging.getLogger(__name__)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DEFAULT_RANGE_PARTS = 4
+DEFAULT_RANGE_MIN_PART_SIZE = 4 * 1024 * 1024
+DEFAULT_ATTEMPTS = 3
+SEGMENT_RE = re.compile(r"^\.([0-9]+)-([0-9]*)\.part$")
+RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+
+class RangeNotSatisfied(Exception):
+    pass
+
+
+@attr.s(frozen=True)
+class Segment:
+
+    path: pathlib.Path = attr.ib()
+    start: int = attr.ib()
+    end: typ.Optional[int] = attr.ib()  # Inclusive; `None` for the whole rest
+
+    @classmethod
+    def create(
+        cls, folder: pathlib.Path, name: str, start: int, end: typ.Optional[int]
+    ) -> "Segment":
+        end_str = "" if end is None else str(end)
+        return cls(folder / f"{name}.{start}-{end_str}.part", start, end)
+
+    @property
+    def length(self) -> typ.Optional[int]:
+        return None if self.end is None else self.end - self.start + 1
+
+    @property
+    def downloaded(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def complete(self) -> bool:
+        return self.length is not None and self.downloaded >= self.length
+
+
+def existing_segments(folder: pathlib.Path, name: str) -> typ.List[Segment]:
+    segments = []
+    for path in folder.glob(f"{name}.*.part"):
+        match = SEGMENT_RE.match(path.name[len(name) :])
+        if match:
+            start, end = match.groups()
+            segments.append(Segment(path, int(start), int(end) if end else None))
+    return sorted(segments, key=lambda segment: segment.start)
+
+
+def split_segments(
+    folder: pathlib.Path, name: str, length: int, parts: int
+) -> typ.List[Segment]:
+    part_size = -(-length // parts)
+    return [
+        Segment.create(folder, name, start, min(start + part_size, length) - 1)
+        for start in range(0, length, part_size)
+    ]
+
+
+def remove_segments(segments: typ.Iterable[Segment]) -> None:
+    for segment in segments:
+        remove_file(segment.path)
+
+
+def iter_segments(segments: typ.Iterable[Segment]) -> typ.Iterator[bytes]:
+    for segment in segments:
+        with segment.path.open("rb") as f:
+            while True:
+                chunk = f.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def supports_ranges(response: requests.Response) -> bool:
+    return response.headers.get("Accept-Ranges", "").strip().lower() == "bytes"
+
+
+def download_segments(
+    session: requests.Session,
+    url: str,
+    folder: pathlib.Path,
+    name: str,
+    *,
+    parts: int = DEFAULT_RANGE_PARTS,
+    min_part_size: int = DEFAULT_RANGE_MIN_PART_SIZE,
+    attempts: int = DEFAULT_ATTEMPTS,
+    **k: typ.Any,
+) -> typ.List[Segment]:
+    # Segments are kept on disk, named by their byte range, so that a later
+    #  call can resume any that were interrupted.
+    folder.mkdir(parents=True, exist_ok=True)
+    segments = existing_segments(folder, name)
+    if not segments:
+        response = session.get(url, stream=True, **k)
+        response.raise_for_status()
+        length = int(response.headers.get("Content-Length", 0))
+        if parts > 1 and supports_ranges(response) and length >= 2 * min_part_size:
+            response.close()
+            parts = min(parts, length // min_part_size)
+            segments = split_segments(folder, name, length, parts)
+            logger.info(f"Downloading {url} as {len(segments)} concurrent ranges")
+        else:
+            segment = Segment.create(folder, name, 0, None)
+            try:
+                with segment.path.open("wb") as f:
+                    write_response(response, f)
+            except RETRYABLE_ERRORS:
+                logger.warning(f"Download of {url} interrupted; resuming")
+                fetch_segment(session, url, segment, attempts=attempts - 1, **k)
+            return [segment]
+    else:
+        logger.info(f"Resuming the download of {url}")
+    try:
+        with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+            futures = [
+                pool.submit(fetch_segment, session, url, segment, attempts, **k)
+                for segment in segments
+            ]
+            for future in futures:
+                future.result()
+    except RangeNotSatisfied:
+        logger.warning(f"Cannot resume {url}; downloading it again")
+        remove_segments(segments)
+        return download_segments(
+            session, url, folder, name, parts=1, attempts=attempts, **k
+        )
+    return segments
+
+
+def fetch_segment(
+    session: requests.Session,
+    url: str,
+    segment: Segment,
+    attempts: int = DEFAULT_ATTEMPTS,
+    **k: typ.Any,
+) -> None:
+    base_headers = k.pop("headers", None) or {}
+    for attempt in range(max(attempts, 1)):
+        if segment.complete:
+            return
+        have = segment.downloaded
+        end = "" if segment.end is None else str(segment.end)
+        headers = dict(base_headers)
+        headers["Range"] = f"bytes={segment.start + have}-{end}"
+        response = session.get(url, headers=headers, stream=True, **k)
+        if response.status_code == 416 and segment.end is None and have:
+            # Nothing past what we already have.
+            response.close()
+            return
+        response.raise_for_status()
+        if response.status_code == 206:
+            mode = "ab"
+        elif segment.start == 0 and segment.end is None:
+            # The server ignored the range; start again from the beginning.
+            mode = "wb"
+        else:
+            response.close()
+            raise RangeNotSatisfied(url)
+        try:
+            with segment.path.open(mode) as f:
+                write_response(response, f)
+            if segment.length is None or segment.complete:
+                return
+        except RETRYABLE_ERRORS:
+            if attempt + 1 >= attempts:
+                raise
+            logger.warning(f"Download of {url} interrupted; resuming")
+    if not segment.complete and segment.length is not None:
+        raise requests.exceptions.ConnectionError(f"Failed to download {url}")
+
+
+def write_response(response: requests.Response, f: typ.IO[bytes]) -> None:
+    with response:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                f.write(chunk)
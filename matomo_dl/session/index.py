@@ -0,0 +1,152 @@
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import typing as typ
+
+import attr
+
+from matomo_dl.hashing import HashInfo
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    verified_at REAL NOT NULL,
+    last_access REAL NOT NULL DEFAULT 0
+)
+"""
+MIGRATIONS = {
+    "last_access": "ALTER TABLE blobs ADD COLUMN last_access REAL NOT NULL DEFAULT 0"
+}
+
+
+@attr.s(frozen=True)
+class BlobRecord:
+
+    hash: HashInfo = attr.ib()
+    size: int = attr.ib()
+    mtime_ns: int = attr.ib()
+    inode: int = attr.ib()
+    verified_at: float = attr.ib()
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return (self.size, self.mtime_ns, self.inode) == (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        )
+
+
+class CacheIndex:
+    # Records the stat of each blob as it was when its hash was last verified,
+    #  so unchanged blobs can be trusted without being re-read.
+
+    path: pathlib.Path
+    read_only: bool
+
+    def __init__(self, path: pathlib.Path, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self._lock = threading.Lock()
+        self._conn: typ.Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None and self.read_only:
+            # Shared layers may be on a read-only mount; never create or
+            #  migrate their index.
+            self._conn = sqlite3.connect(
+                self.path.resolve().as_uri() + "?mode=ro",
+                uri=True,
+                timeout=60,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+        elif self._conn is None:
+            self._conn = sqlite3.connect(
+                str(self.path),
+                timeout=60,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._conn.execute(SCHEMA)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(blobs)")}
+            for column, migration in MIGRATIONS.items():
+                if column not in columns:
+                    self._conn.execute(migration)
+        return self._conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def lookup(self, hash_info: HashInfo) -> typ.Optional[BlobRecord]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT hash, size, mtime_ns, inode, verified_at "
+                "FROM blobs WHERE hash = ?",
+                (hash_info,),
+            ).fetchone()
+        if row is None:
+            return None
+        return BlobRecord(*row)
+
+    def record(self, hash_info: HashInfo, stat: os.stat_result) -> BlobRecord:
+        record = BlobRecord(
+            hash=hash_info,
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            inode=stat.st_ino,
+            verified_at=time.time(),
+        )
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO blobs "
+                "(hash, size, mtime_ns, inode, verified_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                attr.astuple(record) + (record.verified_at,),
+            )
+        return record
+
+    def touch(self, hash_info: HashInfo) -> None:
+        with self._lock:
+            self.conn.execute(
+                "UPDATE blobs SET last_access = ? WHERE hash = ?",
+                (time.time(), hash_info),
+            )
+
+    def forget(self, hash_info: HashInfo) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM blobs WHERE hash = ?", (hash_info,))
+
+    def total_size(self) -> int:
+        with self._lock:
+            (total,) = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+        return int(total)
+
+    def last_accessed(self) -> typ.Dict[HashInfo, float]:
+        with self._lock:
+            rows = self.conn.execute("SELECT hash, last_access FROM blobs").fetchall()
+        return dict(rows)
+
+    def accessed_at(self, hash_info: HashInfo) -> typ.Optional[float]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT last_access FROM blobs WHERE hash = ?", (hash_info,)
+            ).fetchone()
+        return None if row is None else float(row[0])
+
+    def least_recently_used(self) -> typ.Iterator[typ.Tuple[HashInfo, int]]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT hash, size FROM blobs ORDER BY last_access, hash"
+            ).fetchall()
+        return iter(rows)
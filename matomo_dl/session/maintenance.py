@@ -0,0 +1,197 @@
+import logging
+import pathlib
+import re
+import tarfile
+import time
+import typing as typ
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import attr
+
+from matomo_dl.errors import DownloadHashMismatch
+from matomo_dl.hashing import HashInfo
+from .blobs import CACHE_KEY_RE, HASH_INFO_RE, BlobStore, split_hash_info
+
+logger = logging.getLogger(__name__)
+DEFAULT_JOBS = 4
+COPY_CHUNK_SIZE = 1024 * 1024
+DAY = 24 * 60 * 60
+AGE_BUCKETS: typ.Sequence[typ.Tuple[str, float]] = (
+    ("1 day", DAY),
+    ("1 week", 7 * DAY),
+    ("1 month", 30 * DAY),
+    ("older", float("inf")),
+)
+EXPORT_BLOB_RE = re.compile(r"^blobs/([0-9a-z_\-]+)/[0-9a-f]{2}/([0-9a-f]+)$")
+EXPORT_NAME_RE = re.compile(r"^names/(.+)$")
+# Anything in `tmp/` untouched for this long was left by an interrupted
+#  download, which is not going to be resumed.
+TMP_MAX_AGE = DAY
+
+
+@attr.s
+class CacheStats:
+
+    blob_count: int = attr.ib(default=0)
+    total_size: int = attr.ib(default=0)
+    # Blob counts by how recently they were last used.
+    ages: typ.Dict[str, int] = attr.ib(
+        factory=lambda: {name: 0 for name, _ in AGE_BUCKETS}
+    )
+
+
+def cache_stats(blobs: BlobStore, now: typ.Optional[float] = None) -> CacheStats:
+    now = time.time() if now is None else now
+    last_accessed = blobs.index.last_accessed() if blobs.index else {}
+    stats = CacheStats()
+    for hash_info, blob in blobs.iter_blobs():
+        stat = blob.stat()
+        stats.blob_count += 1
+        stats.total_size += stat.st_size
+        # Blobs from before access times were recorded report their mtime.
+        age = now - (last_accessed.get(hash_info) or stat.st_mtime)
+        for name, limit in AGE_BUCKETS:
+            if age < limit:
+                stats.ages[name] += 1
+                break
+    return stats
+
+
+def verify_blobs(blobs: BlobStore, jobs: int = DEFAULT_JOBS) -> typ.List[HashInfo]:
+    # Rehashes every blob, ignoring the index's fast path. Corrupt blobs
+    #  are discarded.
+    def verify(item: typ.Tuple[HashInfo, pathlib.Path]) -> typ.Optional[HashInfo]:
+        hash_info, blob = item
+        if blobs.verify(hash_info, blob, force=True):
+            return None
+        logger.warning(f"Cached blob {blob} is corrupt. Discarding it")
+        blobs.discard(hash_info)
+        return hash_info
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(verify, list(blobs.iter_blobs())))
+    return [hash_info for hash_info in results if hash_info]
+
+
+def collect_garbage(
+    blobs: BlobStore,
+    keep: typ.Collection[HashInfo],
+    jobs: int = DEFAULT_JOBS,
+    dry: bool = False,
+) -> typ.List[HashInfo]:
+    garbage = [
+        hash_info for hash_info, _ in blobs.iter_blobs() if hash_info not in keep
+    ]
+    if dry:
+        return garbage
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(blobs.discard, garbage))
+    for cache_key, hash_info in blobs.iter_names():
+        if hash_info not in keep:
+            blobs.remove(cache_key)
+    if blobs.index:
+        # Forget blobs that were deleted behind the index's back.
+        present = {hash_info for hash_info, _ in blobs.iter_blobs()}
+        for hash_info in blobs.index.last_accessed():
+            if hash_info not in present:
+                blobs.index.forget(hash_info)
+    remove_stale_temporaries(blobs)
+    remove_unused_locks(blobs)
+    return garbage
+
+
+def remove_stale_temporaries(blobs: BlobStore, max_age: float = TMP_MAX_AGE) -> int:
+    if not blobs.tmp_dir.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for tmp_file in blobs.tmp_dir.iterdir():
+        try:
+            if not tmp_file.is_file() or tmp_file.stat().st_mtime > cutoff:
+                continue
+            tmp_file.unlink()
+        except FileNotFoundError:
+            continue
+        logger.info(f"Removed the stale temporary file {tmp_file.name}")
+        removed += 1
+    return removed
+
+
+def remove_unused_locks(blobs: BlobStore) -> int:
+    # Keys with a name are kept, as they will be locked again.
+    named = {cache_key for cache_key, _ in blobs.iter_names()}
+    removed = 0
+    for cache_key in blobs.iter_locks():
+        if cache_key not in named and blobs.remove_lock(cache_key):
+            removed += 1
+    return removed
+
+
+def normalised_tar_info(name: str, size: int) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    info.mtime = 0
+    return info
+
+
+def export_blobs(
+    entries: typ.Iterable[typ.Tuple[str, HashInfo, pathlib.Path]],
+    output_file: pathlib.Path,
+) -> int:
+    # Blobs come first so that `import_blobs` has them before their names.
+    #  They may have been found in a cache layer, so are archived from the
+    #  path they were retrieved from under their local store's layout.
+    entries = sorted(set(entries))
+    blobs = dict(sorted((hash_info, blob) for _, hash_info, blob in entries))
+    with tarfile.open(str(output_file), "w") as tar:
+        for hash_info, blob in blobs.items():
+            algo, digest = split_hash_info(hash_info)
+            name = f"blobs/{algo}/{digest[:2]}/{digest}"
+            with blob.open("rb") as f:
+                tar.addfile(normalised_tar_info(name, blob.stat().st_size), f)
+        for cache_key, hash_info, _ in entries:
+            data = hash_info.encode()
+            info = normalised_tar_info(f"names/{cache_key}", len(data))
+            tar.addfile(info, BytesIO(data))
+    return len(blobs)
+
+
+def import_blobs(blobs: BlobStore, archive: pathlib.Path) -> typ.List[HashInfo]:
+    imported = []
+    with tarfile.open(str(archive), "r:*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            blob_match = EXPORT_BLOB_RE.match(member.name)
+            name_match = EXPORT_NAME_RE.match(member.name)
+            f = tar.extractfile(member)
+            assert f is not None
+            if blob_match:
+                # Stored by the hash of what was read; never by the name.
+                expected_hash = "{}:{}".format(*blob_match.groups())
+                try:
+                    blobs.put(iter_file(f), expected_hash=expected_hash)
+                except DownloadHashMismatch as e:
+                    logger.warning(f"Skipping corrupt {member.name}: {e}")
+                    continue
+                imported.append(expected_hash)
+            elif name_match and CACHE_KEY_RE.match(name_match.group(1)):
+                hash_info = f.read().decode().strip()
+                if (
+                    HASH_INFO_RE.match(hash_info)
+                    and blobs.blob_path(hash_info).exists()
+                ):
+                    blobs.record_name(name_match.group(1), hash_info)
+            else:
+                logger.warning(f"Skipping unexpected {member.name}")
+    return imported
+
+
+def iter_file(f: typ.IO[bytes]) -> typ.Iterator[bytes]:
+    while True:
+        chunk = f.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
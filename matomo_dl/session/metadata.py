@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import pathlib
+import typing as typ
+
+import attr
+import cattr
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .blobs import atomic_write, remove_file
+
+logger = logging.getLogger(__name__)
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+
+
+@attr.s
+class MetadataEntry:
+
+    url: str = attr.ib()
+    headers: typ.Dict[str, str] = attr.ib(factory=dict)
+    encoding: typ.Optional[str] = attr.ib(default=None)
+
+    @property
+    def validators(self) -> typ.Dict[str, str]:
+        validators = {}
+        if "ETag" in self.headers:
+            validators["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            validators["If-Modified-Since"] = self.headers["Last-Modified"]
+        return validators
+
+
+def metadata_key(method: str, url: str, secret: typ.Optional[str] = None) -> str:
+    # Never store the secret (ie. the license key) itself; only a hash of it.
+    secret_hash = hashlib.sha256(secret.encode()).hexdigest() if secret else None
+    key_data = json.dumps([method.upper(), url, secret_hash]).encode()
+    return hashlib.sha256(key_data).hexdigest()
+
+
+class MetadataCache:
+    # Stores API responses along with their validators, so that they can be
+    #  revalidated with a conditional request instead of fetched in full.
+
+    folder: pathlib.Path
+
+    def __init__(self, folder: pathlib.Path):
+        self.folder = folder
+
+    def paths(self, key: str) -> typ.Tuple[pathlib.Path, pathlib.Path]:
+        return self.folder / f"{key}.json", self.folder / f"{key}.body"
+
+    def load(self, key: str) -> typ.Optional[typ.Tuple[MetadataEntry, bytes]]:
+        entry_file, body_file = self.paths(key)
+        try:
+            entry = cattr.structure(json.loads(entry_file.read_text()), MetadataEntry)
+            return entry, body_file.read_bytes()
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def save(self, key: str, response: requests.Response) -> None:
+        headers = {
+            name: response.headers[name]
+            for name in KEPT_HEADERS
+            if name in response.headers
+        }
+        entry = MetadataEntry(
+            url=response.url, headers=headers, encoding=response.encoding
+        )
+        if not entry.validators:
+            self.remove(key)
+            return
+        entry_file, body_file = self.paths(key)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        atomic_write(body_file, [response.content])
+        atomic_write(entry_file, [json.dumps(cattr.unstructure(entry)).encode()])
+
+    def remove(self, key: str) -> None:
+        for file in self.paths(key):
+            remove_file(file)
+
+
+def restore_response(
+    entry: MetadataEntry, body: bytes, not_modified: requests.Response
+) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.url = entry.url
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response.encoding = entry.encoding
+    response._content = body
+    response.request = not_modified.request
+    response.reason = "OK"
+    return response
@@ -0,0 +1,68 @@
+import threading
+import time
+import typing as typ
+from contextlib import contextmanager
+
+import attr
+
+SIZE_NAMES = ("B", "KiB", "MiB", "GiB", "TiB")
+
+
+def format_size(size: float) -> str:
+    for name in SIZE_NAMES[:-1]:
+        if size < 1024:
+            return f"{size:.1f} {name}" if name != "B" else f"{int(size)} B"
+        size /= 1024
+    return f"{size:.1f} {SIZE_NAMES[-1]}"
+
+
+@attr.s
+class SessionMetrics:
+
+    cache_hits: int = attr.ib(default=0)
+    cache_misses: int = attr.ib(default=0)
+    bytes_downloaded: int = attr.ib(default=0)
+    bytes_from_cache: int = attr.ib(default=0)
+    hash_seconds: float = attr.ib(default=0.0)
+    requests_by_host: typ.Dict[str, int] = attr.ib(factory=dict)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False, cmp=False)
+
+    def count(self, name: str, amount: typ.Union[int, float] = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def count_request(self, host: str) -> None:
+        with self._lock:
+            self.requests_by_host[host] = self.requests_by_host.get(host, 0) + 1
+
+    @contextmanager
+    def timer(self, name: str) -> typ.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(name, time.perf_counter() - start)
+
+    def to_output(self) -> typ.Dict[str, typ.Any]:
+        with self._lock:
+            return {
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "bytes_downloaded": self.bytes_downloaded,
+                "bytes_from_cache": self.bytes_from_cache,
+                "hash_seconds": round(self.hash_seconds, 3),
+                "requests_by_host": dict(sorted(self.requests_by_host.items())),
+            }
+
+    def summary(self) -> str:
+        data = self.to_output()
+        requests = ", ".join(
+            f"{host}={count}" for host, count in data["requests_by_host"].items()
+        )
+        return (
+            f"Cache {data['cache_hits']} hits/{data['cache_misses']} misses; "
+            f"downloaded {format_size(data['bytes_downloaded'])}, "
+            f"read {format_size(data['bytes_from_cache'])} from cache; "
+            f"hashing took {data['hash_seconds']:.2f}s; "
+            f"requests: {requests or 'none'}"
+        )
@@ -0,0 +1,66 @@
+import logging
+import re
+import shutil
+import socketserver
+import typing as typ
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from .blobs import BlobStore
+
+logger = logging.getLogger(__name__)
+BLOB_URL_RE = re.compile(r"^/blobs/([0-9a-z_\-]+)/([0-9a-f]+)$")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_url(upstream: str, hash_info: str) -> str:
+    algo, _, digest = hash_info.partition(":")
+    return f"{upstream.rstrip('/')}/blobs/{algo}/{digest}"
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    # Serves verified blobs by their hash, ie. `/blobs/<algorithm>/<digest>`.
+
+    blobs: BlobStore
+
+    def log_message(self, format: str, *a: typ.Any) -> None:
+        logger.info(f"{self.address_string()} - {format % a}")
+
+    def do_HEAD(self) -> None:
+        self.send_blob(with_body=False)
+
+    def do_GET(self) -> None:
+        self.send_blob(with_body=True)
+
+    def send_blob(self, with_body: bool) -> None:
+        match = BLOB_URL_RE.match(self.path)
+        if not match:
+            self.send_error(404)
+            return
+        hash_info = "{}:{}".format(*match.groups())
+        blob = self.blobs.blob_path(hash_info)
+        try:
+            if not self.blobs.verify(hash_info, blob):
+                logger.warning(f"Cached blob {blob} is corrupt. Discarding it")
+                self.blobs.discard(hash_info)
+                self.send_error(404)
+                return
+            f = blob.open("rb")
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(blob.stat().st_size))
+            self.end_headers()
+            if with_body:
+                shutil.copyfileobj(f, self.wfile, COPY_CHUNK_SIZE)
+
+
+class CacheServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def create_cache_server(blobs: BlobStore, host: str, port: int) -> CacheServer:
+    handler = type("CacheRequestHandler", (CacheRequestHandler,), {"blobs": blobs})
+    return CacheServer((host, port), handler)
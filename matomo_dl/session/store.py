@@ -1,14 +1,45 @@
+import logging
 import pathlib
-import re
+import tempfile
 import typing as typ
+from urllib.parse import urlsplit
 
 import requests
 from requests.adapters import HTTPAdapter
 
-from matomo_dl.hashing import HashInfo, all_hashes_for_data
+from matomo_dl.errors import DownloadHashMismatch, OfflineError
+from matomo_dl.hashing import HashInfo, all_hashes_for_data, hash_algorithm
+from .blobs import BlobStore
+from .download import (
+    DEFAULT_RANGE_MIN_PART_SIZE,
+    DEFAULT_RANGE_PARTS,
+    download_segments,
+    existing_segments,
+    iter_segments,
+    remove_segments,
+)
+from .index import CacheIndex
+from .metadata import MetadataCache, metadata_key, restore_response
+from .metrics import SessionMetrics
+from .mirror import blob_url
 
+logger = logging.getLogger(__name__)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
-class HttpLoggingAdapter(HTTPAdapter):
+
+class MetricsAdapter(HTTPAdapter):
+    # Counted here, so only requests that actually reach the network count.
+    def __init__(self, *a, metrics: typ.Optional[SessionMetrics] = None, **k):
+        super().__init__(*a, **k)
+        self.metrics = metrics
+
+    def send(self, request, *a, **k):
+        if self.metrics is not None:
+            self.metrics.count_request(urlsplit(request.url).hostname or "")
+        return super().send(request, *a, **k)
+
+
+class HttpLoggingAdapter(MetricsAdapter):
     def send(self, request, *a, **k):
         if (
             isinstance(request, requests.Request)
@@ -19,46 +50,304 @@ class HttpLoggingAdapter(HTTPAdapter):
         return super().send(request, *a, **k)
 
 
+class OfflineAdapter(HTTPAdapter):
+    def send(self, request, *a, **k):
+        raise OfflineError(f"Refusing to request {request.url} while offline")
+
+
 class SessionStore(requests.Session):
     cache_dir: typ.Optional[pathlib.Path]
+    range_parts: int = DEFAULT_RANGE_PARTS
+    range_min_part_size: int = DEFAULT_RANGE_MIN_PART_SIZE
+    scratch_dir: typ.Optional[tempfile.TemporaryDirectory] = None
+    scratch_blobs: typ.Optional[BlobStore] = None
 
     def __init__(
-        self, *a: typ.Any, cache_dir: typ.Optional[pathlib.Path], **k: typ.Any
+        self,
+        *a: typ.Any,
+        cache_dir: typ.Optional[pathlib.Path],
+        paranoid: bool = False,
+        max_size: typ.Optional[int] = None,
+        offline: bool = False,
+        upstream: typ.Optional[str] = None,
+        layers: typ.Sequence[pathlib.Path] = (),
+        promote: bool = False,
+        tree_cache: bool = False,
+        **k: typ.Any,
     ):
-        super().__init__(*a, **k)  # type: ignore
-        self.mount("http://", HttpLoggingAdapter())
+        super().__init__(*a, **k)
+        self.metrics = SessionMetrics()
+        self.offline = offline
+        self.upstream = upstream
+        # Read-only caches, in lookup order, consulted after `cache_dir`.
+        self.cache_layers = [
+            BlobStore.read_only_layer(layer, paranoid=paranoid, metrics=self.metrics)
+            for layer in layers
+        ]
+        self.promote = promote
+        # Extracted trees are kept outside the blob budget, so are opt-in.
+        self.tree_cache = tree_cache
+        self.set_pool_size(requests.adapters.DEFAULT_POOLSIZE)
+        self.max_size = max_size
         if cache_dir:
             self.cache_dir = pathlib.Path(cache_dir)
+            self.cache_blobs: typ.Optional[BlobStore] = BlobStore(
+                self.cache_dir,
+                index=CacheIndex(self.cache_dir / "index.sqlite"),
+                paranoid=paranoid,
+                metrics=self.metrics,
+            )
         else:
             self.cache_dir = None
+            self.cache_blobs = None
+
+    def set_pool_size(self, size: int) -> None:
+        # Each thread sharing this session needs its own pooled connection.
+        if self.offline:
+            self.mount("http://", OfflineAdapter())
+            self.mount("https://", OfflineAdapter())
+        else:
+            self.mount(
+                "http://", HttpLoggingAdapter(pool_maxsize=size, metrics=self.metrics)
+            )
+            self.mount(
+                "https://", MetricsAdapter(pool_maxsize=size, metrics=self.metrics)
+            )
+
+    def close(self) -> None:
+        super().close()
+        for blobs in [self.cache_blobs, *self.cache_layers]:
+            if blobs is not None and blobs.index is not None:
+                blobs.index.close()
+        if self.scratch_dir is not None:
+            self.scratch_dir.cleanup()
+            self.scratch_dir = None
+            self.scratch_blobs = None
+
+    @property
+    def data_dir(self) -> pathlib.Path:
+        # Downloads are streamed to disk even when there is no cache; so
+        #  without a cache directory they end up in a session-local folder.
+        if self.cache_dir:
+            return self.cache_dir
+        if self.scratch_dir is None:
+            self.scratch_dir = tempfile.TemporaryDirectory(prefix="matomo-dl-data")
+        return pathlib.Path(self.scratch_dir.name)
+
+    @property
+    def blobs(self) -> BlobStore:
+        if self.cache_blobs is not None:
+            return self.cache_blobs
+        if self.scratch_blobs is None:
+            self.scratch_blobs = BlobStore(self.data_dir, metrics=self.metrics)
+        return self.scratch_blobs
 
     def store_cache_data(self, cache_key: str, data: bytes) -> HashInfo:
-        hashes = all_hashes_for_data(data)
         if self.cache_dir:
-            assert re.match(r"^[0-9a-z\-_.]+$", cache_key)
-            file = self.cache_dir / "{}.dat".format(cache_key)
-            file.write_bytes(data)
-            hash_file = self.cache_dir / "{}.dat.check".format(cache_key)
-            hash_file.write_text(hashes)
-        return hashes
-
-    def retrieve_cache_data(
+            _, hashes = self.blobs.store(cache_key, [data])
+            return hashes
+        return all_hashes_for_data(data)
+
+    def store_cache_response(
+        self,
+        cache_key: str,
+        response: requests.Response,
+        algorithm: typ.Optional[str] = None,
+    ) -> typ.Tuple[pathlib.Path, HashInfo]:
+        with response:
+            response.raise_for_status()
+            return self.store_cache_chunks(
+                cache_key,
+                self.count_downloaded(
+                    response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+                ),
+                algorithm=algorithm,
+            )
+
+    def count_downloaded(self, chunks: typ.Iterable[bytes]) -> typ.Iterator[bytes]:
+        for chunk in chunks:
+            self.metrics.count("bytes_downloaded", len(chunk))
+            yield chunk
+
+    def store_cache_chunks(
+        self,
+        cache_key: str,
+        chunks: typ.Iterable[bytes],
+        algorithm: typ.Optional[str] = None,
+    ) -> typ.Tuple[pathlib.Path, HashInfo]:
+        return self.blobs.store(cache_key, chunks, algorithm=algorithm)
+
+    def retrieve_cache_file(
         self, cache_key: str, expected_hash: HashInfo
-    ) -> typ.Optional[bytes]:
-        if not self.cache_dir:
-            return None
-        assert re.match(r"^[0-9a-z\-_.]+$", cache_key)
+    ) -> typ.Optional[pathlib.Path]:
         assert expected_hash
-        file = self.cache_dir / "{}.dat".format(cache_key)
-        hash_file = self.cache_dir / "{}.dat.check".format(cache_key)
-        if not file.exists() or not hash_file.exists():
-            return None
-        digests = hash_file.read_text().splitlines()
-        if expected_hash in digests:
-            data = file.read_bytes()
-            if expected_hash == all_hashes_for_data(data):
-                return data
-
-        file.unlink()
-        hash_file.unlink()
+        if self.cache_blobs is not None:
+            file = self.cache_blobs.retrieve(cache_key, expected_hash)
+            if file:
+                return file
+        for layer in self.cache_layers:
+            file = layer.retrieve(cache_key, expected_hash)
+            if file:
+                logger.debug(f"Found {cache_key} in the cache layer {layer.folder}")
+                return self.promote_cache_file(cache_key, expected_hash, file)
         return None
+
+    def promote_cache_file(
+        self, cache_key: str, expected_hash: HashInfo, file: pathlib.Path
+    ) -> pathlib.Path:
+        if not self.promote or self.cache_blobs is None:
+            return file
+        with file.open("rb") as f:
+            promoted, _ = self.cache_blobs.store(
+                cache_key,
+                iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""),
+                algorithm=hash_algorithm(expected_hash),
+            )
+        return promoted
+
+    def retrieve_upstream_file(
+        self, cache_key: str, expected_hash: HashInfo
+    ) -> typ.Optional[pathlib.Path]:
+        # A mirror (see `serve-cache`) is only ever trusted by hash; anything
+        #  unexpected falls through to the original download.
+        if not self.upstream or self.offline:
+            return None
+        url = blob_url(self.upstream, expected_hash)
+        try:
+            response = self.get(url, stream=True)
+            if response.status_code != 200:
+                response.close()
+                logger.debug(f"{cache_key} is not on the mirror {self.upstream}")
+                return None
+            file, data_hash = self.store_cache_response(
+                cache_key, response, algorithm=hash_algorithm(expected_hash)
+            )
+        except requests.RequestException as e:
+            logger.warning(f"Cannot fetch {cache_key} from {self.upstream}: {e}")
+            return None
+        if data_hash != expected_hash:
+            logger.warning(
+                f"The mirror {self.upstream} sent {data_hash} for {cache_key}, "
+                f"expected {expected_hash}. Ignoring it"
+            )
+            self.remove_cache_data(cache_key)
+            return None
+        logger.info(f"Fetched {cache_key} from the mirror {self.upstream}")
+        return file
+
+    def request_metadata(
+        self, method: str, url: str, *, secret: typ.Optional[str] = None, **k
+    ) -> requests.Response:
+        if not self.cache_dir:
+            return self.request(method, url, **k)
+        metadata = MetadataCache(self.cache_dir / "metadata")
+        key = metadata_key(method, url, secret)
+        cached = metadata.load(key)
+        headers = dict(k.pop("headers", None) or {})
+        if cached:
+            headers.update(cached[0].validators)
+        request = self.prepare_request(
+            requests.Request(method, url, headers=headers, **k)
+        )
+        settings = self.merge_environment_settings(url, {}, None, None, None)
+        # Bypass any response caching of subclasses; the validators decide.
+        response = requests.Session.send(self, request, **settings)
+        if cached and response.status_code == 304:
+            logger.debug(f"{method} {url} has not been modified")
+            return restore_response(*cached, not_modified=response)
+        elif response.status_code == 200:
+            self.metrics.count("bytes_downloaded", len(response.content))
+            metadata.save(key, response)
+        return response
+
+    def fetch_cache_file(
+        self,
+        cache_key: str,
+        expected_hash: HashInfo,
+        request: typ.Callable[[], requests.Response],
+    ) -> pathlib.Path:
+        return self.acquire_cache_file(
+            cache_key,
+            expected_hash,
+            lambda: self.store_cache_response(
+                cache_key, request(), algorithm=hash_algorithm(expected_hash)
+            ),
+        )
+
+    def download_cache_file(
+        self, cache_key: str, expected_hash: HashInfo, url: str, **k: typ.Any
+    ) -> pathlib.Path:
+        return self.acquire_cache_file(
+            cache_key,
+            expected_hash,
+            lambda: self.store_ranged_download(cache_key, expected_hash, url, **k),
+        )
+
+    def acquire_cache_file(
+        self,
+        cache_key: str,
+        expected_hash: HashInfo,
+        download: typ.Callable[[], typ.Tuple[pathlib.Path, HashInfo]],
+    ) -> pathlib.Path:
+        # Looks in the cache, its layers and the upstream mirror before
+        #  calling `download`; which stores the file under `cache_key`.
+        with self.cache_lock(cache_key):
+            file = self.retrieve_cache_file(cache_key, expected_hash)
+            if file:
+                self.metrics.count("cache_hits")
+                self.metrics.count("bytes_from_cache", file.stat().st_size)
+                return file
+            self.metrics.count("cache_misses")
+            file = self.retrieve_upstream_file(cache_key, expected_hash)
+            if file:
+                return file
+            logger.info(f"{cache_key} not in cache. Downloading it now")
+            file, data_hash = download()
+            if data_hash != expected_hash:
+                self.remove_cache_data(cache_key)
+                raise DownloadHashMismatch(
+                    f"Downloaded {cache_key} has hash {data_hash}, "
+                    f"expected {expected_hash}"
+                )
+            return file
+
+    def store_ranged_download(
+        self, cache_key: str, expected_hash: HashInfo, url: str, **k: typ.Any
+    ) -> typ.Tuple[pathlib.Path, HashInfo]:
+        blobs = self.blobs
+        name = expected_hash.replace(":", "-")
+        resumed = sum(
+            segment.downloaded for segment in existing_segments(blobs.tmp_dir, name)
+        )
+        segments = download_segments(
+            self,
+            url,
+            blobs.tmp_dir,
+            name,
+            parts=self.range_parts,
+            min_part_size=self.range_min_part_size,
+            **k,
+        )
+        self.metrics.count(
+            "bytes_downloaded",
+            max(sum(segment.downloaded for segment in segments) - resumed, 0),
+        )
+        try:
+            return blobs.store(
+                cache_key,
+                iter_segments(segments),
+                algorithm=hash_algorithm(expected_hash),
+            )
+        finally:
+            remove_segments(segments)
+
+    def cache_lock(self, cache_key: str) -> typ.ContextManager[bool]:
+        return self.blobs.lock(cache_key)
+
+    def remove_cache_data(self, cache_key: str) -> None:
+        self.blobs.remove(cache_key)
+
+    def enforce_cache_budget(self, keep: typ.Collection[HashInfo] = ()) -> int:
+        if self.cache_blobs is None or self.max_size is None:
+            return 0
+        return self.cache_blobs.evict(self.max_size, keep=frozenset(keep))
@@ -48,7 +48,7 @@ setup(
     },
     python_requires=">=3.6",
     install_requires=required,
-    extras_require={"cache": ["requests_cache==0.4.13"]},
+    extras_require={"cache": ["requests_cache==0.4.13"], "zstd": ["zstandard"]},
     include_package_data=True,
     license="GPLv3+",
 )
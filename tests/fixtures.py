@@ -1,16 +1,92 @@
 import hashlib
+import io
 import os
 import pathlib
 import shutil
 import tempfile
+import threading
 import typing as typ
 import zipfile
 from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import requests
 
+from matomo_dl.distribution.lock import (
+    DistributionLockFile,
+    MatomoLock,
+    VersionedPluginLock,
+)
+from matomo_dl.session.store import SessionStore
+
 MATOMO_ZIP_SHA1S = {"3.6.1": "59daaf90805c98de006db28fa297f01e1dd235ce"}
 TEST_CACHE = pathlib.Path(__file__).parent.parent / ".test_cache"
+ZIP_DATE_TIME = (2019, 1, 1, 0, 0, 0)
+MATOMO_URL = "https://builds.matomo.org"
+PLUGINS_URL = "https://plugins.matomo.org/api/2.0"
+
+
+def sha256(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def make_zip(
+    files: typ.Union[typ.Mapping[str, bytes], typ.Iterable[str]],
+    date_time: typ.Tuple[int, int, int, int, int, int] = ZIP_DATE_TIME,
+) -> bytes:
+    # Given just names, each member contains its own name.
+    if not isinstance(files, typ.Mapping):
+        files = {name: name.encode() for name in files}
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as z:
+        for name, content in files.items():
+            z.writestr(zipfile.ZipInfo(name, date_time), content)
+    return data.getvalue()
+
+
+def make_lock(
+    plugins: typ.Mapping[str, bytes],
+    matomo: typ.Optional[bytes] = None,
+    session: typ.Optional[SessionStore] = None,
+    url: typ.Optional[str] = None,
+) -> DistributionLockFile:
+    # Locks Matomo 3.6.1 and version 1.0 of each plugin to the given archives;
+    #  which are stored in `session`'s cache when given. Without an archive,
+    #  Matomo is locked to one that doesn't exist.
+    def lock_hash(cache_key: str, data: typ.Optional[bytes]) -> str:
+        if data is None:
+            return "sha256:" + "0" * 64
+        elif session is None:
+            return sha256(data)
+        return session.store_cache_data(cache_key, data)
+
+    plugin_locks = {
+        name: VersionedPluginLock(
+            extraction_root=f"{name}/",
+            version="1.0",
+            link=f"{url or PLUGINS_URL}/plugins/{name}/download/1.0",
+            hash=lock_hash(f"plugin-{name.lower()}-1.0-zip", data),
+        )
+        for name, data in plugins.items()
+    }
+    matomo_lock = MatomoLock(
+        version="3.6.1",
+        link=f"{url or MATOMO_URL}/matomo-3.6.1.zip",
+        hash=lock_hash("matomo-3.6.1-zip", matomo),
+        extraction_root="matomo/",
+    )
+    return DistributionLockFile(matomo_lock, plugin_locks, "")
+
+
+def snapshot(folder: pathlib.Path):
+    return {
+        str(path.relative_to(folder)): (
+            path.is_dir() or path.read_bytes(),
+            path.stat().st_mode,
+            path.is_dir() or path.stat().st_mtime,
+        )
+        for path in folder.rglob("*")
+    }
 
 
 def download_matomo_zip(version: str, f: typ.IO):
@@ -81,3 +157,69 @@ def with_extracted_matomo(version: str):
                 target.parent.mkdir(parents=True, exist_ok=True)
                 shutil.copyfileobj(z.open(name), target.open("wb"))
         yield p
+
+
+class StaticHandler(BaseHTTPRequestHandler):
+    files: typ.Mapping[str, bytes] = {}
+    content_types: typ.Mapping[str, str] = {}
+    requests: typ.List[typ.Tuple[str, str, typ.Mapping[str, str]]]
+
+    def log_message(self, *a):
+        pass
+
+    def do_GET(self):
+        self.requests.append(("GET", self.path, dict(self.headers)))
+        data = self.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        content_type = self.content_types.get(self.path, "application/zip")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+
+class RangeHandler(StaticHandler):
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        data = self.files.get(self.path)
+        if not range_header or data is None:
+            return super().do_GET()
+        self.requests.append(("GET", self.path, dict(self.headers)))
+        start_str, _, end_str = range_header[len("bytes=") :].partition("-")
+        start = int(start_str)
+        end = int(end_str) if end_str else len(data) - 1
+        if start >= len(data):
+            self.send_error(416)
+            return
+        part = data[start : end + 1]
+        self.send_response(206)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(len(part)))
+        self.end_headers()
+        self.wfile.write(part)
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+
+@contextmanager
+def serve_http(handler: typ.Type[BaseHTTPRequestHandler], **attrs):
+    handler_cls = type(handler.__name__, (handler,), {"requests": [], **attrs})
+    server = HTTPServer(("127.0.0.1", 0), handler_cls)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}", handler_cls
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
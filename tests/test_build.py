@@ -0,0 +1,116 @@
+import io
+import os
+import pathlib
+import tarfile
+import threading
+
+import pytest
+from click.testing import CliRunner
+
+from matomo_dl.__main__ import cli
+from matomo_dl.distribution.file import unstringify_distribution_file
+from matomo_dl.session.store import SessionStore
+from .fixtures import make_zip
+
+DISTRIBUTION = 'version = "3.6.1"\n'
+GLOBAL_CONFIG = b"""[Plugins]
+Plugins[] = "CoreHome"
+
+[PluginsInstalled]
+PluginsInstalled[] = "CoreHome"
+"""
+
+
+def matomo_zip() -> bytes:
+    return make_zip(
+        {
+            "matomo/index.php": b"<?php // index",
+            "matomo/config/global.ini.php": GLOBAL_CONFIG,
+            "matomo/plugins/CoreHome/CoreHome.php": b"<?php // CoreHome",
+        }
+    )
+
+
+@pytest.fixture()
+def distribution(tmp_path: pathlib.Path) -> pathlib.Path:
+    session = SessionStore(cache_dir=tmp_path / "cache")
+    matomo_hash = session.store_cache_data("matomo-3.6.1-zip", matomo_zip())
+    session.close()
+    dist = unstringify_distribution_file(tmp_path, DISTRIBUTION)
+    (tmp_path / "distribution.toml").write_text(DISTRIBUTION)
+    (tmp_path / "distribution.lock.toml").write_text(
+        f"""distribution_hash = "{dist.versioning_hash}"
+
+[matomo]
+version = "3.6.1"
+link = "https://builds.matomo.org/matomo-3.6.1.zip"
+hash = "{matomo_hash}"
+extraction_root = "matomo/"
+
+[plugin_locks]
+"""
+    )
+    return tmp_path / "distribution.toml"
+
+
+def invoke(distribution: pathlib.Path, *args: str):
+    cache = ["--offline", "--cache", str(distribution.parent / "cache")]
+    return CliRunner().invoke(
+        cli,
+        [*cache, "--cache-level", "locks", "build", str(distribution), *args],
+        catch_exceptions=False,
+    )
+
+
+def tar_names(data: bytes):
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as tar:
+        return set(tar.getnames())
+
+
+def assert_is_release(data: bytes):
+    names = tar_names(data)
+    assert "index.php" in names
+    assert "config/global.ini.php" in names
+    assert ".build.json" in names
+
+
+def test_build_to_a_file(distribution: pathlib.Path):
+    output = distribution.parent / "x.tar"
+    result = invoke(distribution, "-o", str(output))
+    assert result.exit_code == 0, result.output
+    assert_is_release(output.read_bytes())
+
+
+def test_build_to_stdout(distribution: pathlib.Path):
+    result = invoke(distribution, "-o", "-")
+    assert result.exit_code == 0, result.output
+    assert_is_release(result.stdout_bytes)
+
+
+def test_build_to_a_descriptor(distribution: pathlib.Path):
+    read_fd, write_fd = os.pipe()
+    received = []
+
+    def drain():
+        # Concurrently, so the build cannot block on a full pipe.
+        with os.fdopen(read_fd, "rb") as f:
+            received.append(f.read())
+
+    reader = threading.Thread(target=drain)
+    reader.start()
+    try:
+        result = invoke(distribution, "--output-fd", str(write_fd))
+    finally:
+        os.close(write_fd)
+        reader.join()
+    assert result.exit_code == 0, result.output
+    assert_is_release(received[0])
+
+
+def test_bad_cache_sizes_are_reported(distribution: pathlib.Path):
+    result = CliRunner().invoke(
+        cli, ["--cache-max-size", "lots", "build", str(distribution)]
+    )
+    assert result.exit_code == 2
+    assert "--cache-max-size" in result.output
+    assert "Cannot parse the size 'lots'" in result.output
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import pathlib
+import stat
+
+import pytest
+
+from matomo_dl.session.store import SessionStore
+
+DATA = b"matomo" * 100_000
+DATA_HASH = "sha256:" + hashlib.sha256(DATA).hexdigest()
+
+
+@pytest.fixture()
+def shared_layer(tmp_path: pathlib.Path):
+    layer = tmp_path / "shared"
+    seed = SessionStore(cache_dir=layer)
+    seed.store_cache_data("matomo-1.0-zip", DATA)
+    seed.close()
+    # Make the whole layer read-only, like a shared mount.
+    for path in sorted(layer.rglob("*"), reverse=True):
+        path.chmod(path.stat().st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+    layer.chmod(0o555)
+    yield layer
+    for path in [layer, *layer.rglob("*")]:
+        path.chmod(path.stat().st_mode | stat.S_IWUSR)
+
+
+@pytest.mark.skipif(os.geteuid() == 0, reason="root ignores file permissions")
+def test_layer_is_never_written(tmp_path: pathlib.Path, shared_layer: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "local", layers=[shared_layer])
+    file = session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert file is not None and file.read_bytes() == DATA
+
+
+def test_lookups_fall_through_to_layers(tmp_path: pathlib.Path):
+    shared = SessionStore(cache_dir=tmp_path / "shared")
+    shared_file, _ = shared.store_cache_chunks("matomo-1.0-zip", [DATA])
+    session = SessionStore(cache_dir=tmp_path / "local", layers=[tmp_path / "shared"])
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) == shared_file
+    # Nothing was copied into the local layer.
+    assert not (tmp_path / "local" / "blobs").exists()
+    new_file, _ = session.store_cache_chunks("plugin-one-1.0-zip", [b"plugin"])
+    assert (tmp_path / "local") in new_file.parents
+
+
+def test_corrupt_layer_blob_is_left_alone(tmp_path: pathlib.Path):
+    shared = SessionStore(cache_dir=tmp_path / "shared")
+    shared_file, _ = shared.store_cache_chunks("matomo-1.0-zip", [DATA])
+    shared_file.write_bytes(b"corrupt")
+    session = SessionStore(cache_dir=tmp_path / "local", layers=[tmp_path / "shared"])
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) is None
+    assert shared_file.read_bytes() == b"corrupt"
+
+
+def test_layer_hits_can_be_promoted(tmp_path: pathlib.Path):
+    shared = SessionStore(cache_dir=tmp_path / "shared")
+    shared.store_cache_chunks("matomo-1.0-zip", [DATA])
+    session = SessionStore(
+        cache_dir=tmp_path / "local", layers=[tmp_path / "shared"], promote=True
+    )
+    file = session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert file is not None and session.cache_blobs is not None
+    assert (tmp_path / "local") in file.parents
+    assert file.read_bytes() == DATA
+    assert session.cache_blobs.retrieve("matomo-1.0-zip", DATA_HASH) == file
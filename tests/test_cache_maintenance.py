@@ -0,0 +1,188 @@
+import os
+import pathlib
+import threading
+import time
+
+from click.testing import CliRunner
+
+from matomo_dl.session import maintenance
+from matomo_dl.session.store import SessionStore
+from .fixtures import sha256
+
+MATOMO = b"matomo" * 1000
+PLUGIN = b"plugin" * 1000
+OTHER = b"other" * 1000
+
+
+def seeded_session(cache_dir: pathlib.Path) -> SessionStore:
+    session = SessionStore(cache_dir=cache_dir)
+    session.store_cache_data("matomo-3.6.1-zip", MATOMO)
+    session.store_cache_data("plugin-one-1.0-zip", PLUGIN)
+    session.store_cache_data("matomo-3.5.0-zip", OTHER)
+    return session
+
+
+def write_lockfile(path: pathlib.Path) -> pathlib.Path:
+    path.write_text(f"""distribution_hash = ""
+
+[matomo]
+version = "3.6.1"
+link = "https://builds.matomo.org/matomo-3.6.1.zip"
+hash = "{sha256(MATOMO)}"
+extraction_root = "matomo/"
+
+[plugin_locks.One]
+extraction_root = "One/"
+version = "1.0"
+link = "https://plugins.matomo.org/api/2.0/plugins/One/download/1.0"
+hash = "{sha256(PLUGIN)}"
+""")
+    return path
+
+
+def invoke(*args: str):
+    from matomo_dl.__main__ import cli
+
+    return CliRunner().invoke(cli, list(args), catch_exceptions=False)
+
+
+def test_stats_counts_blobs(tmp_path: pathlib.Path):
+    session = seeded_session(tmp_path)
+    stats = maintenance.cache_stats(session.blobs)
+    assert stats.blob_count == 3
+    assert stats.total_size == len(MATOMO) + len(PLUGIN) + len(OTHER)
+    assert stats.ages["1 day"] == 3
+    assert sum(stats.ages.values()) == 3
+
+
+def test_verify_discards_corrupt_blobs(tmp_path: pathlib.Path):
+    session = seeded_session(tmp_path)
+    session.blobs.blob_path(sha256(PLUGIN)).write_bytes(b"corrupt")
+    result = invoke(
+        "--cache", str(tmp_path), "--cache-level", "locks", "cache", "verify"
+    )
+    assert result.exit_code == 2, result.output
+    assert sha256(PLUGIN) in result.output
+    assert not session.blobs.blob_path(sha256(PLUGIN)).exists()
+    assert session.blobs.blob_path(sha256(MATOMO)).exists()
+
+
+def test_gc_keeps_only_locked_blobs(tmp_path: pathlib.Path):
+    session = seeded_session(tmp_path / "cache")
+    lockfile = write_lockfile(tmp_path / "distribution.lock.toml")
+    result = invoke(
+        "--cache",
+        str(tmp_path / "cache"),
+        "--cache-level",
+        "locks",
+        "cache",
+        "gc",
+        "--keep",
+        str(lockfile),
+    )
+    assert result.exit_code == 0, result.output
+    assert sorted(hash_info for hash_info, _ in session.blobs.iter_blobs()) == sorted(
+        [sha256(MATOMO), sha256(PLUGIN)]
+    )
+    assert session.blobs.lookup_name("matomo-3.5.0-zip") is None
+    assert session.blobs.index is not None
+    assert session.blobs.index.total_size() == len(MATOMO) + len(PLUGIN)
+
+
+def test_export_and_import_round_trip(tmp_path: pathlib.Path):
+    seeded_session(tmp_path / "cache")
+    lockfile = write_lockfile(tmp_path / "distribution.lock.toml")
+    archive = tmp_path / "cache.tar"
+    common = ["--cache-level", "locks"]
+    result = invoke(
+        "--cache",
+        str(tmp_path / "cache"),
+        *common,
+        "cache",
+        "export",
+        "--lock",
+        str(lockfile),
+        str(archive),
+    )
+    assert result.exit_code == 0, result.output
+    result = invoke(
+        "--cache", str(tmp_path / "seeded"), *common, "cache", "import", str(archive)
+    )
+    assert result.exit_code == 0, result.output
+    seeded = SessionStore(cache_dir=tmp_path / "seeded")
+    assert seeded.retrieve_cache_file("matomo-3.6.1-zip", sha256(MATOMO))
+    assert seeded.retrieve_cache_file("plugin-one-1.0-zip", sha256(PLUGIN))
+    assert seeded.retrieve_cache_file("matomo-3.5.0-zip", sha256(OTHER)) is None
+    assert seeded.blobs.lookup_name("plugin-one-1.0-zip") == sha256(PLUGIN)
+
+
+def test_export_includes_blobs_from_cache_layers(tmp_path: pathlib.Path):
+    seeded_session(tmp_path / "layer")
+    lockfile = write_lockfile(tmp_path / "distribution.lock.toml")
+    archive = tmp_path / "cache.tar"
+    result = invoke(
+        "--cache",
+        str(tmp_path / "cache"),
+        "--cache-layer",
+        str(tmp_path / "layer"),
+        "--cache-level",
+        "locks",
+        "cache",
+        "export",
+        "--lock",
+        str(lockfile),
+        str(archive),
+    )
+    assert result.exit_code == 0, result.output
+    imported = maintenance.import_blobs(
+        SessionStore(cache_dir=tmp_path / "seeded").blobs, archive
+    )
+    assert sorted(imported) == sorted([sha256(MATOMO), sha256(PLUGIN)])
+
+
+def test_gc_removes_stale_temporaries_and_unused_locks(tmp_path: pathlib.Path):
+    session = seeded_session(tmp_path)
+    blobs = session.blobs
+    stale = blobs.tmp_dir / "sha256-abc.0-1023.part"
+    fresh = blobs.tmp_dir / "sha256-def.0-1023.part"
+    for part in [stale, fresh]:
+        part.write_bytes(b"partial")
+    old = time.time() - maintenance.TMP_MAX_AGE - 60
+    os.utime(str(stale), (old, old))
+    for cache_key in ["matomo-3.6.1-zip", "matomo-3.5.0-zip", "gone-1.0-zip"]:
+        with blobs.lock(cache_key):
+            pass
+    other = SessionStore(cache_dir=tmp_path)
+    with other.blobs.lock("busy-1.0-zip"):
+        maintenance.collect_garbage(blobs, {sha256(MATOMO)})
+    assert list(blobs.tmp_dir.iterdir()) == [fresh]
+    # Kept for the named key, and for the one another build holds.
+    assert list(blobs.iter_locks()) == ["busy-1.0-zip", "matomo-3.6.1-zip"]
+
+
+def test_waiters_follow_a_removed_lock(tmp_path: pathlib.Path):
+    holder = SessionStore(cache_dir=tmp_path).blobs
+    waiter = SessionStore(cache_dir=tmp_path).blobs
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def wait() -> None:
+        with waiter.lock("plugin-one-1.0-zip"):
+            acquired.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=wait)
+    with holder.lock("plugin-one-1.0-zip"):
+        thread.start()
+        time.sleep(0.2)
+        assert holder.remove_lock("plugin-one-1.0-zip")
+    try:
+        assert acquired.wait(5)
+        # The waiter holds a new lock file, which nobody else can take.
+        assert waiter.lock_path("plugin-one-1.0-zip").exists()
+        assert not SessionStore(cache_dir=tmp_path).blobs.remove_lock(
+            "plugin-one-1.0-zip"
+        )
+    finally:
+        release.set()
+        thread.join()
@@ -0,0 +1,42 @@
+import pathlib
+import typing as typ
+
+import pytest
+
+from matomo_dl.session import CachingSessionStore, create_cached_session_store
+from .fixtures import StaticHandler, serve_http
+
+pytestmark = pytest.mark.skipif(
+    CachingSessionStore is None, reason="requests_cache is not installed"
+)
+FILES = {
+    "/api/info": b'{"name": "Plugin"}',
+    "/matomo-1.0.zip": b"PK" * 1000,
+    "/api/plugins/Plugin/download/1.0": b"PK" * 1000,
+    "/signature": b"\x00" * 100,
+}
+CONTENT_TYPES = {
+    "/api/info": "application/json; charset=utf-8",
+    "/signature": "application/octet-stream",
+}
+
+
+def test_only_metadata_is_kept_in_requests_cache(tmp_path: pathlib.Path):
+    session = create_cached_session_store(tmp_path, backend="memory")
+    with serve_http(StaticHandler, files=FILES, content_types=CONTENT_TYPES) as (
+        url,
+        handler,
+    ):
+        for _ in range(2):
+            assert session.get(f"{url}/api/info").json() == {"name": "Plugin"}
+            with session.get(f"{url}/matomo-1.0.zip", stream=True) as resp:
+                assert resp.content == FILES["/matomo-1.0.zip"]
+            session.get(f"{url}/api/plugins/Plugin/download/1.0")
+            session.get(f"{url}/signature")
+        paths = [path for _, path, _ in handler.requests]
+    assert paths.count("/api/info") == 1
+    assert paths.count("/matomo-1.0.zip") == 2
+    assert paths.count("/api/plugins/Plugin/download/1.0") == 2
+    assert paths.count("/signature") == 2
+    # `cache` is requests_cache's, which is untyped.
+    assert len(typ.cast(typ.Any, session).cache.responses) == 1
@@ -0,0 +1,201 @@
+import gzip
+import io
+import os
+import pathlib
+import random
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from matomo_dl.bundle import create_release_tarball
+from matomo_dl.bundle.compress import ParallelGzipWriter
+from matomo_dl.bundle.formats import (
+    FORMATS,
+    ZIP_LEVELS_SUPPORTED,
+    ArchiveFormat,
+    infer_format,
+)
+from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.distribution.customisations import Customisations
+from .fixtures import make_lock
+
+WORDS = [b"<?php ", b"echo ", b"$value; ", b"\n", b"function ", b"return "]
+
+
+def sample_data(size: int) -> bytes:
+    rng = random.Random(size)
+    data = bytearray()
+    while len(data) < size:
+        data += rng.choice(WORDS) if rng.random() < 0.9 else bytes([rng.getrandbits(8)])
+    return bytes(data[:size])
+
+
+def compress(data: bytes, jobs: int, block_size: int = 64 * 1024) -> bytes:
+    output = io.BytesIO()
+    rng = random.Random(jobs)
+    with ParallelGzipWriter(output, 1546300800, block_size=block_size, jobs=jobs) as f:
+        offset = 0
+        while offset < len(data):
+            size = rng.randint(1, 50000)
+            f.write(data[offset : offset + size])
+            offset += size
+    return output.getvalue()
+
+
+def test_output_is_independent_of_jobs():
+    data = sample_data(1024 * 1024 + 123)
+    outputs = {compress(data, jobs) for jobs in (1, 2, 7)}
+    assert len(outputs) == 1
+    output = outputs.pop()
+    assert gzip.decompress(output) == data
+    with gzip.GzipFile(fileobj=io.BytesIO(output)) as f:
+        f.read()
+        assert f.mtime == 1546300800
+
+
+def test_empty_and_single_block():
+    assert gzip.decompress(compress(b"", jobs=4)) == b""
+    data = sample_data(1000)
+    assert gzip.decompress(compress(data, jobs=4)) == data
+
+
+def test_release_tarball_is_reproducible(tmp_path: pathlib.Path):
+    folder = tmp_path / "build"
+    (folder / "core").mkdir(parents=True)
+    (folder / "index.php").write_bytes(sample_data(1536 * 1024))
+    (folder / "core/Version.php").write_bytes(b"<?php // 3.6.1")
+    build = BuildInformation(
+        make_lock({}), Customisations(), folder, mtime_clamp=1546300800
+    )
+    outputs = []
+    for jobs in (1, 8):
+        output = tmp_path / f"matomo-{jobs}.tar.gz"
+        create_release_tarball(build, output, jobs=jobs)
+        outputs.append(output.read_bytes())
+    assert outputs[0] == outputs[1]
+    with tarfile.open(tmp_path / "matomo-1.tar.gz") as tar:
+        assert tar.getnames() == ["core", "core/Version.php", "index.php"]
+        index = tar.extractfile("index.php")
+        assert index is not None
+        assert index.read() == sample_data(1536 * 1024)
+
+
+def make_build(tmp_path: pathlib.Path) -> BuildInformation:
+    folder = tmp_path / "build"
+    (folder / "plugins/Morpheus/images").mkdir(parents=True)
+    (folder / "index.php").write_bytes(sample_data(64 * 1024))
+    (folder / "plugins/Morpheus/images/logo.png").write_bytes(b"\x89PNG" * 1000)
+    return BuildInformation(
+        make_lock({}), Customisations(), folder, mtime_clamp=1546300800
+    )
+
+
+@pytest.mark.parametrize("name", ["tar", "tar.bz2", "tar.xz", "tar.gz"])
+def test_tar_formats(tmp_path: pathlib.Path, name):
+    build = make_build(tmp_path)
+    fmt = FORMATS[name]
+    outputs = []
+    for i in range(2):
+        output = tmp_path / f"matomo-{i}{fmt.suffix}"
+        create_release_tarball(build, output, fmt, fmt.fast_level)
+        outputs.append(output)
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+    with tarfile.open(outputs[0]) as tar:
+        index = tar.extractfile("index.php")
+        assert index is not None
+        assert index.read() == sample_data(64 * 1024)
+
+
+def test_zstd_format(tmp_path: pathlib.Path):
+    pytest.importorskip("zstandard")
+    build = make_build(tmp_path)
+    outputs = []
+    for jobs in (1, 4):
+        output = tmp_path / f"matomo-{jobs}.tar.zst"
+        create_release_tarball(build, output, FORMATS["tar.zst"], jobs=jobs)
+        outputs.append(output.read_bytes())
+    assert outputs[0] == outputs[1]
+
+
+def test_zip_format(tmp_path: pathlib.Path):
+    build = make_build(tmp_path)
+    outputs = []
+    for i in range(2):
+        output = tmp_path / f"matomo-{i}.zip"
+        create_release_tarball(build, output)
+        outputs.append(output)
+    assert outputs[0].read_bytes() == outputs[1].read_bytes()
+    with zipfile.ZipFile(outputs[0]) as z:
+        infos = {info.filename: info for info in z.infolist()}
+        assert sorted(infos) == [
+            "index.php",
+            "plugins/",
+            "plugins/Morpheus/",
+            "plugins/Morpheus/images/",
+            "plugins/Morpheus/images/logo.png",
+        ]
+        assert infos["index.php"].compress_type == zipfile.ZIP_DEFLATED
+        assert infos["index.php"].date_time == (2019, 1, 1, 0, 0, 0)
+        logo = infos["plugins/Morpheus/images/logo.png"]
+        assert logo.compress_type == zipfile.ZIP_STORED
+        assert z.read(logo) == b"\x89PNG" * 1000
+
+
+def test_formats_are_inferred_from_the_output():
+    assert infer_format(pathlib.Path("matomo-3.6.1.tar.zst"))[0].name == "tar.zst"
+    assert infer_format(pathlib.Path("matomo.tar"))[0].name == "tar"
+    assert infer_format(pathlib.Path("matomo.TGZ"))[0].name == "tar.gz"
+    assert infer_format(pathlib.Path("matomo.tar.bz"))[0].name == "tar.bz2"
+    with pytest.raises(ValueError):
+        infer_format(pathlib.Path("matomo.tar.lz"))
+    fmt, output = infer_format(pathlib.Path("matomo"))
+    assert (fmt.name, output) == ("tar.gz", pathlib.Path("matomo.tar.gz"))
+    assert FORMATS["tar.gz"].compression_level(fast=True) == 1
+    with pytest.raises(ValueError):
+        FORMATS["zip"].compression_level(12)
+    assert FORMATS["tar"].compression_level(fast=True) is None
+    with pytest.raises(ValueError):
+        FORMATS["tar"].compression_level(6)
+
+
+def test_pinned_compression_levels_are_enforced(caplog):
+    fmt = ArchiveFormat("zip", ".zip", 6, 6, 6, 6)
+    assert fmt.compression_level() == 6
+    with pytest.raises(ValueError, match="can only be 6"):
+        fmt.compression_level(9)
+    assert fmt.compression_level(fast=True) == 6
+    assert "cannot be compressed faster" in caplog.text
+
+
+@pytest.mark.skipif(not ZIP_LEVELS_SUPPORTED, reason="zip levels need Python 3.7")
+def test_zip_compression_level_is_used(tmp_path: pathlib.Path):
+    build = make_build(tmp_path)
+    sizes = []
+    for level in [0, 9]:
+        output = tmp_path / f"matomo-{level}.zip"
+        create_release_tarball(build, output, FORMATS["zip"], level)
+        with zipfile.ZipFile(output) as z:
+            sizes.append(z.getinfo("index.php").compress_size)
+    assert sizes[0] > sizes[1]
+
+
+@pytest.mark.parametrize("name", ["tar", "tar.gz", "zip"])
+def test_archives_stream_to_pipes(tmp_path: pathlib.Path, name):
+    build = make_build(tmp_path)
+    fmt = FORMATS[name]
+    create_release_tarball(build, tmp_path / f"matomo{fmt.suffix}", fmt)
+    read_fd, write_fd = os.pipe()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with os.fdopen(read_fd, "rb") as reader:
+            streamed = pool.submit(reader.read)
+            with os.fdopen(write_fd, "wb") as writer:
+                create_release_tarball(build, writer, fmt)
+            data = streamed.result()
+    if name == "zip":
+        # Streamed zips describe each file after its data instead.
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            assert z.read("index.php") == sample_data(64 * 1024)
+    else:
+        assert data == (tmp_path / f"matomo{fmt.suffix}").read_bytes()
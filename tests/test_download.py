@@ -0,0 +1,81 @@
+import hashlib
+import pathlib
+import typing as typ
+
+from matomo_dl.session.download import Segment
+from matomo_dl.session.store import SessionStore
+from .fixtures import RangeHandler, StaticHandler, serve_http
+
+DATA = bytes(range(256)) * 4096
+DATA_HASH = "sha256:" + hashlib.sha256(DATA).hexdigest()
+PART_NAME = DATA_HASH.replace(":", "-")
+
+
+def ranges_requested(handler: typ.Any) -> typ.List[typ.Optional[str]]:
+    return [headers.get("Range") for _, _, headers in handler.requests]
+
+
+def ranged_session(cache_dir: pathlib.Path) -> SessionStore:
+    session = SessionStore(cache_dir=cache_dir)
+    session.range_parts = 4
+    session.range_min_part_size = 64 * 1024
+    return session
+
+
+def test_large_downloads_use_concurrent_ranges(tmp_path: pathlib.Path):
+    session = ranged_session(tmp_path)
+    with serve_http(RangeHandler, files={"/matomo.zip": DATA}) as (url, handler):
+        file = session.download_cache_file(
+            "matomo-1.0-zip", DATA_HASH, f"{url}/matomo.zip"
+        )
+    assert file.read_bytes() == DATA
+    assert sorted(filter(None, ranges_requested(handler))) == [
+        "bytes=0-262143",
+        "bytes=262144-524287",
+        "bytes=524288-786431",
+        "bytes=786432-1048575",
+    ]
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_partial_download_is_resumed(tmp_path: pathlib.Path):
+    session = ranged_session(tmp_path)
+    segment = Segment.create(tmp_path / "tmp", PART_NAME, 0, None)
+    segment.path.parent.mkdir(parents=True)
+    segment.path.write_bytes(DATA[:1000])
+    with serve_http(RangeHandler, files={"/matomo.zip": DATA}) as (url, handler):
+        file = session.download_cache_file(
+            "matomo-1.0-zip", DATA_HASH, f"{url}/matomo.zip"
+        )
+    assert file.read_bytes() == DATA
+    assert ranges_requested(handler) == ["bytes=1000-"]
+
+
+def test_interrupted_range_is_resumed(tmp_path: pathlib.Path):
+    session = ranged_session(tmp_path)
+    segments = [
+        Segment.create(tmp_path / "tmp", PART_NAME, 0, 524287),
+        Segment.create(tmp_path / "tmp", PART_NAME, 524288, len(DATA) - 1),
+    ]
+    segments[0].path.parent.mkdir(parents=True)
+    segments[0].path.write_bytes(DATA[:524288])
+    segments[1].path.write_bytes(DATA[524288:600000])
+    with serve_http(RangeHandler, files={"/matomo.zip": DATA}) as (url, handler):
+        file = session.download_cache_file(
+            "matomo-1.0-zip", DATA_HASH, f"{url}/matomo.zip"
+        )
+    assert file.read_bytes() == DATA
+    assert ranges_requested(handler) == [f"bytes=600000-{len(DATA) - 1}"]
+
+
+def test_server_without_ranges_restarts(tmp_path: pathlib.Path):
+    session = ranged_session(tmp_path)
+    segment = Segment.create(tmp_path / "tmp", PART_NAME, 0, None)
+    segment.path.parent.mkdir(parents=True)
+    segment.path.write_bytes(b"stale partial download")
+    with serve_http(StaticHandler, files={"/matomo.zip": DATA}) as (url, handler):
+        file = session.download_cache_file(
+            "matomo-1.0-zip", DATA_HASH, f"{url}/matomo.zip"
+        )
+    assert file.read_bytes() == DATA
+    assert len(handler.requests) == 1
@@ -0,0 +1,84 @@
+import pathlib
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from matomo_dl.bundle import extract
+from matomo_dl.bundle.extract import extract_zip_file
+from .fixtures import snapshot
+
+DATA = bytes(range(256)) * 8192
+
+
+def test_members_are_streamed_to_disk(tmp_path: pathlib.Path, monkeypatch):
+    archive = tmp_path / "plugin.zip"
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        info = zipfile.ZipInfo("Plugin/data/GeoIP.dat", (2019, 1, 2, 3, 4, 6))
+        info.external_attr = 0o644 << 16
+        z.writestr(info, DATA)
+
+    def no_whole_reads(*a, **k):
+        raise AssertionError("Members should not be read into memory whole")
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", no_whole_reads)
+    monkeypatch.setattr(extract, "EXTRACT_CHUNK_SIZE", 4096)
+    latest_mtime = extract_zip_file(archive, tmp_path / "out", root="Plugin/")
+    target = tmp_path / "out/data/GeoIP.dat"
+    assert target.read_bytes() == DATA
+    assert target.stat().st_mtime == latest_mtime
+    assert target.stat().st_mode & 0o777 == 0o600
+
+
+def build_archive(archive: pathlib.Path) -> None:
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(zipfile.ZipInfo("Plugin/"), b"")
+        z.writestr(zipfile.ZipInfo("Plugin/empty/"), b"")
+        for i in range(40):
+            info = zipfile.ZipInfo(f"Plugin/d{i % 5}/f{i}.php", (2019, 1, 2, 3, 4, i))
+            info.external_attr = (0o755 if i % 3 else 0o644) << 16
+            z.writestr(info, DATA[: 1000 * i])
+        z.writestr(zipfile.ZipInfo("Plugin/../../evil.php"), b"evil")
+        z.writestr(zipfile.ZipInfo("Plugin/d0/f0.php", (2019, 1, 2, 3, 4, 50)), b"2")
+
+
+def test_parallel_extraction_matches_serial(tmp_path: pathlib.Path):
+    archive = tmp_path / "plugin.zip"
+    build_archive(archive)
+    serial = extract_zip_file(archive, tmp_path / "serial", "Plugin/", jobs=1)
+    parallel = extract_zip_file(archive, tmp_path / "parallel", "Plugin/", jobs=8)
+    assert serial == parallel
+    assert snapshot(tmp_path / "serial") == snapshot(tmp_path / "parallel")
+    assert (tmp_path / "serial/empty").is_dir()
+    assert (tmp_path / "serial/d0/f0.php").read_bytes() == b"2"
+
+
+def test_archives_can_share_a_pool(tmp_path: pathlib.Path, monkeypatch):
+    archive = tmp_path / "plugin.zip"
+    build_archive(archive)
+    threads = set()
+    write_member = extract.write_member
+
+    def record_thread(*a, **k):
+        threads.add(threading.current_thread().name)
+        return write_member(*a, **k)
+
+    monkeypatch.setattr(extract, "write_member", record_thread)
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="shared") as pool:
+        for name in ["one", "two"]:
+            extract_zip_file(archive, tmp_path / name, "Plugin/", jobs=8, pool=pool)
+    assert snapshot(tmp_path / "one") == snapshot(tmp_path / "two")
+    assert threads and all(name.startswith("shared") for name in threads)
+    assert not list(tmp_path.rglob("evil.php"))
+
+
+def test_extraction_replaces_existing_files(tmp_path: pathlib.Path):
+    archive = tmp_path / "plugin.zip"
+    build_archive(archive)
+    out = tmp_path / "out"
+    (out / "d1").mkdir(parents=True)
+    original = tmp_path / "original.php"
+    original.write_bytes(b"original")
+    (out / "d1/f1.php").symlink_to(original)
+    extract_zip_file(archive, out, "Plugin/")
+    assert original.read_bytes() == b"original"
+    assert (out / "d1/f1.php").read_bytes() == DATA[:1000]
@@ -0,0 +1,49 @@
+import pathlib
+import typing as typ
+
+import pytest
+
+from matomo_dl.bundle import extract_sources
+from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.distribution.customisations import Customisations
+from matomo_dl.distribution.lock import DistributionLockFile
+from matomo_dl.errors import PluginConflictError
+from matomo_dl.session.store import SessionStore
+from .fixtures import make_lock, make_zip, snapshot
+
+
+def lock_plugins(session: SessionStore, plugins: typ.List[str]) -> DistributionLockFile:
+    matomo = make_zip(
+        ["matomo/index.php", "matomo/plugins/CoreHome/plugin.json"],
+        date_time=(2019, 1, 1, 0, 20, 0),
+    )
+    archives = {
+        name: make_zip([f"{name}/plugin.json"], date_time=(2019, 1, 1, 0, minute, 0))
+        for minute, name in enumerate(plugins, start=30)
+    }
+    return make_lock(archives, matomo=matomo, session=session)
+
+
+def test_concurrent_extraction_matches_serial(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "cache", offline=True)
+    lock = lock_plugins(session, [f"Plugin{i}" for i in range(8)])
+    builds = []
+    for jobs in (1, 8):
+        build = BuildInformation(lock, Customisations(), tmp_path / f"build-{jobs}")
+        extract_sources(session, None, build, jobs=jobs)
+        builds.append(build)
+    serial, concurrent = builds
+    assert (serial.folder / "plugins/Plugin7/plugin.json").is_file()
+    assert (serial.folder / "plugins/CoreHome/plugin.json").is_file()
+    assert serial.mtime_clamp == concurrent.mtime_clamp
+    assert snapshot(serial.folder) == snapshot(concurrent.folder)
+
+
+def test_plugins_cannot_replace_core_plugins(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "cache", offline=True)
+    lock = lock_plugins(session, ["Extra", "CoreHome"])
+    build = BuildInformation(lock, Customisations(), tmp_path / "build")
+    with pytest.raises(PluginConflictError) as e:
+        extract_sources(session, None, build)
+    assert "CoreHome" in str(e.value)
+    assert not (tmp_path / "build/plugins").exists()
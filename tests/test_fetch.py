@@ -0,0 +1,49 @@
+import pathlib
+
+import pytest
+
+from matomo_dl.bundle.artifacts import fetch_artifacts
+from matomo_dl.distribution.lock import VersionedPluginLock
+from matomo_dl.errors import DownloadHashMismatch
+from matomo_dl.session.store import SessionStore
+from .fixtures import StaticHandler, make_lock, serve_http, sha256
+
+MATOMO = b"matomo" * 1000
+PLUGINS = {"One": b"one" * 1000, "Two": b"two" * 1000}
+FILES = {
+    "/matomo-3.6.1.zip": MATOMO,
+    **{f"/plugins/{name}/download/1.0": data for name, data in PLUGINS.items()},
+}
+
+
+def test_fetch_downloads_every_missing_artifact(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(StaticHandler, files=FILES) as (url, handler):
+        lock = make_lock(PLUGINS, matomo=MATOMO, url=url)
+        fetched = fetch_artifacts(session, "license", lock, jobs=3)
+        assert sorted(artifact.cache_key for artifact in fetched) == [
+            "matomo-3.6.1-zip",
+            "plugin-one-1.0-zip",
+            "plugin-two-1.0-zip",
+        ]
+        assert len(handler.requests) == 3
+        # Everything is cached now, so a second fetch is a no-op.
+        assert fetch_artifacts(session, "license", lock, jobs=3) == []
+        assert len(handler.requests) == 3
+    for path, data in FILES.items():
+        assert session.blobs.blob_path(sha256(data)).read_bytes() == data
+
+
+def test_fetch_verifies_locked_hashes(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(StaticHandler, files=FILES) as (url, _):
+        lock = make_lock(PLUGINS, matomo=MATOMO, url=url)
+        plugin_lock = lock.plugin_locks["Two"]
+        assert isinstance(plugin_lock, VersionedPluginLock)
+        plugin_lock.hash = sha256(b"something else")
+        with pytest.raises(DownloadHashMismatch):
+            fetch_artifacts(session, "license", lock, jobs=3)
+    assert (
+        session.retrieve_cache_file("plugin-two-1.0-zip", sha256(PLUGINS["Two"]))
+        is None
+    )
@@ -0,0 +1,66 @@
+import hashlib
+import io
+import os
+import pathlib
+
+from matomo_dl import hashing
+from matomo_dl.hashing import (
+    MultiHasher,
+    all_hashes_for_data,
+    all_hashes_for_file,
+    hash_stream,
+)
+from matomo_dl.session.store import SessionStore
+
+DATA = bytes(range(256)) * 10_000
+SHA256 = "sha256:" + hashlib.sha256(DATA).hexdigest()
+BLAKE2B = "blake2b:" + hashlib.blake2b(DATA).hexdigest()
+
+
+def test_every_digest_is_computed_in_one_pass():
+    hasher = MultiHasher(["sha256", "blake2b"])
+    hasher.update_from(io.BytesIO(DATA))
+    assert hasher.all_hash_infos() == [SHA256, BLAKE2B]
+    assert hasher.hash_info("blake2b") == BLAKE2B
+
+
+def test_sources_hash_identically():
+    view = memoryview(DATA)
+    chunks = [view[i : i + 4096] for i in range(0, len(DATA), 4096)]
+    assert hash_stream(io.BytesIO(DATA)) == SHA256
+    assert hash_stream(iter(chunks)) == SHA256
+    assert all_hashes_for_data(DATA) == SHA256
+    assert all_hashes_for_data(DATA, "blake2b") == BLAKE2B
+
+
+def test_file_hashes_are_cached_by_stat(tmp_path: pathlib.Path, monkeypatch):
+    file = tmp_path / "data"
+    file.write_bytes(DATA)
+    calls = []
+    original = hashing.hash_stream
+
+    def counting(*a, **k):
+        calls.append(a)
+        return original(*a, **k)
+
+    monkeypatch.setattr(hashing, "hash_stream", counting)
+    assert all_hashes_for_file(file) == SHA256
+    assert all_hashes_for_file(file) == SHA256
+    assert len(calls) == 1
+    assert all_hashes_for_file(file, cached=False) == SHA256
+    assert len(calls) == 2
+    file.write_bytes(DATA[::-1])
+    os.utime(file, ns=(1, 1))
+    assert all_hashes_for_file(file) != SHA256
+    assert len(calls) == 3
+
+
+def test_blake2b_locks_are_stored_and_verified(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    file, data_hash = session.store_cache_chunks(
+        "matomo-1.0-zip", [DATA], algorithm="blake2b"
+    )
+    assert data_hash == BLAKE2B
+    assert file == session.blobs.blob_path(BLAKE2B)
+    fresh = SessionStore(cache_dir=tmp_path, paranoid=True)
+    assert fresh.retrieve_cache_file("matomo-1.0-zip", BLAKE2B) == file
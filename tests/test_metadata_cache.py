@@ -0,0 +1,67 @@
+import json
+import pathlib
+from http.server import BaseHTTPRequestHandler
+
+from matomo_dl.lock.matomo import get_latest_matomo_version
+from matomo_dl.lock.plugin import versioned
+from matomo_dl.session.store import SessionStore
+from .fixtures import serve_http
+
+
+class RevalidatingHandler(BaseHTTPRequestHandler):
+    body = b"3.6.1"
+    etag = '"v1"'
+
+    def log_message(self, *a):
+        pass
+
+    def respond(self):
+        self.requests.append((self.command, self.path, dict(self.headers)))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("ETag", self.etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_GET = respond
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.respond()
+
+
+def test_unchanged_metadata_is_revalidated(tmp_path: pathlib.Path, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(RevalidatingHandler) as (url, handler):
+        monkeypatch.setattr("matomo_dl.lock.matomo.API_URL", url)
+        assert get_latest_matomo_version(session) == "3.6.1"
+        assert get_latest_matomo_version(session) == "3.6.1"
+        handler.body = b"3.7.0"
+        handler.etag = '"v2"'
+        assert get_latest_matomo_version(session) == "3.7.0"
+    sent_etags = [headers.get("If-None-Match") for _, _, headers in handler.requests]
+    assert sent_etags == [None, '"v1"', '"v1"']
+
+
+def test_plugin_info_is_keyed_by_license(tmp_path: pathlib.Path, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path)
+    info = {"name": "Plugin", "isDownloadable": True, "versions": []}
+    with serve_http(RevalidatingHandler, body=json.dumps(info).encode()) as (
+        url,
+        handler,
+    ):
+        monkeypatch.setattr(versioned, "PLUGIN_API_URL", url)
+        for key in ["license-a", "license-b", "license-a"]:
+            data = versioned.get_plugin_data(session, key, "Plugin")
+            assert data.name == "Plugin"
+            assert data.raw_response.url == f"{url}/api/2.0/plugins/Plugin/info"
+    sent_etags = [headers.get("If-None-Match") for _, _, headers in handler.requests]
+    assert sent_etags == [None, None, '"v1"']
+    stored = "".join(file.read_text() for file in tmp_path.glob("metadata/*"))
+    assert "license-a" not in stored
@@ -0,0 +1,67 @@
+import hashlib
+import pathlib
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from matomo_dl.session.mirror import create_cache_server
+from matomo_dl.session.store import SessionStore
+from .fixtures import StaticHandler, serve_http
+
+DATA = b"matomo" * 100_000
+DATA_HASH = "sha256:" + hashlib.sha256(DATA).hexdigest()
+
+
+@contextmanager
+def serve_cache(session: SessionStore):
+    server = create_cache_server(session.blobs, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_mirror_serves_blobs_by_hash(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    session.store_cache_data("matomo-1.0-zip", DATA)
+    digest = DATA_HASH.partition(":")[2]
+    with serve_cache(session) as mirror:
+        resp = requests.get(f"{mirror}/blobs/sha256/{digest}")
+        assert resp.status_code == 200
+        assert resp.content == DATA
+        assert requests.get(f"{mirror}/blobs/sha256/{'0' * 64}").status_code == 404
+        assert requests.get(f"{mirror}/names/matomo-1.0-zip").status_code == 404
+
+
+def test_upstream_mirror_is_tried_first(tmp_path: pathlib.Path):
+    mirror_session = SessionStore(cache_dir=tmp_path / "mirror")
+    mirror_session.store_cache_data("matomo-1.0-zip", DATA)
+    with serve_cache(mirror_session) as mirror, serve_http(
+        StaticHandler, files={"/matomo.zip": DATA}
+    ) as (url, origin):
+        session = SessionStore(cache_dir=tmp_path / "node", upstream=mirror)
+        file = session.download_cache_file(
+            "matomo-1.0-zip", DATA_HASH, f"{url}/matomo.zip"
+        )
+        assert file.read_bytes() == DATA
+        assert origin.requests == []
+
+
+def test_upstream_mirror_falls_back_to_origin(tmp_path: pathlib.Path):
+    mirror_session = SessionStore(cache_dir=tmp_path / "mirror")
+    with serve_cache(mirror_session) as mirror, serve_http(
+        StaticHandler, files={"/matomo.zip": DATA}
+    ) as (url, origin):
+        session = SessionStore(cache_dir=tmp_path / "node", upstream=mirror)
+        file = session.fetch_cache_file(
+            "matomo-1.0-zip",
+            DATA_HASH,
+            lambda: session.get(f"{url}/matomo.zip", stream=True),
+        )
+        assert file.read_bytes() == DATA
+        assert len(origin.requests) == 1
@@ -0,0 +1,97 @@
+import json
+import os
+import pathlib
+
+import attr
+import pytest
+
+from matomo_dl.bundle import extract_sources
+from matomo_dl.bundle.artifacts import assert_artifacts_cached
+from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.distribution.customisations import Customisations
+from matomo_dl.distribution.lock import VersionedPluginLock
+from matomo_dl.errors import MissingDownloadError, OfflineError
+from matomo_dl.lock.plugin import versioned
+from matomo_dl.session.store import SessionStore
+from .fixtures import StaticHandler, make_lock, make_zip, serve_http
+
+
+def plugin_zip(name: str) -> bytes:
+    return make_zip({f"{name}/plugin.json": b"{}"})
+
+
+def test_offline_session_makes_no_requests(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path, offline=True)
+    with serve_http(StaticHandler, files={"/": b""}) as (url, handler):
+        with pytest.raises(OfflineError):
+            session.get(f"{url}/")
+        with pytest.raises(OfflineError):
+            session.request_metadata("GET", f"{url}/")
+    assert handler.requests == []
+
+
+def test_offline_check_lists_every_missing_artifact(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path, offline=True)
+    lock = make_lock({"Cached": plugin_zip("Cached")}, session=session)
+    missing = VersionedPluginLock(
+        extraction_root="Missing/",
+        version="2.0",
+        link="https://plugins.matomo.org/api/2.0/plugins/Missing/download/2.0",
+        hash="sha256:" + "1" * 64,
+    )
+    lock = attr.evolve(lock, plugin_locks={**lock.plugin_locks, "Missing": missing})
+    with pytest.raises(MissingDownloadError) as e:
+        assert_artifacts_cached(session, lock)
+    assert "matomo-3.6.1-zip" in str(e.value)
+    assert "plugin-missing-2.0-zip" in str(e.value)
+    assert "plugin-cached-1.0-zip" not in str(e.value)
+
+
+def test_offline_plugins_extract_from_cache(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "cache", offline=True)
+    lock = make_lock(
+        {"CustomPlugin": plugin_zip("CustomPlugin")},
+        matomo=plugin_zip("matomo"),
+        session=session,
+    )
+    build = BuildInformation(lock, Customisations(), tmp_path / "build")
+    extract_sources(session, "license", build)
+    assert (tmp_path / "build/plugins/CustomPlugin/plugin.json").read_text() == "{}"
+
+
+def test_plugins_install_under_their_locked_name(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "cache", offline=True)
+    lock = make_lock(
+        {"customplugin": plugin_zip("CustomPlugin")},
+        matomo=plugin_zip("matomo"),
+        session=session,
+    )
+    plugin_lock = lock.plugin_locks["customplugin"]
+    assert isinstance(plugin_lock, VersionedPluginLock)
+    plugin_lock.extraction_root = "CustomPlugin/"
+    plugin_lock.name = "CustomPlugin"
+    build = BuildInformation(lock, Customisations(), tmp_path / "build")
+    extract_sources(session, "license", build)
+    assert os.listdir(str(tmp_path / "build/plugins")) == ["CustomPlugin"]
+
+
+def test_online_and_offline_builds_match(tmp_path: pathlib.Path, monkeypatch):
+    info = {"name": "CustomPlugin", "isDownloadable": True}
+    files = {"/api/2.0/plugins/customplugin/info": json.dumps(info).encode()}
+    trees = []
+    with serve_http(StaticHandler, files=files) as (url, _):
+        monkeypatch.setattr(versioned, "PLUGIN_API_URL", url)
+        for offline in [False, True]:
+            session = SessionStore(cache_dir=tmp_path / "cache", offline=offline)
+            lock = make_lock(
+                {"customplugin": plugin_zip("CustomPlugin")},
+                matomo=plugin_zip("matomo"),
+                session=session,
+            )
+            lock.plugin_locks["customplugin"].extraction_root = "CustomPlugin/"
+            build = BuildInformation(
+                lock, Customisations(), tmp_path / f"build-{offline}"
+            )
+            extract_sources(session, "license", build)
+            trees.append(os.listdir(str(build.folder / "plugins")))
+    assert trees == [["customplugin"], ["customplugin"]]
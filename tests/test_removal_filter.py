@@ -0,0 +1,102 @@
+import pathlib
+
+import pytest
+
+from matomo_dl.bundle import extract_sources
+from matomo_dl.bundle.customisation import remove
+from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.distribution.customisations import Customisations, RemoveCustomisation
+from matomo_dl.distribution.lock import DistributionLockFile
+from matomo_dl.session.store import SessionStore
+from .fixtures import make_lock, make_zip
+
+MATOMO_FILES = [
+    "matomo/",
+    "matomo/index.php",
+    "matomo/README.md",
+    "matomo/composer.json",
+    "matomo/core/Version.php",
+    "matomo/core/CHANGELOG",
+    "matomo/misc/composer/build.sh",
+    "matomo/misc/composer/nested/clean.sh",
+    "matomo/misc/user/index.html",
+    "matomo/misc/user/kept.html",
+    "matomo/docs.md/",
+    "matomo/docs.md/api.php",
+    "matomo/libs/bower_components/jquery-ui/ui/jquery-ui.min.js",
+    "matomo/plugins/ExampleAPI/",
+    "matomo/plugins/ExampleAPI/API.php",
+    "matomo/plugins/ExampleAPI/lang/en.json",
+    "matomo/plugins/CoreHome/plugin.json",
+    "matomo/vendor/twig/twig/ext/twig/twig.c",
+    "matomo/vendor/only-docs/readme.txt",
+    "matomo/vendor/licensed/LICENSE",
+]
+
+
+def lock_archives(session: SessionStore) -> DistributionLockFile:
+    plugin = make_zip(["ExampleUI/plugin.json", "ExampleUI/lang/en.json"])
+    return make_lock(
+        {"ExampleUI": plugin}, matomo=make_zip(MATOMO_FILES), session=session
+    )
+
+
+def build_tree(session, lock, folder: pathlib.Path, filtered: bool):
+    customisations = Customisations(
+        remove=RemoveCustomisation(
+            build_support=True,
+            documentation=True,
+            example_plugins=True,
+            vendored_extras=True,
+        )
+    )
+    build = BuildInformation(
+        lock, customisations if filtered else Customisations(), folder
+    )
+    extract_sources(session, None, build)
+    build.customisations = customisations
+    remove.remove_build_support(build)
+    remove.remove_documentation(build)
+    remove.remove_example_plugins(build)
+    remove.remove_vendored_extras(build)
+    tree = sorted(str(path.relative_to(folder)) for path in folder.rglob("*"))
+    return build.extra_info["removed_files"], tree
+
+
+@pytest.mark.parametrize("tree_cache", [False, True])
+def test_filtered_extraction_matches_removal(tmp_path: pathlib.Path, tree_cache):
+    session = SessionStore(
+        cache_dir=tmp_path / "cache", offline=True, tree_cache=tree_cache
+    )
+    lock = lock_archives(session)
+    expected = build_tree(session, lock, tmp_path / "unfiltered", filtered=False)
+    # With the tree cache, this clones the (unfiltered) cached trees.
+    removed, tree = build_tree(session, lock, tmp_path / "filtered", filtered=True)
+    assert (tmp_path / "cache/trees").exists() == tree_cache
+    assert (removed, tree) == expected
+    assert "plugins/ExampleUI" in removed
+    assert "misc/composer/nested" in removed
+    assert "docs.md/api.php" in removed
+    assert "vendor/only-docs" in tree
+    assert "misc/user/kept.html" in tree
+
+
+@pytest.mark.parametrize("tree_cache", [False, True])
+def test_removed_files_are_never_written(
+    tmp_path: pathlib.Path, monkeypatch, tree_cache
+):
+    session = SessionStore(
+        cache_dir=tmp_path / "cache", offline=True, tree_cache=tree_cache
+    )
+    lock = lock_archives(session)
+    deleted = []
+    original = remove.delete_all_matching
+
+    def counting(*a, **k):
+        for path in original(*a, **k):
+            deleted.append(path)
+            yield path
+
+    monkeypatch.setattr(remove, "delete_all_matching", counting)
+    build_tree(session, lock, tmp_path / "build", filtered=True)
+    assert deleted == []
@@ -0,0 +1,215 @@
+import hashlib
+import pathlib
+import threading
+import typing as typ
+
+import pytest
+
+from matomo_dl.errors import DownloadHashMismatch
+from matomo_dl.session import blobs
+from matomo_dl.session.store import SessionStore
+from .fixtures import StaticHandler, serve_http
+
+DATA = b"matomo" * 500_000
+DATA_HASH = "sha256:" + hashlib.sha256(DATA).hexdigest()
+
+
+def test_store_cache_response_streams_to_cache(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(StaticHandler, files={"/matomo.zip": DATA}) as (url, _):
+        resp = session.get(f"{url}/matomo.zip", stream=True)
+        file, data_hash = session.store_cache_response("matomo-1.0-zip", resp)
+    assert data_hash == DATA_HASH
+    assert file.read_bytes() == DATA
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) == file
+    # No temporary files are left behind.
+    assert list((tmp_path / "tmp").iterdir()) == []
+
+
+def test_retrieve_cache_file_discards_corrupt_data(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    file, _ = session.store_cache_chunks("matomo-1.0-zip", [DATA])
+    file.write_bytes(b"corrupted")
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) is None
+    assert not file.exists()
+
+
+def test_store_without_cache_dir_uses_scratch(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=None)
+    file, data_hash = session.store_cache_chunks("matomo-1.0-zip", [DATA])
+    assert data_hash == DATA_HASH
+    assert file.read_bytes() == DATA
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) is None
+    session.close()
+    assert not file.exists()
+
+
+def test_blobs_are_content_addressed(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    file_a, hash_a = session.store_cache_chunks("plugin-a-1.0-zip", [DATA])
+    file_b, hash_b = session.store_cache_chunks("plugin-b-2.0-zip", [DATA])
+    assert file_a == file_b
+    assert file_a == tmp_path / "blobs/sha256" / DATA_HASH[7:9] / DATA_HASH[7:]
+    assert session.blobs.lookup_name("plugin-a-1.0-zip") == DATA_HASH
+    assert session.blobs.lookup_name("plugin-b-2.0-zip") == DATA_HASH
+    # A lookup under a new key is a path computation on the lock's hash.
+    assert session.retrieve_cache_file("plugin-c-3.0-zip", DATA_HASH) == file_a
+    assert session.blobs.lookup_name("plugin-c-3.0-zip") == DATA_HASH
+
+
+def test_cached_files_follow_the_umask(tmp_path: pathlib.Path, monkeypatch):
+    # The module reads the umask once; so this stands in for a umask of 022.
+    monkeypatch.setattr(blobs, "FILE_MODE", 0o644)
+    session = SessionStore(cache_dir=tmp_path)
+    file, _ = session.store_cache_chunks("matomo-1.0-zip", [DATA])
+    assert file.stat().st_mode & 0o777 == 0o644
+    assert session.blobs.name_path("matomo-1.0-zip").stat().st_mode & 0o777 == 0o644
+
+
+def test_legacy_cache_files_are_imported(tmp_path: pathlib.Path):
+    (tmp_path / "matomo-1.0-zip.dat").write_bytes(DATA)
+    (tmp_path / "matomo-1.0-zip.dat.check").write_text(DATA_HASH)
+    session = SessionStore(cache_dir=tmp_path)
+    file = session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert file == session.blobs.blob_path(DATA_HASH)
+    assert file.read_bytes() == DATA
+    assert not (tmp_path / "matomo-1.0-zip.dat").exists()
+    assert not (tmp_path / "matomo-1.0-zip.dat.check").exists()
+
+
+def count_rehashes(monkeypatch) -> typ.List[pathlib.Path]:
+    calls = []
+    original = blobs.all_hashes_for_file
+
+    def counting(file, *a, **k):
+        calls.append(file)
+        return original(file, *a, **k)
+
+    monkeypatch.setattr(blobs, "all_hashes_for_file", counting)
+    return calls
+
+
+def test_unchanged_blobs_are_trusted(tmp_path: pathlib.Path, monkeypatch):
+    SessionStore(cache_dir=tmp_path).store_cache_chunks("matomo-1.0-zip", [DATA])
+    calls = count_rehashes(monkeypatch)
+    session = SessionStore(cache_dir=tmp_path)
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert calls == []
+
+    paranoid = SessionStore(cache_dir=tmp_path, paranoid=True)
+    assert paranoid.retrieve_cache_file("matomo-1.0-zip", DATA_HASH)
+    assert len(calls) == 1
+
+
+def test_changed_blobs_are_rehashed(tmp_path: pathlib.Path, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path)
+    file, _ = session.store_cache_chunks("matomo-1.0-zip", [DATA])
+    calls = count_rehashes(monkeypatch)
+    # Same size, different content and mtime.
+    file.write_bytes(DATA[::-1])
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) is None
+    assert calls == [file]
+    assert not file.exists()
+
+
+def test_size_mismatch_is_rejected_without_reading(tmp_path: pathlib.Path, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path)
+    file, _ = session.store_cache_chunks("matomo-1.0-zip", [DATA])
+    calls = count_rehashes(monkeypatch)
+    file.write_bytes(DATA[:-1])
+    assert session.retrieve_cache_file("matomo-1.0-zip", DATA_HASH) is None
+    assert calls == []
+    assert not file.exists()
+
+
+def test_evicts_least_recently_used(tmp_path: pathlib.Path, monkeypatch):
+    monkeypatch.setattr(blobs, "EVICTION_GRACE", 0)
+    session = SessionStore(cache_dir=tmp_path, max_size=2500)
+    files = {}
+    for name in ["a", "b", "c", "d"]:
+        files[name] = session.store_cache_chunks(
+            f"plugin-{name}", [name.encode() * 1000]
+        )
+    _, hash_a = files["a"]
+    _, hash_b = files["b"]
+    # Use 'a' so that 'b' becomes the oldest, and keep 'b' as the lock needs it.
+    assert session.retrieve_cache_file("plugin-a", hash_a)
+    assert session.enforce_cache_budget(keep=[hash_b]) == 2000
+    remaining = {name for name, (file, _) in files.items() if file.exists()}
+    assert remaining == {"a", "b"}
+    assert session.blobs.index is not None
+    assert session.blobs.index.total_size() == 2000
+    # Already within budget; nothing else is touched.
+    assert session.enforce_cache_budget(keep=[hash_b]) == 0
+    # Their names go with them.
+    assert session.blobs.lookup_name("plugin-c") is None
+    assert not session.blobs.name_path("plugin-c").exists()
+
+
+def test_eviction_spares_blobs_in_use(tmp_path: pathlib.Path, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path, max_size=0)
+    file_a, _ = session.store_cache_chunks("plugin-a", [b"a" * 1000])
+    file_b, _ = session.store_cache_chunks("plugin-b", [b"b" * 1000])
+    # Both were just used, and might be about to be opened by another build.
+    assert session.enforce_cache_budget() == 0
+    monkeypatch.setattr(blobs, "EVICTION_GRACE", 0)
+    other = SessionStore(cache_dir=tmp_path)
+    with other.cache_lock("plugin-a"):
+        assert session.enforce_cache_budget() == 1000
+    assert file_a.exists()
+    assert not file_b.exists()
+
+
+def test_concurrent_misses_download_once(tmp_path: pathlib.Path):
+    results = []
+
+    def fetch(url):
+        session = SessionStore(cache_dir=tmp_path)
+        file = session.fetch_cache_file(
+            "matomo-1.0-zip",
+            DATA_HASH,
+            lambda: session.get(f"{url}/matomo.zip", stream=True),
+        )
+        results.append(file)
+
+    with serve_http(StaticHandler, files={"/matomo.zip": DATA}) as (url, handler):
+        threads = [threading.Thread(target=fetch, args=(url,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(handler.requests) == 1
+    assert len(results) == 4
+    assert all(file.read_bytes() == DATA for file in results)
+
+
+def test_fetch_rejects_mismatched_download(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(StaticHandler, files={"/matomo.zip": b"not matomo"}) as (url, _):
+        with pytest.raises(DownloadHashMismatch):
+            session.fetch_cache_file(
+                "matomo-1.0-zip",
+                DATA_HASH,
+                lambda: session.get(f"{url}/matomo.zip", stream=True),
+            )
+    assert session.blobs.lookup_name("matomo-1.0-zip") is None
+    assert list((tmp_path / "blobs").glob("*/*/*")) == []
+
+
+def test_metrics_count_hits_misses_and_requests(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path)
+    with serve_http(StaticHandler, files={"/matomo.zip": DATA}) as (url, _):
+        for _ in range(2):
+            session.fetch_cache_file(
+                "matomo-1.0-zip",
+                DATA_HASH,
+                lambda: session.get(f"{url}/matomo.zip", stream=True),
+            )
+    metrics = session.metrics.to_output()
+    assert metrics["cache_hits"] == 1
+    assert metrics["cache_misses"] == 1
+    assert metrics["bytes_downloaded"] == len(DATA)
+    assert metrics["bytes_from_cache"] == len(DATA)
+    assert metrics["requests_by_host"] == {"127.0.0.1": 1}
+    assert "1 hits/1 misses" in session.metrics.summary()
@@ -0,0 +1,114 @@
+import errno
+import os
+import pathlib
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from matomo_dl.bundle import count_folder_for_tar, create_release_tarball, tar_writer
+from matomo_dl.bundle.formats import FORMATS
+from matomo_dl.bundle.info import BuildInformation
+from matomo_dl.bundle.stat import standardise_mode
+from matomo_dl.distribution.customisations import Customisations
+from .fixtures import make_lock
+
+
+def reference_tar_infos(tar: tarfile.TarFile, build, folder: pathlib.Path, base: str):
+    # How release tarballs used to be built; using `TarFile.gettarinfo`.
+    for path in sorted(folder.iterdir()):
+        info = tar.gettarinfo(str(path), f"{base}{path.name}")
+        if not info.isfile() and not info.isdir():
+            continue
+        info.mode = standardise_mode(info.mode, force_exec=info.isdir())
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        info.pax_headers = {}
+        info.mtime = build.clamp_mtime(info.mtime)
+        if info.isfile():
+            yield info, path
+        else:
+            yield info, None
+            yield from reference_tar_infos(tar, build, path, f"{base}{path.name}/")
+
+
+def write_reference_tar(build: BuildInformation, output: pathlib.Path):
+    with tarfile.open(output, mode="w") as tar:
+        for info, path in list(reference_tar_infos(tar, build, build.folder, "")):
+            if path:
+                with path.open("rb") as f:
+                    tar.addfile(info, f)
+            else:
+                tar.addfile(info)
+
+
+@pytest.fixture()
+def build(tmp_path: pathlib.Path) -> BuildInformation:
+    folder = tmp_path / "build"
+    for name in ["core/Plugin", "core/Plugin-Extra", "empty", "B"]:
+        (folder / name).mkdir(parents=True)
+    files = {
+        "index.php": b"<?php",
+        "core/Plugin.php": b"<?php // plugin",
+        "core/Plugin/Manager.php": bytes(range(256)) * 300,
+        "core/Plugin-Extra/a.php": b"",
+        "core/Plugin.b": b"b",
+        "console": b"#!/usr/bin/env php",
+        "B/c.js": b"js",
+        "été.txt": b"unicode",
+        "x" * 120 + ".php": b"long name",
+    }
+    for name, data in files.items():
+        (folder / name).write_bytes(data)
+    (folder / "console").chmod(0o750)
+    (folder / "link.php").symlink_to(folder / "index.php")
+    os.utime(str(folder / "index.php"), (2000000000, 2000000000))
+    return BuildInformation(
+        make_lock({}), Customisations(), folder, mtime_clamp=1546300800
+    )
+
+
+def test_tarball_matches_gettarinfo(tmp_path: pathlib.Path, build):
+    write_reference_tar(build, tmp_path / "reference.tar")
+    create_release_tarball(build, tmp_path / "matomo.tar", FORMATS["tar"])
+    reference = (tmp_path / "reference.tar").read_bytes()
+    assert (tmp_path / "matomo.tar").read_bytes() == reference
+    with tarfile.open(tmp_path / "matomo.tar") as tar:
+        assert "link.php" not in tar.getnames()
+        assert len(tar.getnames()) == count_folder_for_tar(build.folder)
+
+
+@pytest.mark.parametrize("method", [name for name, _ in tar_writer.COPY_METHODS])
+def test_each_copy_method_matches_tarfile(
+    tmp_path: pathlib.Path, build, monkeypatch, method
+):
+    methods = [(n, m) for n, m in tar_writer.COPY_METHODS if n == method]
+    monkeypatch.setattr(tar_writer, "COPY_METHODS", methods)
+    write_reference_tar(build, tmp_path / "reference.tar")
+    create_release_tarball(build, tmp_path / "matomo.tar", FORMATS["tar"])
+    reference = (tmp_path / "reference.tar").read_bytes()
+    assert (tmp_path / "matomo.tar").read_bytes() == reference
+
+
+def test_unsupported_copies_fall_back(tmp_path: pathlib.Path, build, monkeypatch):
+    def unsupported(*a):
+        raise OSError(errno.EXDEV, "Cross-device link")
+
+    methods = [("unsupported", unsupported), *tar_writer.COPY_METHODS]
+    monkeypatch.setattr(tar_writer, "COPY_METHODS", methods)
+    write_reference_tar(build, tmp_path / "reference.tar")
+    read_fd, write_fd = os.pipe()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with os.fdopen(read_fd, "rb") as reader:
+            streamed = pool.submit(reader.read)
+            with os.fdopen(write_fd, "wb") as writer:
+                create_release_tarball(build, writer, FORMATS["tar"])
+            assert streamed.result() == (tmp_path / "reference.tar").read_bytes()
+
+
+def test_truncated_files_are_an_error(tmp_path: pathlib.Path, build):
+    info = tarfile.TarInfo("index.php")
+    info.size = 1000
+    with (tmp_path / "matomo.tar").open("wb") as f:
+        with pytest.raises(OSError, match="unexpected end of data"):
+            tar_writer.TarWriter(f.fileno()).addfile(info, build.folder / "index.php")
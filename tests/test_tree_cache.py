@@ -0,0 +1,96 @@
+import io
+import pathlib
+import zipfile
+
+import pytest
+
+from matomo_dl.bundle import tree_cache
+from matomo_dl.bundle.fs_util import break_link
+from matomo_dl.bundle.tree_cache import TreeCache, extract_archive, get_tree_cache
+from matomo_dl.session.store import SessionStore
+from .fixtures import sha256, snapshot
+
+FILES = {
+    "matomo/index.php": b"<?php // index",
+    "matomo/config/global.ini.php": b"[General]",
+    "matomo/core/Version.php": b"<?php // 3.6.1",
+}
+
+
+@pytest.fixture()
+def archive(tmp_path: pathlib.Path):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as z:
+        for day, (name, content) in enumerate(sorted(FILES.items()), start=1):
+            info = zipfile.ZipInfo(name, (2019, 1, day, 0, 0, 0))
+            info.external_attr = 0o644 << 16
+            z.writestr(info, content)
+    file = tmp_path / "matomo.zip"
+    file.write_bytes(data.getvalue())
+    return file, sha256(data.getvalue())
+
+
+def test_extracted_trees_are_reused(tmp_path: pathlib.Path, archive, monkeypatch):
+    session = SessionStore(cache_dir=tmp_path / "cache", tree_cache=True)
+    file, file_hash = archive
+    first = extract_archive(session, file, file_hash, tmp_path / "one", "matomo/")
+
+    def fail(*a, **k):
+        raise AssertionError("Should have been served from the tree cache")
+
+    monkeypatch.setattr(tree_cache, "extract_zip_file", fail)
+    second = extract_archive(session, file, file_hash, tmp_path / "two", "matomo/")
+    assert first == second
+    assert snapshot(tmp_path / "one") == snapshot(tmp_path / "two")
+    assert len([p for p in (tmp_path / "two").rglob("*") if p.is_file()]) == len(FILES)
+
+
+def test_cached_trees_match_plain_extraction(tmp_path: pathlib.Path, archive):
+    file, file_hash = archive
+    plain = SessionStore(cache_dir=None)
+    cached = SessionStore(cache_dir=tmp_path / "cache", tree_cache=True)
+    plain_mtime = extract_archive(plain, file, file_hash, tmp_path / "plain", "matomo/")
+    for target in ["first", "second"]:
+        mtime = extract_archive(cached, file, file_hash, tmp_path / target, "matomo/")
+        assert mtime == plain_mtime
+        assert snapshot(tmp_path / target) == snapshot(tmp_path / "plain")
+
+
+def test_modifying_a_build_leaves_the_tree_cache_alone(tmp_path: pathlib.Path, archive):
+    session = SessionStore(cache_dir=tmp_path / "cache", tree_cache=True)
+    file, file_hash = archive
+    extract_archive(session, file, file_hash, tmp_path / "build", "matomo/")
+    config = tmp_path / "build/config/global.ini.php"
+    break_link(config)
+    config.write_text("[Changed]")
+    trees = get_tree_cache(session)
+    assert trees is not None
+    cached = trees.lookup(file_hash, "matomo/")
+    assert cached is not None
+    tree, _ = cached
+    assert (tree / "config/global.ini.php").read_bytes() == b"[General]"
+
+
+def test_paranoid_sessions_skip_the_tree_cache(tmp_path: pathlib.Path):
+    session = SessionStore(cache_dir=tmp_path / "cache", paranoid=True, tree_cache=True)
+    assert get_tree_cache(session) is None
+
+
+def test_the_tree_cache_is_opt_in(tmp_path: pathlib.Path, archive):
+    session = SessionStore(cache_dir=tmp_path / "cache")
+    assert get_tree_cache(session) is None
+    file, file_hash = archive
+    extract_archive(session, file, file_hash, tmp_path / "build", "matomo/")
+    assert not (tmp_path / "cache/trees").exists()
+
+
+def test_tree_usage_and_pruning(tmp_path: pathlib.Path, archive):
+    session = SessionStore(cache_dir=tmp_path / "cache", tree_cache=True)
+    file, file_hash = archive
+    extract_archive(session, file, file_hash, tmp_path / "build", "matomo/")
+    assert session.cache_blobs is not None
+    trees = TreeCache.for_blobs(session.cache_blobs)
+    assert trees.usage() == (1, sum(map(len, FILES.values())) + len("1546560000"))
+    assert trees.prune({file_hash}) == 0
+    assert trees.prune(set()) == 1
+    assert trees.usage() == (0, 0)